@@ -0,0 +1,8 @@
+"""Benchmarks of the read and write paths against disposable databases.
+
+Run them with ``dbp bench`` (see ``dbp bench --help``).
+"""
+
+from .suite import Benchmark, compare, load, run_mongo, run_sql, save
+
+__all__ = ["Benchmark", "compare", "load", "run_mongo", "run_sql", "save"]
@@ -0,0 +1,502 @@
+"""
+Synthetic ZTF-like alert data for benchmarks and load tests.
+
+:class:`SyntheticAlerts` generates objects with their detections, forced
+photometry, non-detections and probabilities in batches of columns (numpy
+arrays), so millions of records can be streamed to the bulk loaders without
+keeping them in memory. Each batch is seeded independently from the seed and
+its number, so the same records are produced again for each backend (or any
+single batch on its own).
+
+The records are consistent with each other:
+
+- ``aid`` and ``oid`` of the light curves match their object, and the position,
+  ``ndet``, ``firstmjd`` and ``lastmjd`` of the objects match their detections
+- ``mjd`` increases along each light curve: non-detections, then forced
+  photometry (the history before the first alert), then detections
+- ``candid`` is unique among detections and forced photometry
+- ``ranking`` follows the order of the probabilities of each object
+
+.. code-block:: python
+
+    from db_plugins.bench.data import SyntheticAlerts
+
+    alerts = SyntheticAlerts(1000000, seed=0)
+    mongo_conn.query(model=Detection).bulk_insert(
+        alerts.mongo_documents("detection"), chunk_size=10000, return_ids=False
+    )
+    sql_conn.copy_insert(SQLDetection, alerts.sql_rows("detection"))
+"""
+
+import math
+import string
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, it's only needed for synthetic data
+    np = None
+
+CLASSIFIER = "lc_classifier"
+CLASSIFIER_VERSION = "1.0.0"
+CLASSES = [
+    "SNIa",
+    "SNIbc",
+    "SNII",
+    "SLSN",
+    "QSO",
+    "AGN",
+    "Blazar",
+    "CV/Nova",
+    "YSO",
+    "LPV",
+    "E",
+    "DSCT",
+    "RRL",
+    "CEP",
+    "Periodic-Other",
+]
+FIELD_CENTER = (150.0, 2.0)  # ra, dec in degrees
+FIELD_SIZE = 10.0  # degrees
+FIRST_MJD = 58300.0
+CANDID_OFFSET = 1000000000000000000
+MAX_EPOCHS = 1000  # per object, so candid = offset + object * MAX_EPOCHS + epoch
+
+
+def _names(prefix: str, indices):
+    """Get ZTF-like names, e.g., ``ZTF20aaaaaab`` for index 1."""
+    digits = (indices[:, None] // 26 ** np.arange(6, -1, -1)) % 26
+    letters = np.array(list(string.ascii_lowercase))[digits]
+    return [prefix + "".join(row) for row in letters]
+
+
+def _rows(columns: dict):
+    """Convert columns (arrays or lists) to a list of dictionaries."""
+    keys = list(columns)
+    values = [
+        column.tolist() if hasattr(column, "tolist") else column
+        for column in columns.values()
+    ]
+    return [dict(zip(keys, row)) for row in zip(*values)]
+
+
+class Batch:
+    """Records of consecutive objects, as columns.
+
+    Attributes
+    ----------
+    objects : dict[str, numpy.ndarray]
+        Columns of the objects (``aid`` and ``oid`` are lists)
+    detections, forced_photometry, non_detections : dict[str, numpy.ndarray]
+        Columns of the light curves. The ``object`` column is the position of
+        the object in the batch
+    probabilities : numpy.ndarray
+        Probabilities of each object (rows) for each class (columns)
+        of ``CLASSIFIER``, in the same order as ``CLASSES``
+    ranking : numpy.ndarray
+        Ranking (starting at 1) of each probability within its object
+    """
+
+    def __init__(
+        self,
+        objects,
+        detections,
+        forced_photometry,
+        non_detections,
+        probabilities,
+        ranking,
+    ):
+        self.objects = objects
+        self.detections = detections
+        self.forced_photometry = forced_photometry
+        self.non_detections = non_detections
+        self.probabilities = probabilities
+        self.ranking = ranking
+
+    def __len__(self):
+        return len(self.objects["oid"])
+
+    def _object_names(self, columns):
+        index = columns["object"]
+        aid, oid = self.objects["aid"], self.objects["oid"]
+        return [aid[i] for i in index.tolist()], [oid[i] for i in index.tolist()]
+
+    def ranked_probabilities(self):
+        """Get the probabilities of each object, as in ``Object.probabilities``."""
+        classes = np.asarray(CLASSES, dtype=object)
+        order = np.argsort(self.ranking, axis=1)
+        probabilities = np.take_along_axis(self.probabilities, order, axis=1)
+        return [
+            [
+                {
+                    "classifier_name": CLASSIFIER,
+                    "classifier_version": CLASSIFIER_VERSION,
+                    "class_name": class_name,
+                    "probability": probability,
+                    "ranking": ranking,
+                }
+                for ranking, (class_name, probability) in enumerate(zip(names, row), 1)
+            ]
+            for names, row in zip(classes[order].tolist(), probabilities.tolist())
+        ]
+
+    def mongo_columns(self, table: str):
+        """Get the records of a Mongo model as columns.
+
+        Parameters
+        ----------
+        table : str
+            Collection of the model (``object``, ``detection``,
+            ``forced_photometry`` or ``non_detection``). Probabilities are part
+            of the objects
+
+        Returns
+        -------
+        dict[str, list]
+            Column-oriented mapping accepted by ``BaseModel.from_records`` and
+            ``MongoQuery.bulk_insert``
+        """
+        n = len(self)
+        if table == "object":
+            objects = self.objects
+            return {
+                "aid": objects["aid"],
+                "oid": [[oid] for oid in objects["oid"]],
+                "tid": [["ztf"] for _ in range(n)],
+                "sid": [["ztf"] for _ in range(n)],
+                "corrected": [False] * n,
+                "stellar": [False] * n,
+                "firstmjd": objects["firstmjd"].tolist(),
+                "lastmjd": objects["lastmjd"].tolist(),
+                "ndet": objects["ndet"].tolist(),
+                "meanra": objects["meanra"].tolist(),
+                "sigmara": objects["sigmara"].tolist(),
+                "meandec": objects["meandec"].tolist(),
+                "sigmadec": objects["sigmadec"].tolist(),
+                "probabilities": self.ranked_probabilities(),
+            }
+        if table == "non_detection":
+            columns = self.non_detections
+            aid, oid = self._object_names(columns)
+            mjd, fid = columns["mjd"].tolist(), columns["fid"].tolist()
+            m = len(mjd)
+            return {
+                "_id": [f"{o}_{f}_{t}" for o, f, t in zip(oid, fid, mjd)],
+                "aid": aid,
+                "tid": ["ztf"] * m,
+                "sid": ["ztf"] * m,
+                "oid": oid,
+                "mjd": mjd,
+                "fid": fid,
+                "diffmaglim": columns["diffmaglim"].tolist(),
+            }
+        if table in ("detection", "forced_photometry"):
+            if table == "detection":
+                columns = self.detections
+            else:
+                columns = self.forced_photometry
+            aid, oid = self._object_names(columns)
+            m = len(aid)
+            return {
+                "candid": columns["candid"].tolist(),
+                "tid": ["ztf"] * m,
+                "sid": ["ztf"] * m,
+                "aid": aid,
+                "oid": oid,
+                "mjd": columns["mjd"].tolist(),
+                "fid": columns["fid"].tolist(),
+                "ra": columns["ra"].tolist(),
+                "e_ra": [0.1] * m,
+                "dec": columns["dec"].tolist(),
+                "e_dec": [0.1] * m,
+                "mag": columns["mag"].tolist(),
+                "e_mag": columns["e_mag"].tolist(),
+                "mag_corr": [None] * m,
+                "e_mag_corr": [None] * m,
+                "e_mag_corr_ext": [None] * m,
+                "isdiffpos": columns["isdiffpos"].tolist(),
+                "corrected": [False] * m,
+                "dubious": [False] * m,
+                "parent_candid": [None] * m,
+                "has_stamp": [table == "detection"] * m,
+            }
+        raise ValueError(f"There is no Mongo model for {table}")
+
+    def sql_rows(self, table: str):
+        """Get the rows of a SQL model.
+
+        Parameters
+        ----------
+        table : str
+            Table of the model (``object``, ``detection``, ``non_detection``
+            or ``probability``). There is no SQL model for forced photometry
+
+        Returns
+        -------
+        list[dict]
+            Rows accepted by ``SQLQuery.bulk_insert``, ``copy_insert`` and
+            ``bulk_upsert``
+        """
+        if table == "object":
+            columns = {
+                key: self.objects[key]
+                for key in [
+                    "oid",
+                    "ndet",
+                    "meanra",
+                    "meandec",
+                    "sigmara",
+                    "sigmadec",
+                    "firstmjd",
+                    "lastmjd",
+                ]
+            }
+            columns["corrected"] = columns["stellar"] = [False] * len(self)
+            return _rows(columns)
+        if table == "detection":
+            columns = self.detections
+            _, oid = self._object_names(columns)
+            m = len(oid)
+            return _rows(
+                {
+                    "candid": columns["candid"],
+                    "oid": oid,
+                    "mjd": columns["mjd"],
+                    "fid": columns["fid"],
+                    "pid": columns["candid"] // 1000,
+                    "isdiffpos": columns["isdiffpos"],
+                    "ra": columns["ra"],
+                    "dec": columns["dec"],
+                    "magpsf": columns["mag"],
+                    "sigmapsf": columns["e_mag"],
+                    "corrected": [False] * m,
+                    "dubious": [False] * m,
+                    "has_stamp": [True] * m,
+                    "step_id_corr": ["bench"] * m,
+                }
+            )
+        if table == "non_detection":
+            columns = self.non_detections
+            _, oid = self._object_names(columns)
+            return _rows(
+                {
+                    "oid": oid,
+                    "fid": columns["fid"],
+                    "mjd": columns["mjd"],
+                    "diffmaglim": columns["diffmaglim"],
+                }
+            )
+        if table == "probability":
+            m = len(CLASSES) * len(self)
+            return _rows(
+                {
+                    "oid": np.repeat(np.asarray(self.objects["oid"]), len(CLASSES)),
+                    "class_name": np.tile(np.asarray(CLASSES), len(self)),
+                    "classifier_name": [CLASSIFIER] * m,
+                    "classifier_version": [CLASSIFIER_VERSION] * m,
+                    "probability": self.probabilities.ravel(),
+                    "ranking": self.ranking.ravel(),
+                }
+            )
+        raise ValueError(f"There is no SQL model for {table}")
+
+
+class SyntheticAlerts:
+    """Seeded generator of consistent alert records in batches.
+
+    Parameters
+    ----------
+    n_objects : int
+        Number of objects
+    seed : int
+        Seed of the random generator
+    batch_size : int
+        Number of objects per batch
+    detections : int
+        Mean number of detections per object (at least one each)
+    forced_photometry : int
+        Mean number of forced photometry epochs per object
+    non_detections : int
+        Mean number of non-detections per object
+    """
+
+    def __init__(
+        self,
+        n_objects: int,
+        seed: int = 0,
+        batch_size: int = 10000,
+        detections: int = 10,
+        forced_photometry: int = 5,
+        non_detections: int = 5,
+    ):
+        if np is None:
+            raise ImportError(
+                "numpy is required for synthetic data, "
+                "install it with 'pip install db-plugins[numpy]'"
+            )
+        self.n_objects = n_objects
+        self.seed = seed
+        self.batch_size = batch_size
+        self.detections = detections
+        self.forced_photometry = forced_photometry
+        self.non_detections = non_detections
+
+    def __len__(self):
+        """Get the number of batches."""
+        return math.ceil(self.n_objects / self.batch_size)
+
+    def __iter__(self):
+        for number in range(len(self)):
+            yield self.batch(number)
+
+    def batch(self, number: int):
+        """Generate a single batch.
+
+        Parameters
+        ----------
+        number : int
+            Position of the batch, starting at 0
+
+        Returns
+        -------
+        Batch
+            Records of the objects from ``number * batch_size`` onwards
+        """
+        rng = np.random.default_rng([self.seed, number])
+        start = number * self.batch_size
+        index = np.arange(start, min(start + self.batch_size, self.n_objects))
+        n = len(index)
+        limit = MAX_EPOCHS // 3
+
+        # Light curves: non-detections, forced photometry and then detections
+        counts = np.stack(
+            [
+                rng.poisson(self.non_detections, n),
+                rng.poisson(self.forced_photometry, n),
+                1 + rng.poisson(max(self.detections - 1, 0), n),
+            ]
+        ).clip(max=limit)
+        epochs = counts.sum(axis=0)
+        first = np.cumsum(epochs) - epochs
+        obj = np.repeat(np.arange(n), epochs)
+        epoch = np.arange(epochs.sum()) - first[obj]
+        gaps = rng.exponential(3.0, len(obj))
+        cumulative = np.cumsum(gaps)
+        mjd = FIRST_MJD + rng.uniform(0, 1000, n)[obj] + cumulative
+        mjd -= np.concatenate([[0.0], cumulative])[first][obj]
+
+        ra0, dec0 = FIELD_CENTER
+        width = FIELD_SIZE / math.cos(math.radians(dec0))
+        ra = ra0 + (rng.random(n) - 0.5) * width
+        dec = dec0 + (rng.random(n) - 0.5) * FIELD_SIZE
+        base_mag = rng.uniform(16, 20, n)
+
+        columns = {
+            "object": obj,
+            "candid": CANDID_OFFSET + index[obj] * MAX_EPOCHS + epoch,
+            "mjd": mjd,
+            "fid": rng.integers(1, 3, len(obj)),
+            "ra": ra[obj] + rng.normal(0, 1e-5, len(obj)),
+            "dec": dec[obj] + rng.normal(0, 1e-5, len(obj)),
+            "mag": base_mag[obj] + rng.normal(0, 0.2, len(obj)),
+            "e_mag": rng.uniform(0.01, 0.2, len(obj)),
+            "isdiffpos": np.where(rng.random(len(obj)) < 0.9, 1, -1),
+            "diffmaglim": rng.normal(20, 0.5, len(obj)),
+        }
+        kind = np.select(
+            [epoch < counts[0][obj], epoch < (counts[0] + counts[1])[obj]], [0, 1], 2
+        )
+
+        def select(mask, keys):
+            return {key: columns[key][mask] for key in keys}
+
+        lightcurve = ["object", "candid", "mjd", "fid", "ra", "dec", "mag", "e_mag"]
+        non_detections = select(kind == 0, ["object", "mjd", "fid", "diffmaglim"])
+        forced_photometry = select(kind == 1, lightcurve + ["isdiffpos"])
+        detections = select(kind == 2, lightcurve + ["isdiffpos"])
+
+        det_obj = detections["object"]
+        ndet = counts[2]
+        objects = {
+            "aid": _names("AL20", index),
+            "oid": _names("ZTF20", index),
+            "ndet": ndet,
+            "meanra": np.bincount(det_obj, detections["ra"], n) / ndet,
+            "meandec": np.bincount(det_obj, detections["dec"], n) / ndet,
+            "sigmara": np.full(n, 0.1),
+            "sigmadec": np.full(n, 0.1),
+            # Detections are sorted by mjd within each object
+            "firstmjd": detections["mjd"][np.cumsum(ndet) - ndet],
+            "lastmjd": detections["mjd"][np.cumsum(ndet) - 1],
+        }
+        probabilities = rng.dirichlet(np.ones(len(CLASSES)), n)
+        order = np.argsort(-probabilities, axis=1, kind="stable")
+        ranking = np.empty_like(order)
+        np.put_along_axis(ranking, order, np.arange(1, len(CLASSES) + 1), axis=1)
+        return Batch(
+            objects,
+            detections,
+            forced_photometry,
+            non_detections,
+            probabilities,
+            ranking,
+        )
+
+    def mongo_documents(self, table: str):
+        """Lazily generate the records of a Mongo model, batch by batch.
+
+        See :meth:`Batch.mongo_columns` for the tables.
+
+        Yields
+        ------
+        dict
+            Records accepted by ``MongoQuery.bulk_insert`` with a `chunk_size`
+        """
+        for batch in self:
+            columns = batch.mongo_columns(table)
+            keys = list(columns)
+            for row in zip(*columns.values()):
+                yield dict(zip(keys, row))
+
+    def sql_rows(self, table: str):
+        """Lazily generate the rows of a SQL model, batch by batch.
+
+        See :meth:`Batch.sql_rows` for the tables.
+
+        Yields
+        ------
+        dict
+            Rows accepted by ``copy_insert`` and ``bulk_upsert``
+        """
+        for batch in self:
+            yield from batch.sql_rows(table)
+
+
+def cones(n: int, seed: int = 0, centers: list = None):
+    """Centers of cone searches in the field of the objects.
+
+    Parameters
+    ----------
+    n : int
+        Number of cones
+    seed : int
+        Seed of the random generator
+    centers : list[tuple[float, float]], optional
+        Positions of objects. If given, half of the cones are centered on
+        them, so they have matches
+
+    Returns
+    -------
+    list[tuple[float, float]]
+        Right ascension and declination of each cone
+    """
+    rng = np.random.default_rng(seed)
+    ra0, dec0 = FIELD_CENTER
+    width = FIELD_SIZE / math.cos(math.radians(dec0))
+    ra = ra0 + (rng.random(n) - 0.5) * width
+    dec = dec0 + (rng.random(n) - 0.5) * FIELD_SIZE
+    positions = list(zip(ra.tolist(), dec.tolist()))
+    if centers:
+        choices = rng.integers(0, len(centers), n)
+        for i in range(0, n, 2):
+            positions[i] = tuple(centers[choices[i]])
+    return positions
@@ -0,0 +1,293 @@
+"""
+Benchmarks of the core read and write paths of both backends.
+
+Each benchmark is timed once with the synthetic records of
+:mod:`db_plugins.bench.data`, and the results are collected in a report that
+can be saved as JSON and compared with the report of another run.
+"""
+
+import contextlib
+import datetime
+import json
+import platform
+import time
+from itertools import islice
+
+import db_plugins
+from . import data
+
+READ_REPEATS = 100  # pages or cones timed by the read benchmarks
+
+
+class Benchmark:
+    """Collects the timings of a run.
+
+    Parameters
+    ----------
+    scale : int
+        Number of objects
+    seed : int
+        Seed of the synthetic records
+    """
+
+    def __init__(self, scale: int, seed: int = 0):
+        self.scale = scale
+        self.seed = seed
+        self.results = []
+
+    @contextlib.contextmanager
+    def timer(self, backend: str, name: str, documents: int = None):
+        """Time the block and add it to the results.
+
+        The number of `documents` can also be set (or corrected) by the block,
+        by updating the ``documents`` key of the yielded result.
+        """
+        result = {"backend": backend, "name": name, "documents": documents}
+        start = time.perf_counter()
+        yield result
+        result["seconds"] = time.perf_counter() - start
+        if result["documents"] and result["seconds"] > 0:
+            result["rate"] = result["documents"] / result["seconds"]
+        else:
+            result["rate"] = None
+        self.results.append(result)
+
+    def report(self):
+        """Get the results and the context of the run as a dictionary."""
+        return {
+            "version": db_plugins.__version__,
+            "python": platform.python_version(),
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "scale": self.scale,
+            "seed": self.seed,
+            "results": self.results,
+        }
+
+
+def _cones(alerts):
+    objects = alerts.batch(0).objects
+    centers = zip(objects["meanra"].tolist(), objects["meandec"].tolist())
+    return data.cones(READ_REPEATS, alerts.seed, list(islice(centers, READ_REPEATS)))
+
+
+def run_mongo(benchmark: Benchmark, connection, radius: float = 2.0):
+    """Run the MongoDB benchmarks.
+
+    The database of the connection must be empty, since the collections of
+    the models are created (with their indexes) and dropped at the end.
+
+    Parameters
+    ----------
+    benchmark : Benchmark
+        Collects the results
+    connection : db_plugins.db.mongo.connection.MongoConnection
+        Connected to a disposable database
+    radius : float
+        Radius of the cone searches in arcseconds
+    """
+    from db_plugins.db.mongo import models
+    from db_plugins.db.mongo.helpers.update_probs import (
+        create_or_update_probabilities_matrix,
+    )
+
+    if connection.database.list_collection_names():
+        raise ValueError(f"Database {connection.database.name} is not empty")
+    scale = benchmark.scale
+    alerts = data.SyntheticAlerts(scale, benchmark.seed)
+    connection.create_db()
+    try:
+        for model in [
+            models.Object,
+            models.Detection,
+            models.ForcedPhotometry,
+            models.NonDetection,
+        ]:
+            name = f"bulk_insert.{model.__tablename__}"
+            with benchmark.timer("mongo", name) as result:
+                result["documents"] = connection.query(model=model).bulk_insert(
+                    alerts.mongo_documents(model.__tablename__),
+                    chunk_size=10000,
+                    return_ids=False,
+                )
+
+        instances = list(models.Object.from_records(alerts.mongo_documents("object")))
+        aids = [instance["_id"] for instance in instances]
+        attrs = [{"ndet": i % 100, "stellar": True} for i in range(scale)]
+        with benchmark.timer("mongo", "bulk_update.object", scale):
+            connection.query().bulk_update(
+                instances, attrs, filter_fields=[{"_id": aid} for aid in aids]
+            )
+        del instances
+
+        # New probabilities of the same classifier, replacing the inserted ones
+        probabilities = [
+            row
+            for batch in data.SyntheticAlerts(scale, benchmark.seed + 1)
+            for row in batch.probabilities.tolist()
+        ]
+        for server_side in [False, True]:
+            name = "update_probabilities" + (".server_side" if server_side else "")
+            with benchmark.timer("mongo", name, scale):
+                create_or_update_probabilities_matrix(
+                    connection,
+                    data.CLASSIFIER,
+                    data.CLASSIFIER_VERSION,
+                    aids,
+                    data.CLASSES,
+                    probabilities,
+                    server_side=server_side,
+                )
+
+        query = connection.query(model=models.Object)
+        per_page = 100
+        last_page = max(scale // per_page - READ_REPEATS, 1)
+        with benchmark.timer("mongo", "paginate.offset", READ_REPEATS):
+            for page in range(last_page, last_page + READ_REPEATS):
+                query.paginate({}, page=page, per_page=per_page, count=False)
+        cursor = None
+        for _ in range(last_page - 1):  # Skip to the same depth without timing
+            cursor = query.paginate(
+                {}, per_page=per_page, count=False, sort_by="firstmjd", cursor=cursor
+            ).next_cursor
+        with benchmark.timer("mongo", "paginate.keyset", READ_REPEATS):
+            for _ in range(READ_REPEATS):
+                cursor = query.paginate(
+                    {},
+                    per_page=per_page,
+                    count=False,
+                    sort_by="firstmjd",
+                    cursor=cursor,
+                ).next_cursor
+
+        cones = _cones(alerts)
+        for use_healpix in [False, True]:
+            index = "healpix" if use_healpix else "2dsphere"
+            with benchmark.timer("mongo", f"cone_search.{index}", len(cones)):
+                for ra, dec in cones:
+                    query.cone_search(ra, dec, radius, use_healpix=use_healpix)
+            with benchmark.timer("mongo", f"cone_search_many.{index}", len(cones)):
+                query.cone_search_many(cones, radius, use_healpix=use_healpix)
+    finally:
+        connection.drop_db()
+
+
+def run_sql(benchmark: Benchmark, connection, radius: float = 2.0):
+    """Run the PostgreSQL benchmarks.
+
+    The ``object``, ``detection``, ``non_detection`` and ``probability``
+    tables are created and dropped at the end, so the database must not
+    already have them.
+
+    Parameters
+    ----------
+    benchmark : Benchmark
+        Collects the results
+    connection : db_plugins.db.sql.connection.SQLConnection
+        Connected to a disposable database
+    radius : float
+        Radius of the cone searches in arcseconds
+    """
+    from db_plugins.db.sql import models
+
+    tables = [
+        models.Object.__table__,
+        models.Detection.__table__,
+        models.NonDetection.__table__,
+        models.Probability.__table__,
+    ]
+    scale = benchmark.scale
+    alerts = data.SyntheticAlerts(scale, benchmark.seed)
+    # Fails instead of dropping existing tables at the end
+    models.Base.metadata.create_all(connection.engine, tables, checkfirst=False)
+    try:
+        with benchmark.timer("sql", "bulk_insert.object", scale):
+            for batch in alerts:
+                connection.query(models.Object).bulk_insert(batch.sql_rows("object"))
+            connection.session.commit()
+        for model in [models.Detection, models.NonDetection]:
+            name = f"copy_insert.{model.__tablename__}"
+            with benchmark.timer("sql", name) as result:
+                result["documents"] = connection.copy_insert(
+                    model, alerts.sql_rows(model.__tablename__)
+                )
+
+        updates = (
+            {"oid": row["oid"], "ndet": i % 100, "stellar": True}
+            for i, row in enumerate(alerts.sql_rows("object"))
+        )
+        with benchmark.timer("sql", "bulk_upsert.object", scale):
+            connection.bulk_upsert(models.Object, updates)
+        with benchmark.timer("sql", "bulk_upsert.probability") as result:
+            result["documents"] = connection.bulk_upsert(
+                models.Probability, alerts.sql_rows("probability")
+            )
+
+        per_page = 100
+        last_page = max(scale // per_page - READ_REPEATS, 1)
+        with benchmark.timer("sql", "paginate.offset", READ_REPEATS):
+            for page in range(last_page, last_page + READ_REPEATS):
+                connection.query(models.Object).paginate(
+                    page=page, per_page=per_page, count=False
+                )
+        query = connection.query(models.Object)
+        cursor = None
+        for _ in range(last_page - 1):  # Skip to the same depth without timing
+            cursor = query.paginate(
+                per_page=per_page, count=False, sort_by="firstmjd", cursor=cursor
+            ).next_cursor
+        with benchmark.timer("sql", "paginate.keyset", READ_REPEATS):
+            for _ in range(READ_REPEATS):
+                cursor = query.paginate(
+                    per_page=per_page, count=False, sort_by="firstmjd", cursor=cursor
+                ).next_cursor
+
+        cones = _cones(alerts)
+        for use_healpix in [False, True]:
+            index = "healpix" if use_healpix else "meandec"
+            with benchmark.timer("sql", f"cone_search.{index}", len(cones)):
+                for ra, dec in cones:
+                    query.cone_search(ra, dec, radius, use_healpix=use_healpix).all()
+    finally:
+        connection.session.rollback()
+        models.Base.metadata.drop_all(connection.engine, tables)
+
+
+def save(report: dict, path: str):
+    """Write a report as JSON."""
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2)
+
+
+def load(path: str):
+    """Read a report written by :func:`save`."""
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare(baseline: dict, report: dict):
+    """Compare the timings of two reports.
+
+    Returns
+    -------
+    list[dict]
+        For each benchmark in both reports, its ``backend`` and ``name``, the
+        ``seconds`` of both runs (``baseline`` and ``current``) and their
+        ``ratio`` (above 1 means that the current run is slower)
+    """
+    previous = {(r["backend"], r["name"]): r for r in baseline["results"]}
+    comparison = []
+    for result in report["results"]:
+        key = (result["backend"], result["name"])
+        if key not in previous:
+            continue
+        seconds = previous[key]["seconds"]
+        comparison.append(
+            {
+                "backend": result["backend"],
+                "name": result["name"],
+                "baseline": seconds,
+                "current": result["seconds"],
+                "ratio": result["seconds"] / seconds if seconds else None,
+            }
+        )
+    return comparison
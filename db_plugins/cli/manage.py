@@ -7,6 +7,8 @@ from db_plugins.db.sql.initialization import migrate as migrate_sql
 from db_plugins.db.mongo.initialization import (
     init_mongo_database as init_mongo,
 )
+from db_plugins.db.mongo.connection import MongoConnection
+from db_plugins.db.sql.connection import SQLConnection
 import importlib
 
 
@@ -72,3 +74,94 @@ def migrate(settings_path):
     else:
         print("ERROR", DB_CONFIG)
         raise Exception("Invalid settings file")
+
+
+@cli.command()
+@click.option(
+    "--settings_path",
+    default=None,
+    help="settings.py path. If not given, the docker services of the "
+    "integration tests are used (run from the root of the repository)",
+)
+@click.option("--scale", default=10000, show_default=True, help="Number of objects")
+@click.option("--seed", default=0, show_default=True, help="Seed of the records")
+@click.option(
+    "--backend",
+    "backends",
+    multiple=True,
+    type=click.Choice(["mongo", "sql"]),
+    default=["mongo", "sql"],
+    show_default=True,
+    help="Backend to benchmark (can be repeated)",
+)
+@click.option(
+    "--output", default="bench.json", show_default=True, help="JSON results path"
+)
+@click.option(
+    "--compare", "baseline", default=None, help="JSON results of a previous run"
+)
+def bench(settings_path, scale, seed, backends, output, baseline):
+    """Time the read and write paths with synthetic records.
+
+    The databases must be disposable: the collections and tables are created
+    and dropped, and the benchmarks refuse to run if they already exist.
+    """
+    from db_plugins import bench as benchmarks
+
+    if settings_path is None:
+        _run_docker_bench(scale, seed, backends, output)
+    else:
+        if not os.path.exists(settings_path):
+            raise Exception("Settings file not found")
+        sys.path.append(os.path.dirname(os.path.expanduser(settings_path + "/")))
+        settings = importlib.import_module("settings")
+        DB_CONFIG = settings.DB_CONFIG
+        del sys.modules["settings"]
+        sys.path.pop(-1)
+        benchmark = benchmarks.Benchmark(scale, seed)
+        if "mongo" in backends and "MONGO" in DB_CONFIG:
+            connection = MongoConnection()
+            connection.connect(DB_CONFIG["MONGO"])
+            benchmarks.run_mongo(benchmark, connection)
+        if "sql" in backends and "SQL" in DB_CONFIG:
+            connection = SQLConnection()
+            connection.connect(DB_CONFIG["SQL"])
+            try:
+                benchmarks.run_sql(benchmark, connection)
+            finally:
+                connection.end_session()
+                connection.dispose()
+        benchmarks.save(benchmark.report(), output)
+
+    report = benchmarks.load(output)
+    for result in report["results"]:
+        rate = f"{result['rate']:.0f}/s" if result["rate"] else ""
+        click.echo(
+            f"{result['backend']:6} {result['name']:32} "
+            f"{result['seconds']:10.3f} s {rate:>12}"
+        )
+    if baseline is not None:
+        click.echo(f"Compared with {baseline}:")
+        for item in benchmarks.compare(benchmarks.load(baseline), report):
+            if item["ratio"] is not None:
+                click.echo(
+                    f"{item['backend']:6} {item['name']:32} {item['ratio']:10.2f}x"
+                )
+    click.echo("Results written to {}".format(output))
+
+
+def _run_docker_bench(scale, seed, backends, output):
+    """Run the benchmarks on the docker services of the integration tests."""
+    import pytest
+
+    path = os.path.join("tests", "integration", "bench_suite.py")
+    if not os.path.exists(path):
+        raise click.ClickException(f"{path} not found, run from the repository root")
+    os.environ.update(
+        BENCH_SCALE=str(scale),
+        BENCH_SEED=str(seed),
+        BENCH_BACKENDS=",".join(backends),
+        BENCH_OUTPUT=os.path.abspath(output),
+    )
+    if pytest.main(["-q", "-s", path]) != 0:
+        raise click.ClickException("Benchmarks failed")
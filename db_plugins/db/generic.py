@@ -1,7 +1,17 @@
 import abc
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
 from math import ceil
 from typing import Type
 
+# Sort directions of keyset pagination (the same values used by pymongo)
+ASCENDING = 1
+DESCENDING = -1
+
 
 class DatabaseCreator(abc.ABC):
     """Abstract DatabaseConnection creator class.
@@ -60,6 +70,15 @@ def new_DBConnection(creator: Type[DatabaseCreator]) -> DatabaseConnection:
     return creator.create_database()
 
 
+def _chunks(iterable, size: int):
+    """Split any iterable into lists with up to `size` elements."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
 class BaseQuery(abc.ABC):
     """Abstract Query class."""
 
@@ -104,17 +123,153 @@ class BaseQuery(abc.ABC):
         """
         raise NotImplementedError()
 
+    def count_results(self, filter_by, limit=None):
+        """Count the results of a query, up to `limit` if defined.
+
+        Used by :class:`CountStrategy` objects.
+        """
+        raise NotImplementedError()
+
+    def estimated_count(self, filter_by):
+        """Get an estimated count of the results of a query from statistics.
+
+        Used by :class:`CountStrategy` objects. Returns None if no estimate is
+        available for the query.
+        """
+        return None
+
+    def count_key(self, filter_by):
+        """Get a key that identifies the results counted for a query.
+
+        Used by :class:`CountStrategy` objects for caching.
+        """
+        raise NotImplementedError()
+
+
+def _normalized_hash(value):
+    """Hash of a JSON-like value that doesn't depend on the order of dictionary keys."""
+    value = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha1(value.encode()).hexdigest()
+
+
+class CountStrategy(abc.ABC):
+    """Strategy used to count the total number of results when paginating."""
+
+    @abc.abstractmethod
+    def count(self, query, filter_by):
+        """Count the results of `filter_by` using the counting methods of `query`."""
+        raise NotImplementedError()
+
+
+class ExactCount(CountStrategy):
+    """Count all results of the query."""
+
+    def count(self, query, filter_by):
+        return query.count_results(filter_by)
+
+
+class CappedCount(CountStrategy):
+    """Count the results of the query, but only up to `max_results`."""
+
+    def __init__(self, max_results=50000):
+        self.max_results = max_results
+
+    def count(self, query, filter_by):
+        return query.count_results(filter_by, limit=self.max_results)
+
+
+class EstimatedCount(CountStrategy):
+    """Use the estimated count from database statistics, if available.
+
+    Estimates are only used when the query provides one (e.g., when there are
+    no filters in MongoDB). Otherwise, the `fallback` strategy is used, which
+    defaults to :class:`CappedCount`.
+    """
+
+    def __init__(self, fallback=None):
+        self.fallback = fallback or CappedCount()
+
+    def count(self, query, filter_by):
+        total = query.estimated_count(filter_by)
+        if total is None:
+            total = self.fallback.count(query, filter_by)
+        return total
+
+
+class CachedCount(CountStrategy):
+    """Cache the totals of another strategy, up to `ttl` seconds.
+
+    Totals are kept in a LRU cache with up to `maxsize` queries, which are
+    identified by a normalized hash of the query filters. This way, requesting
+    other pages for the same query doesn't count the results again. The same
+    instance must be reused between calls for the cache to work.
+    """
+
+    def __init__(self, strategy=None, ttl=60, maxsize=1024):
+        self.strategy = strategy or CappedCount()
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, query, filter_by):
+        key = query.count_key(filter_by)
+        now = time.monotonic()
+        with self._lock:
+            if key in self._cache:
+                expiration, total = self._cache[key]
+                if expiration > now:
+                    self._cache.move_to_end(key)
+                    return total
+                del self._cache[key]
+        total = self.strategy.count(query, filter_by)
+        with self._lock:
+            self._cache[key] = (now + self.ttl, total)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return total
+
+    def clear(self):
+        """Remove all cached totals."""
+        with self._lock:
+            self._cache.clear()
+
 
 class Pagination:
     """Paginate responses from the database."""
 
-    def __init__(self, query, page, per_page, total, items):
-        """Set attributes from args."""
+    def __init__(
+        self,
+        query,
+        page,
+        per_page,
+        total,
+        items,
+        next_cursor=None,
+        count_strategy=None,
+        arguments=None,
+        keyset=False,
+    ):
+        """Set attributes from args.
+
+        `next_cursor` is only set by keyset (cursor-based) pagination and it
+        is the opaque token used to request the page after this one.
+        `count_strategy` is the :class:`CountStrategy` used to get `total`, and
+        it is reused when requesting other pages. `arguments` are the other
+        arguments of the ``paginate`` call (filters, sorting, etc.), which are
+        also passed again for other pages. `keyset` tells whether the page was
+        selected with keyset pagination, which can only go forward.
+        """
         self.query = query
         self.page = page
         self.per_page = per_page
         self.total = total
         self.items = items
+        self.next_cursor = next_cursor
+        self.count_strategy = count_strategy
+        self.arguments = arguments or {}
+        self.keyset = keyset
 
     @property
     def pages(self):
@@ -125,12 +280,28 @@ class Pagination:
             pages = int(ceil(self.total / float(self.per_page)))
         return pages
 
-    def prev(self):
-        """Return a :class:`Pagination` object for the previous page."""
+    def _paginate(self, page, **kwargs):
         assert (
             self.query is not None
         ), "a query object is required for this method to work"
-        return self.query.paginate(self.page - 1, self.per_page)
+        return self.query.paginate(
+            page=page,
+            per_page=self.per_page,
+            count_strategy=self.count_strategy,
+            **self.arguments,
+            **kwargs,
+        )
+
+    def prev(self):
+        """Return a :class:`Pagination` object for the previous page.
+
+        Raises a ``ValueError`` on the first page and on keyset pages.
+        """
+        if self.keyset:
+            raise ValueError("Keyset pagination can't request previous pages")
+        if not self.has_prev:
+            raise ValueError("There is no previous page")
+        return self._paginate(self.page - 1)
 
     @property
     def prev_num(self):
@@ -145,15 +316,22 @@ class Pagination:
         return self.page > 1
 
     def next(self):
-        """Return a :class:`Pagination` object for the next page."""
-        assert (
-            self.query is not None
-        ), "a query object is required for this method to work"
-        return self.query.paginate(self.page + 1, self.per_page)
+        """Return a :class:`Pagination` object for the next page.
+
+        Keyset pages request it with their `next_cursor`, so they raise a
+        ``ValueError`` if there is no next page.
+        """
+        if not self.keyset:
+            return self._paginate(self.page + 1)
+        if self.next_cursor is None:
+            raise ValueError("There is no next page")
+        return self._paginate(self.page + 1, cursor=self.next_cursor)
 
     @property
     def has_next(self):
         """Check if a next page exists."""
+        if self.keyset:
+            return self.next_cursor is not None
         return self.page < self.pages
 
     @property
@@ -165,8 +343,27 @@ class Pagination:
 
 
 class PaginationNoCount(Pagination):
-    def __init__(self, query, page, per_page, items, has_next):
-        super().__init__(query, page, per_page, None, items)
+    def __init__(
+        self,
+        query,
+        page,
+        per_page,
+        items,
+        has_next,
+        next_cursor=None,
+        arguments=None,
+        keyset=False,
+    ):
+        super().__init__(
+            query,
+            page,
+            per_page,
+            None,
+            items,
+            next_cursor,
+            arguments=arguments,
+            keyset=keyset,
+        )
         self._has_next = has_next
 
     @property
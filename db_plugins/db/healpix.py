@@ -0,0 +1,243 @@
+"""HEALPix pixel indexing (nested scheme) for positional queries.
+
+Objects store the pixel of their position at `HEALPIX_ORDER`. In the nested
+scheme, the pixels of a coarser order are contiguous ranges of the finer
+pixels, so a cone search becomes a few range lookups over the pixel index
+(see :func:`cone_ranges`) plus an exact distance filter.
+"""
+
+import math
+
+HEALPIX_ORDER = 29
+"""Order of the pixels stored in the database (``nside = 2 ** order``).
+
+Order 29 is the finest one that fits in a 64 bit integer, with pixels of
+about 0.4 milliarcseconds. Changing it requires recomputing the stored pixels.
+"""
+
+_JRLL = (2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4)
+_JPLL = (1, 3, 5, 7, 0, 2, 4, 6, 1, 3, 5, 7)
+
+
+def _spread(value: int):
+    """Interleave the bits of `value` with zeros."""
+    result, bit = 0, 0
+    while value:
+        result |= (value & 1) << (2 * bit)
+        value >>= 1
+        bit += 1
+    return result
+
+
+def _compress(value: int):
+    """Inverse of :func:`_spread`, keeping the even bits of `value`."""
+    result, bit = 0, 0
+    while value:
+        result |= (value & 1) << bit
+        value >>= 2
+        bit += 1
+    return result
+
+
+def ang2pix(order: int, ra: float, dec: float):
+    """Get the nested HEALPix pixel that contains a position.
+
+    Parameters
+    ----------
+    order : int
+        HEALPix order, between 0 and 29
+    ra : float
+        Right ascension in degrees
+    dec : float
+        Declination in degrees
+
+    Returns
+    -------
+    int
+        Pixel number
+    """
+    nside = 1 << order
+    z = math.sin(math.radians(dec))
+    za = abs(z)
+    tt = math.fmod(math.radians(ra) / (0.5 * math.pi), 4.0)
+    if tt < 0:
+        tt += 4.0
+    if za <= 2 / 3:
+        # Equatorial region
+        temp1 = nside * (0.5 + tt)
+        temp2 = nside * (0.75 * z)
+        jp = int(temp1 - temp2)  # Index of ascending edge line
+        jm = int(temp1 + temp2)  # Index of descending edge line
+        ifp, ifm = jp >> order, jm >> order
+        if ifp == ifm:
+            face = ifp | 4
+        elif ifp < ifm:
+            face = ifp
+        else:
+            face = ifm + 8
+        ix = jm & (nside - 1)
+        iy = nside - (jp & (nside - 1)) - 1
+    else:
+        # Polar caps
+        ntt = min(3, int(tt))
+        tp = tt - ntt
+        tmp = nside * math.sqrt(3 * (1 - za))
+        jp = min(int(tp * tmp), nside - 1)
+        jm = min(int((1.0 - tp) * tmp), nside - 1)
+        if z >= 0:
+            face, ix, iy = ntt, nside - jm - 1, nside - jp - 1
+        else:
+            face, ix, iy = ntt + 8, jp, jm
+    return (face << (2 * order)) + _spread(ix) + (_spread(iy) << 1)
+
+
+def pix2ang(order: int, pixel: int):
+    """Get the position of the center of a nested HEALPix pixel.
+
+    Parameters
+    ----------
+    order : int
+        HEALPix order, between 0 and 29
+    pixel : int
+        Pixel number
+
+    Returns
+    -------
+    tuple[float, float]
+        Right ascension and declination in degrees
+    """
+    nside = 1 << order
+    face = pixel >> (2 * order)
+    pixel &= (1 << (2 * order)) - 1
+    ix, iy = _compress(pixel), _compress(pixel >> 1)
+    jr = (_JRLL[face] << order) - ix - iy - 1
+    if jr < nside:
+        nr = jr
+        z = 1 - nr * nr / (3 * nside * nside)
+    elif jr > 3 * nside:
+        nr = 4 * nside - jr
+        z = nr * nr / (3 * nside * nside) - 1
+    else:
+        nr = nside
+        z = (2 * nside - jr) * 2 / (3 * nside)
+    tmp = _JPLL[face] * nr + ix - iy
+    if tmp < 0:
+        tmp += 8 * nr
+    phi = 0.25 * math.pi * tmp / nr
+    return math.degrees(phi) % 360, math.degrees(math.asin(z))
+
+
+def max_pixrad(order: int):
+    """Get the maximum distance between the center of a pixel and its corners.
+
+    Returns
+    -------
+    float
+        Distance in degrees
+    """
+    nside = 1 << order
+    t1 = (1 - 1 / nside) ** 2
+    return angular_distance(
+        math.degrees(math.pi / (4 * nside)),
+        math.degrees(math.asin(2 / 3)),
+        0.0,
+        math.degrees(math.asin(1 - t1 / 3)),
+    )
+
+
+def angular_distance(ra1: float, dec1: float, ra2: float, dec2: float):
+    """Get the angular distance between two positions (all in degrees)."""
+    ra1, dec1, ra2, dec2 = map(math.radians, (ra1, dec1, ra2, dec2))
+    a = (
+        math.sin((dec2 - dec1) / 2) ** 2
+        + math.cos(dec1) * math.cos(dec2) * math.sin((ra2 - ra1) / 2) ** 2
+    )
+    return math.degrees(2 * math.asin(min(1.0, math.sqrt(a))))
+
+
+def query_order(radius_arcsec: float, order: int = HEALPIX_ORDER):
+    """Get the finest order whose pixels are at least as large as the radius.
+
+    A cone only overlaps a handful of pixels of this order, so it results in
+    few ranges.
+    """
+    radius = radius_arcsec / 3600
+    for level in range(order + 1):
+        if max_pixrad(level) < radius:
+            return max(level - 1, 0)
+    return order
+
+
+def cone_pixels(ra: float, dec: float, radius_arcsec: float, order: int):
+    """Get the pixels of an order that may overlap a cone.
+
+    Pixels are selected by refining the base pixels only where they might
+    overlap the cone. The selection is conservative: it can include a few
+    pixels near the border that don't overlap, which the exact distance
+    filter of the queries discards.
+
+    Returns
+    -------
+    list[int]
+        Sorted pixel numbers
+    """
+    radius = radius_arcsec / 3600
+    margins = [1.5 * max_pixrad(level) for level in range(order + 1)]
+    pixels, candidates = [], [(0, pixel) for pixel in range(12)]
+    while candidates:
+        level, pixel = candidates.pop()
+        center = pix2ang(level, pixel)
+        if angular_distance(ra, dec, *center) > radius + margins[level]:
+            continue
+        if level == order:
+            pixels.append(pixel)
+        else:
+            candidates.extend((level + 1, 4 * pixel + child) for child in range(4))
+    return sorted(pixels)
+
+
+def cone_ranges(
+    ra: float,
+    dec: float,
+    radius_arcsec: float,
+    order: int = HEALPIX_ORDER,
+    search_order: int = None,
+):
+    """Get the ranges of pixels of an order that may be inside a cone.
+
+    Parameters
+    ----------
+    ra : float
+        Right ascension of the center in degrees
+    dec : float
+        Declination of the center in degrees
+    radius_arcsec : float
+        Radius of the cone in arcseconds
+    order : int
+        Order of the stored pixels
+    search_order : int, optional
+        Order used to cover the cone, defaults to :func:`query_order`.
+        Finer orders give more but tighter ranges
+
+    Returns
+    -------
+    list[tuple[int, int]]
+        Sorted and disjoint ranges of pixels, including the start and
+        excluding the end
+    """
+    if search_order is None:
+        search_order = query_order(radius_arcsec, order)
+    shift = 2 * (order - search_order)
+    pixels = cone_pixels(ra, dec, radius_arcsec, search_order)
+    return merge_ranges((pixel << shift, (pixel + 1) << shift) for pixel in pixels)
+
+
+def merge_ranges(ranges):
+    """Sort ranges (excluding the end) and join the ones that overlap or touch."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and merged[-1][1] >= start:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
@@ -0,0 +1,519 @@
+"""Opt-in instrumentation of database operations.
+
+Listeners registered with :func:`add_listener` are called with a :class:`Span`
+after each instrumented operation: the public methods of the queries and
+connections, and the probability helpers. Spans carry the operation name, the
+collection or table, the number of documents and the batch size (when they
+apply) and the wall time. Lower level spans can be emitted for every command
+sent to MongoDB (:func:`instrument_mongo`) and every statement executed by a
+SQLAlchemy engine (:func:`instrument_engine`).
+
+When no listener is registered, instrumented operations only check that the
+registry is empty.
+
+.. code-block:: python
+
+    from db_plugins.db import instrumentation
+
+    instrumentation.add_listener(lambda span: print(span))
+    # Or export them to OpenTelemetry (requires opentelemetry-api)
+    instrumentation.add_listener(instrumentation.OpenTelemetryListener())
+"""
+
+import functools
+import inspect
+import logging
+import re
+import threading
+import time
+
+from pymongo import monitoring
+from sqlalchemy import event
+
+try:
+    from opentelemetry import trace
+except ImportError:  # opentelemetry is an optional dependency
+    trace = None
+
+logger = logging.getLogger(__name__)
+
+_listeners = []
+
+
+def add_listener(listener):
+    """Register a callable that receives each finished :class:`Span`."""
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_listener(listener):
+    """Unregister a listener added with :func:`add_listener`."""
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def emit(span):
+    """Send a span to all the listeners.
+
+    Errors raised by a listener are logged, so they never affect the
+    instrumented operation or the other listeners.
+    """
+    for listener in list(_listeners):
+        try:
+            listener(span)
+        except Exception:
+            logger.exception("Instrumentation listener %r failed", listener)
+
+
+class Span:
+    """Record of an operation.
+
+    Parameters
+    ----------
+    backend : str
+        Either ``mongo`` or ``sql``
+    operation : str
+        Name of the method, helper, command or statement
+    target : str, optional
+        Name of the collection or table
+    documents : int, optional
+        Number of documents (or rows) written or read, when known
+    batch_size : int, optional
+        Number of documents (or rows) per batch
+    start : int
+        Start time in nanoseconds since the epoch
+    duration : float
+        Wall time in seconds
+    error : Exception, optional
+        Error raised by the operation
+    statement : dict or str, optional
+        Shape of the command or statement, without the values (only for
+        command and statement spans)
+    explain : callable, optional
+        Function without arguments that gets the execution plan of the
+        command or statement, running it again
+    """
+
+    __slots__ = (
+        "backend",
+        "operation",
+        "target",
+        "documents",
+        "batch_size",
+        "start",
+        "duration",
+        "error",
+        "statement",
+        "explain",
+    )
+
+    def __init__(
+        self,
+        backend,
+        operation,
+        target=None,
+        documents=None,
+        batch_size=None,
+        start=None,
+        duration=None,
+        error=None,
+        statement=None,
+        explain=None,
+    ):
+        self.backend = backend
+        self.operation = operation
+        self.target = target
+        self.documents = documents
+        self.batch_size = batch_size
+        self.start = start
+        self.duration = duration
+        self.error = error
+        self.statement = statement
+        self.explain = explain
+
+    @property
+    def name(self):
+        return f"{self.backend}.{self.operation}"
+
+    def attributes(self):
+        """Get the attributes of the span, following the OpenTelemetry names."""
+        attributes = {"db.system": self.backend, "db.operation": self.operation}
+        optional = {
+            "db.collection.name": self.target,
+            "db.documents": self.documents,
+            "db.batch_size": self.batch_size,
+        }
+        attributes.update((k, v) for k, v in optional.items() if v is not None)
+        return attributes
+
+    def __repr__(self):
+        return (
+            f"Span({self.name}, target={self.target}, documents={self.documents}, "
+            f"batch_size={self.batch_size}, duration={self.duration:.6f})"
+        )
+
+
+def _count(value):
+    """Get the number of documents in an argument or result, if known.
+
+    It handles lists, pages, insert results, bulk write summaries and counts.
+    """
+    if isinstance(value, (list, tuple)):
+        return len(value)
+    if type(value) is int:
+        return value
+    for attribute in ("items", "inserted_ids", "operations"):
+        result = getattr(value, attribute, None)
+        if isinstance(result, (list, int)) and not isinstance(result, bool):
+            return len(result) if isinstance(result, list) else result
+    return None
+
+
+def _documents(argument, result):
+    count = _count(argument)
+    return _count(result) if count is None else count
+
+
+def _target(arguments):
+    model = arguments.get("model")
+    if model is not None:
+        meta = getattr(model, "_meta", None)
+        return meta.tablename if meta else getattr(model, "__tablename__", None)
+    instance = arguments.get("self")
+    get_target = getattr(instance, "_span_target", None)
+    return get_target() if get_target else None
+
+
+def instrumented(backend, operation=None, documents=None, batch_size=None, target=None):
+    """Decorator that emits a span for each call of a function or method.
+
+    Parameters
+    ----------
+    backend : str
+        Either ``mongo`` or ``sql``
+    operation : str, optional
+        Name of the operation, defaults to the function name
+    documents : str, optional
+        Argument with the input documents, which are counted. If they can't
+        be counted (e.g., generators), the documents in the result are counted
+    batch_size : str, optional
+        Argument with the batch size
+    target : str, optional
+        Collection or table name. Defaults to the table of a ``model``
+        argument or the ``_span_target`` of the instance
+    """
+
+    def decorator(function):
+        signature = inspect.signature(function)
+        name = operation or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _listeners:
+                return function(*args, **kwargs)
+            start, counter = time.time_ns(), time.perf_counter()
+            result, error = None, None
+            try:
+                result = function(*args, **kwargs)
+                return result
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                duration = time.perf_counter() - counter
+                try:
+                    arguments = signature.bind(*args, **kwargs).arguments
+                    span = Span(
+                        backend,
+                        name,
+                        target=target or _target(arguments),
+                        documents=_documents(arguments.get(documents), result),
+                        batch_size=arguments.get(batch_size) if batch_size else None,
+                        start=start,
+                        duration=duration,
+                        error=error,
+                    )
+                except Exception:
+                    # E.g., the arguments don't match the signature, in which
+                    # case the call itself raised the error
+                    logger.exception("Failed to create the span of %s", name)
+                else:
+                    emit(span)
+
+        return wrapper
+
+    return decorator
+
+
+def _shape(value):
+    """Replace the values of a command by ``?``, keeping keys and operators."""
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in value.items()}
+    if isinstance(value, list) and any(isinstance(item, dict) for item in value):
+        return [_shape(item) for item in value]
+    return "?"
+
+
+def _command_shape(command_name, command):
+    """Get the shape of a command, without its documents and session fields."""
+    shape = {command_name: command.get(command_name)}
+    for key, value in command.items():
+        if key not in shape and key not in _COMMAND_IGNORED_FIELDS:
+            shape[key] = _shape(value)
+    return shape
+
+
+_COMMAND_IGNORED_FIELDS = {
+    "lsid",
+    "txnNumber",
+    "$db",
+    "$clusterTime",
+    "$readPreference",
+    "documents",
+    "cursor",
+    "comment",
+}
+
+_EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct"}
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """pymongo command listener that emits a span for each command.
+
+    Use :func:`instrument_mongo` to register it before creating the clients.
+    If `client` is set, spans of reads include a function to get their plan
+    with ``explain`` and ``executionStats`` verbosity.
+    """
+
+    _BATCH_FIELDS = ("documents", "updates", "deletes")
+
+    def __init__(self, client=None):
+        self.client = client
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _explain(self, database, command):
+        return self.client[database].command(
+            "explain", command, verbosity="executionStats"
+        )
+
+    def started(self, event):
+        if not _listeners:
+            return
+        target = event.command.get(event.command_name)
+        batch = next(
+            (event.command[f] for f in self._BATCH_FIELDS if f in event.command),
+            None,
+        )
+        statement, explain = None, None
+        if event.command_name != "explain":
+            statement = _command_shape(event.command_name, event.command)
+        if self.client is not None and event.command_name in _EXPLAINABLE_COMMANDS:
+            command = {
+                key: value
+                for key, value in event.command.items()
+                if key not in _COMMAND_IGNORED_FIELDS or key == "cursor"
+            }
+            explain = functools.partial(self._explain, event.database_name, command)
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (
+                time.time_ns(),
+                target if isinstance(target, str) else None,
+                len(batch) if isinstance(batch, list) else None,
+                statement,
+                explain,
+            )
+
+    def _finish(self, event, documents=None, error=None):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        start, target, batch_size, statement, explain = pending
+        emit(
+            Span(
+                "mongo",
+                event.command_name,
+                target=target,
+                documents=documents,
+                batch_size=batch_size,
+                start=start,
+                duration=event.duration_micros / 1e6,
+                error=error,
+                statement=statement,
+                explain=explain,
+            )
+        )
+
+    def succeeded(self, event):
+        n = event.reply.get("n")
+        self._finish(event, documents=n if isinstance(n, int) else None)
+
+    def failed(self, event):
+        self._finish(event, error=event.failure)
+
+
+_mongo_listener = None
+
+
+def instrument_mongo():
+    """Register a :class:`MongoCommandListener` for all new pymongo clients.
+
+    It must be called before the clients are created (e.g., before
+    :meth:`MongoConnection.connect`). Calling it again has no effect. To
+    capture execution plans, set the client of the returned listener.
+
+    .. code-block:: python
+
+        listener = instrumentation.instrument_mongo()
+        conn.connect(config)
+        listener.client = conn.client
+    """
+    global _mongo_listener
+    if _mongo_listener is None:
+        _mongo_listener = MongoCommandListener()
+        monitoring.register(_mongo_listener)
+    return _mongo_listener
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _listeners and context is not None:
+        context._span_start = (time.time_ns(), time.perf_counter())
+
+
+_EXPLAIN_PREFIXES = {
+    "postgresql": "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+}
+
+
+# Locking clauses and ``SELECT ... INTO`` make a SELECT statement write
+_WRITING_SELECT = re.compile(
+    r"\bFOR\s+(NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b|\bINTO\b",
+    re.IGNORECASE,
+)
+
+
+def _is_read_only(operation, statement):
+    """Check if a statement is a plain SELECT, which can be run again to explain it.
+
+    ``WITH`` statements are excluded, since they may contain data-modifying
+    statements that ``EXPLAIN ANALYZE`` would execute.
+    """
+    return operation == "SELECT" and _WRITING_SELECT.search(statement) is None
+
+
+def _explain_sql(engine, statement, parameters):
+    """Get the plan of a statement, running it again in another connection."""
+    prefix = _EXPLAIN_PREFIXES.get(engine.dialect.name)
+    if prefix is None:
+        return None
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(prefix + statement, parameters).all()
+    if engine.dialect.name == "postgresql":
+        return rows[0][0]
+    return [tuple(row) for row in rows]
+
+
+def _statement_span(
+    context, statement, parameters, executemany, rowcount=None, error=None
+):
+    start, counter = context._span_start
+    del context._span_start
+    compiled = getattr(getattr(context, "compiled", None), "statement", None)
+    table = getattr(compiled, "table", None)
+    operation = statement.split(None, 1)[0].upper() if statement else ""
+    explain = None
+    if _is_read_only(operation, statement) and not executemany:
+        explain = functools.partial(
+            _explain_sql, context.root_connection.engine, statement, parameters
+        )
+    return Span(
+        "sql",
+        operation,
+        target=getattr(table, "name", None),
+        documents=rowcount if rowcount is not None and rowcount >= 0 else None,
+        batch_size=len(parameters) if executemany else None,
+        start=start,
+        duration=time.perf_counter() - counter,
+        error=error,
+        statement=(
+            " ".join(statement.split()) if operation not in ("", "EXPLAIN") else None
+        ),
+        explain=explain,
+    )
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is None or not hasattr(context, "_span_start"):
+        return
+    try:
+        rowcount = cursor.rowcount if cursor is not None else None
+        span = _statement_span(context, statement, parameters, executemany, rowcount)
+    except Exception:
+        logger.exception("Failed to create the span of a SQL statement")
+    else:
+        emit(span)
+
+
+def _handle_error(exception_context):
+    context = exception_context.execution_context
+    if context is None or not hasattr(context, "_span_start"):
+        return
+    try:
+        span = _statement_span(
+            context,
+            exception_context.statement,
+            exception_context.parameters,
+            context.executemany,
+            error=exception_context.original_exception,
+        )
+    except Exception:
+        logger.exception("Failed to create the span of a SQL statement")
+    else:
+        emit(span)
+
+
+def instrument_engine(engine):
+    """Emit a span for each statement executed by a SQLAlchemy engine.
+
+    It uses the ``before_cursor_execute`` and ``after_cursor_execute`` events.
+    Calling it again for the same engine has no effect. For async engines,
+    pass their ``sync_engine``.
+    """
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+    return engine
+
+
+class OpenTelemetryListener:
+    """Listener that exports the spans to OpenTelemetry.
+
+    Parameters
+    ----------
+    tracer : opentelemetry.trace.Tracer, optional
+        Tracer used to create the spans, by default the tracer of this
+        package from the global tracer provider (requires ``opentelemetry-api``)
+    """
+
+    def __init__(self, tracer=None):
+        if tracer is None:
+            if trace is None:
+                raise ImportError(
+                    "opentelemetry-api is required for OpenTelemetry spans, "
+                    "install it with 'pip install db-plugins[telemetry]'"
+                )
+            tracer = trace.get_tracer("db_plugins")
+        self.tracer = tracer
+
+    def __call__(self, span):
+        otel_span = self.tracer.start_span(
+            span.name, start_time=span.start, attributes=span.attributes()
+        )
+        if span.error is not None:
+            otel_span.record_exception(span.error)
+            if trace is not None:
+                otel_span.set_status(trace.Status(trace.StatusCode.ERROR))
+        otel_span.end(end_time=span.start + int(span.duration * 1e9))
@@ -0,0 +1,91 @@
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:  # motor is an optional dependency
+    AsyncIOMotorClient = None
+
+from ..generic import DatabaseConnection, DatabaseCreator
+from .async_query import AsyncMongoQuery
+from .connection import _MongoConfig
+from .orm import ModelMetaClass
+
+
+class AsyncMongoConnection(DatabaseConnection):
+    """asyncio version of :class:`MongoConnection`, backed by motor.
+
+    The methods `create_db` and `drop_db` are coroutines and queries are
+    :class:`AsyncMongoQuery` objects.
+    """
+
+    def __init__(self, config=None):
+        self.config = config
+        self.client = None
+        self.database = None
+
+    @property
+    def config(self):
+        return self.__config
+
+    @config.setter
+    def config(self, config):
+        self.__config = config if config is None else _MongoConfig(config)
+
+    def connect(self, config=None):
+        """
+        Creates the motor client and selects the database.
+
+        The actual connection is established by motor when it is first used.
+
+        Parameters
+        ----------
+        config : dict
+            Database configuration, same as for :meth:`MongoConnection.connect`
+        """
+        if config is not None:
+            self.config = config
+        if self.client is None:
+            if AsyncIOMotorClient is None:
+                raise ImportError(
+                    "motor is required for async connections, "
+                    "install it with 'pip install db-plugins[async]'"
+                )
+            self.client = AsyncIOMotorClient(**self.config)
+        self.database = self.client[self.config.db_name]
+        ModelMetaClass.set_database(self.config.db_name)
+
+    async def create_db(self):
+        for name, collection in ModelMetaClass.metadata.collections.items():
+            await self.database[name].create_indexes(collection["indexes"])
+
+    async def drop_db(self):
+        await self.client.drop_database(self.config.db_name)
+
+    def query(self, model=None, name=None):
+        """Create an AsyncMongoQuery object that allows you to query the database
+        using the motor Collection API, or using the BaseQuery methods
+        like ``get_or_create``.
+
+        Parameters
+        ----------
+        model : Type[BaseModel]
+            Model class to create the query for
+        name : str
+            Name of collection to use
+
+        Examples
+        --------
+        .. code-block:: python
+
+            # Using motor API through collection attribute
+            await db_conn.query(
+                name='my_collection',
+            ).collection.find_one({'hello': 'world'})
+            # Using db-plugins
+            page = await db_conn.query(model=Object).paginate(filter_by=filters)
+        """
+        return AsyncMongoQuery(self.database, model=model, name=name)
+
+
+class AsyncMongoDatabaseCreator(DatabaseCreator):
+    @classmethod
+    def create_database(cls) -> AsyncMongoConnection:
+        return AsyncMongoConnection()
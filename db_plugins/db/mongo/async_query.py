@@ -0,0 +1,340 @@
+import asyncio
+from typing import Type
+
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from ..generic import BaseQuery, Pagination, PaginationNoCount, _chunks
+from .bulk import BulkWriteSummary, ChunkFailure
+from .models import BaseModel
+from .query import (
+    CollectionNotFound,
+    _as_pipeline,
+    _bulk_update_model,
+    _count_key,
+    _count_pipeline,
+    _is_unfiltered,
+    _keys_query,
+    _many_keys,
+    _many_results,
+    _missing_documents,
+    _new_document,
+    _page_arguments,
+    _page_pipeline,
+    _page_repeat_arguments,
+    _position_update,
+    _raced_keys,
+    _split_page,
+    _update_requests,
+    _upsert_fields,
+    _upsert_operations,
+)
+
+
+class AsyncMongoQuery(BaseQuery):
+    """asyncio version of :class:`MongoQuery`, for a motor database.
+
+    All methods that access the database are coroutines. The collection is
+    available as a ``motor`` collection through the `collection` attribute.
+    """
+
+    def __init__(self, database, model: Type[BaseModel] = None, name: str = None):
+        if model and name:
+            raise ValueError("Only one of 'model' or 'name' can be defined")
+        self.model = model
+        self.collection = None
+        self._db = database
+        if name:
+            # Ignore model and use pure motor API
+            self.collection = self._db[name]
+        elif model:
+            # Using custom ORM API
+            self.init_collection(model)
+
+    def init_collection(self, model: Type[BaseModel] = None):
+        """Sets the collection used by the various methods based on the model
+        class provided. If no model is provided, it will use the collection
+        provided during creation, if any.
+
+        Raises a :class:`CollectionNotFound` error if no model is provided
+        and no collection was selected during creation.
+
+        Parameters
+        ----------
+        model : Type[BaseModel]
+            Model class used for queries
+        """
+        if model:
+            self.model = model
+            self.collection = self._db[model._meta.tablename]
+        elif self.collection is None:
+            raise CollectionNotFound(
+                "A valid model must be provided at instantiation or in method call"
+            )
+
+    async def check_exists(self, filter_by: dict = None, model: Type[BaseModel] = None):
+        """Check if record exists in database.
+
+        See :meth:`MongoQuery.check_exists`.
+        """
+        filter_by = filter_by or {}
+        self.init_collection(model)
+        return await self.collection.count_documents(filter_by, limit=1) != 0
+
+    async def get_or_create(
+        self, filter_by: dict = None, model: Type[BaseModel] = None, **kwargs
+    ):
+        """Initialize a model by creating it or getting it from the database.
+
+        See :meth:`MongoQuery.get_or_create`.
+        """
+        filter_by = filter_by or {}
+        self.init_collection(model)
+        result = await self.collection.find_one(filter_by)
+        if result is not None:
+            return result, False
+
+        model_instance = _new_document(self.model, filter_by, kwargs)
+        try:
+            result = await self.collection.insert_one(model_instance)
+        except Exception as e:
+            raise AttributeError(e)
+
+        return result, True
+
+    async def get_or_create_many(
+        self,
+        filters: list,
+        model: Type[BaseModel] = None,
+        documents: list = None,
+    ):
+        """Get or create multiple documents at once.
+
+        See :meth:`MongoQuery.get_or_create_many`.
+        """
+        if len(filters) == 0:
+            return []
+        keys, get_key, documents = _many_keys(filters, documents)
+        self.init_collection(model)
+
+        item_keys = [get_key(filter_by) for filter_by in filters]
+        filters_by_key = dict(zip(item_keys, filters))
+        found = await self._find_by_keys(filters_by_key, keys, get_key)
+        created = _missing_documents(self.model, filters, documents, item_keys, found)
+
+        if created:
+            try:
+                await self.collection.insert_many(list(created.values()), ordered=False)
+            except BulkWriteError as e:
+                raced = _raced_keys(e, created)
+                found.update(
+                    await self._find_by_keys(
+                        {k: filters_by_key[k] for k in raced}, keys, get_key
+                    )
+                )
+                if raced.difference(found):  # Duplicated on fields outside filter
+                    raise
+
+        return _many_results(item_keys, found, created)
+
+    async def _find_by_keys(self, filters_by_key: dict, keys: list, get_key):
+        """Find documents matching any of the filters, indexed by their key."""
+        cursor = self.collection.find(_keys_query(filters_by_key, keys))
+        return {get_key(doc): doc async for doc in cursor}
+
+    async def update(self, instance, attrs):
+        """Update a document in collection.
+
+        See :meth:`MongoQuery.update`.
+        """
+        self.init_collection(type(instance))
+        attrs = _position_update(instance, attrs)
+        return await self.collection.update_one(instance, {"$set": attrs})
+
+    async def bulk_update(
+        self, instances: list, attrs: list, filter_fields: list = None
+    ):
+        """Update multiple documents in a collection at once.
+
+        See :meth:`MongoQuery.bulk_update`.
+        """
+        if len(instances) == 0:
+            return
+        filter_fields = filter_fields or []
+        self.init_collection(_bulk_update_model(instances, attrs, filter_fields))
+
+        requests = list(_update_requests(instances, attrs, filter_fields))
+        return await self.collection.bulk_write(requests=requests, ordered=False)
+
+    async def bulk_upsert(
+        self,
+        documents: list,
+        model: Type[BaseModel] = None,
+        filter_fields: list = None,
+        set_on_insert: list = None,
+        add_to_set: list = None,
+        replace: bool = False,
+        chunk_size: int = 1000,
+    ):
+        """Insert or update multiple documents in a collection at once.
+
+        See :meth:`MongoQuery.bulk_upsert` (chunks are always sent one after
+        the other and custom executors are not supported).
+        """
+        fields = _upsert_fields(filter_fields, set_on_insert, add_to_set, replace)
+        if len(documents) == 0:
+            return
+        if model is None and isinstance(documents[0], BaseModel):
+            model = type(documents[0])
+        self.init_collection(model)
+
+        operations = _upsert_operations(self.model, documents, fields, replace)
+        summary, offset = BulkWriteSummary(), 0
+        for index, chunk in enumerate(_chunks(operations, chunk_size)):
+            try:
+                result = await self.collection.bulk_write(chunk, ordered=False)
+            except PyMongoError as error:
+                summary.add_failure(ChunkFailure(index, offset, len(chunk), error))
+            else:
+                summary.add_result(result)
+            summary.chunks += 1
+            summary.operations += len(chunk)
+            offset += len(chunk)
+        summary.raise_for_errors()
+        return summary
+
+    async def bulk_insert(self, documents, model: Type[BaseModel] = None):
+        """Insert multiple documents to the database at once.
+
+        See :meth:`MongoQuery.bulk_insert` (chunked insertion is not supported).
+        """
+        if len(documents) == 0:
+            return
+        self.init_collection(model)
+
+        documents = list(self.model.from_records(documents))
+        if len(documents) == 0:
+            return
+        return await self.collection.insert_many(documents)
+
+    async def paginate(
+        self,
+        filter_by=None,
+        page=1,
+        per_page=10,
+        count=True,
+        max_results=50000,
+        sort_by=None,
+        sort_direction=ASCENDING,
+        cursor=None,
+        count_strategy=None,
+    ):
+        """Return pagination object with selected documents.
+
+        The documents of the page and the total number of documents are
+        queried concurrently. The methods `next` and `prev` of the returned
+        pagination object must be awaited.
+
+        See :meth:`MongoQuery.paginate`. Count strategies are not supported,
+        since they count synchronously.
+
+        Returns
+        -------
+        Pagination
+            Paginated results
+        """
+        page, per_page = _page_arguments(page, per_page, sort_by, cursor)
+        if count_strategy is not None:
+            raise ValueError("Count strategies are not supported by async queries")
+
+        filter_by = _as_pipeline(filter_by)
+        pipeline = _page_pipeline(
+            filter_by, page, per_page, count, sort_by, sort_direction, cursor
+        )
+        items = self.collection.aggregate(pipeline).to_list(length=None)
+        if count:
+            items, total = await asyncio.gather(
+                items, self.count_results(filter_by, max_results)
+            )
+        else:
+            items = await items
+
+        items, has_next, next_cursor = _split_page(items, per_page, count, sort_by)
+        arguments = _page_repeat_arguments(
+            filter_by, count, max_results, sort_by, sort_direction
+        )
+        keyset = sort_by is not None
+        if not count:
+            return PaginationNoCount(
+                self, page, per_page, items, has_next, next_cursor, arguments, keyset
+            )
+        return Pagination(
+            self,
+            page,
+            per_page,
+            total,
+            items,
+            next_cursor,
+            arguments=arguments,
+            keyset=keyset,
+        )
+
+    async def count_results(self, filter_by: list, limit: int = None):
+        """Count the documents returned by an aggregation pipeline.
+
+        See :meth:`MongoQuery.count_results`.
+        """
+        summary = await self.collection.aggregate(
+            _count_pipeline(filter_by, limit)
+        ).to_list(length=1)
+        try:
+            return summary[0]["n"]
+        except IndexError:
+            return 0
+
+    async def estimated_count(self, filter_by: list):
+        """Get the estimated number of documents in the collection from its metadata.
+
+        See :meth:`MongoQuery.estimated_count`.
+        """
+        if _is_unfiltered(filter_by):
+            return await self.collection.estimated_document_count()
+        return None
+
+    def count_key(self, filter_by: list):
+        """Get the collection name and the hash of the pipeline (without sorting)."""
+        return _count_key(self.collection, filter_by)
+
+    async def find_one(
+        self, filter_by: dict = None, model: Type[BaseModel] = None, **kwargs
+    ):
+        """Find one item of the specified model.
+
+        See :meth:`MongoQuery.find_one`.
+        """
+        filter_by = filter_by or {}
+        self.init_collection(model)
+        return await self.collection.find_one(filter_by, **kwargs)
+
+    async def find_all(
+        self,
+        filter_by: dict = None,
+        model: Type[BaseModel] = None,
+        paginate=True,
+        **kwargs,
+    ):
+        """Find list of items of the specified model.
+
+        See :meth:`MongoQuery.find_all`. Without pagination, it returns a
+        motor cursor, which can be iterated with ``async for``.
+        """
+        self.init_collection(model)
+        filter_by = _as_pipeline(filter_by)
+
+        if paginate:
+            return await self.paginate(filter_by, **kwargs)
+        else:
+            return self.collection.aggregate(filter_by, **kwargs)
+
+    def __repr__(self):
+        return f"AsyncMongoQuery(model={self.model.__class__.__name__})"
@@ -0,0 +1,177 @@
+"""Chunked (and optionally parallel) execution of bulk write operations"""
+
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from ..generic import _chunks
+
+ChunkFailure = namedtuple("ChunkFailure", ["index", "offset", "size", "error"])
+ChunkFailure.__doc__ = (
+    """Failed chunk, with its position in the operations and the error"""
+)
+
+
+class BulkWriteExecutionError(Exception):
+    def __init__(self, summary):
+        self.summary = summary
+        messages = "; ".join(
+            f"chunk {failure.index} (offset {failure.offset}): {failure.error}"
+            for failure in summary.failures
+        )
+        super().__init__(f"{len(summary.failures)} chunk(s) failed: {messages}")
+
+
+class BulkWriteSummary:
+    """Aggregated counts of all chunks of a bulk write.
+
+    Counts include the operations of failed chunks that were still applied
+    (as reported in unordered bulk write errors).
+    """
+
+    COUNTS = {
+        "inserted_count": "nInserted",
+        "matched_count": "nMatched",
+        "modified_count": "nModified",
+        "deleted_count": "nRemoved",
+        "upserted_count": "nUpserted",
+    }
+
+    def __init__(self):
+        self.inserted_count = 0
+        self.matched_count = 0
+        self.modified_count = 0
+        self.deleted_count = 0
+        self.upserted_count = 0
+        self.chunks = 0
+        self.operations = 0
+        self.failures = []
+
+    def add_result(self, result):
+        """Add the counts of a `pymongo.results.BulkWriteResult`."""
+        for count in self.COUNTS:
+            setattr(self, count, getattr(self, count) + getattr(result, count))
+
+    def add_failure(self, failure: ChunkFailure):
+        """Add a failed chunk, including the partial counts for bulk write errors."""
+        self.failures.append(failure)
+        if isinstance(failure.error, BulkWriteError):
+            for count, key in self.COUNTS.items():
+                value = failure.error.details.get(key, 0)
+                setattr(self, count, getattr(self, count) + value)
+
+    @property
+    def acknowledged(self):
+        return not self.failures
+
+    def raise_for_errors(self):
+        """Raise a :class:`BulkWriteExecutionError` if any chunk failed."""
+        if self.failures:
+            raise BulkWriteExecutionError(self)
+
+    def __repr__(self):
+        counts = ", ".join(f"{count}={getattr(self, count)}" for count in self.COUNTS)
+        return f"BulkWriteSummary({counts}, failures={len(self.failures)})"
+
+
+class BulkWriteExecutor:
+    """Runs bulk write operations in chunks, optionally on a bounded thread pool.
+
+    Operations can be any iterable (e.g., a generator) and they are consumed
+    lazily, with at most two chunks per worker waiting to be sent. Failed
+    chunks don't stop the rest of the operations, they are reported in the
+    returned :class:`BulkWriteSummary` instead (or raised at the end, if
+    `raise_on_error` is set).
+
+    Parameters
+    ----------
+    chunk_size : int
+        Maximum number of operations per ``bulk_write`` call
+    max_workers : int
+        Number of threads used to send chunks. ``pymongo.MongoClient`` is
+        thread-safe, so the same collection is shared by all workers
+    ordered : bool
+        Whether operations inside each chunk are ordered (chunks run in
+        parallel, so there is no order between chunks when using threads)
+    progress : callable, optional
+        Called with the :class:`BulkWriteSummary` after each chunk finishes
+    raise_on_error : bool
+        Whether to raise :class:`BulkWriteExecutionError` once all chunks
+        finish if any of them failed
+    """
+
+    def __init__(
+        self,
+        chunk_size=1000,
+        max_workers=1,
+        ordered=False,
+        progress=None,
+        raise_on_error=False,
+    ):
+        if chunk_size < 1 or max_workers < 1:
+            raise ValueError("Both chunk_size and max_workers must be positive")
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.ordered = ordered
+        self.progress = progress
+        self.raise_on_error = raise_on_error
+
+    def _write(self, collection, chunk):
+        return collection.bulk_write(requests=chunk, ordered=self.ordered)
+
+    def _collect(self, summary, index, offset, chunk, future_or_result):
+        try:
+            result = future_or_result()
+        except PyMongoError as error:
+            summary.add_failure(ChunkFailure(index, offset, len(chunk), error))
+        else:
+            summary.add_result(result)
+        summary.chunks += 1
+        summary.operations += len(chunk)
+        if self.progress:
+            self.progress(summary)
+
+    def execute(self, collection, operations):
+        """Send the operations to the collection.
+
+        Parameters
+        ----------
+        collection : pymongo.collection.Collection
+            Collection where operations are applied
+        operations : iterable
+            Operations such as ``UpdateOne`` or ``InsertOne``
+
+        Returns
+        -------
+        BulkWriteSummary
+            Aggregated counts and failed chunks
+        """
+        summary = BulkWriteSummary()
+        offset = 0
+        if self.max_workers == 1:
+            for index, chunk in enumerate(_chunks(operations, self.chunk_size)):
+                self._collect(
+                    summary,
+                    index,
+                    offset,
+                    chunk,
+                    lambda: self._write(collection, chunk),
+                )
+                offset += len(chunk)
+        else:
+            with ThreadPoolExecutor(self.max_workers) as pool:
+                pending = {}
+                for index, chunk in enumerate(_chunks(operations, self.chunk_size)):
+                    future = pool.submit(self._write, collection, chunk)
+                    pending[future] = (index, offset, chunk)
+                    offset += len(chunk)
+                    if len(pending) >= 2 * self.max_workers:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self._collect(summary, *pending.pop(future), future.result)
+                for future in list(pending):
+                    self._collect(summary, *pending.pop(future), future.result)
+        if self.raise_on_error:
+            summary.raise_for_errors()
+        return summary
@@ -1,11 +1,63 @@
+import os
+import threading
 from collections import UserDict
 
 from pymongo import MongoClient
 
 from .query import MongoQuery
-from ..generic import DatabaseConnection, DatabaseCreator
+from ..generic import DatabaseConnection, DatabaseCreator, _normalized_hash
 from .orm import ModelMetaClass
 
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(config):
+    """Get the process-wide ``MongoClient`` for a configuration.
+
+    Connections with equal configurations (ignoring the database) share the
+    same client, with its connection pool and monitoring threads. The client
+    class is part of the key, so different client implementations (e.g.,
+    mocks) are never mixed. Clients are not inherited by forked processes,
+    since pymongo clients are not fork-safe.
+
+    Parameters
+    ----------
+    config : _MongoConfig
+        Parsed configuration (keyword arguments for the client)
+
+    Returns
+    -------
+    pymongo.MongoClient
+    """
+    key = (MongoClient, _normalized_hash(dict(config)))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = MongoClient(**config)
+        return client
+
+
+def close_clients():
+    """Close and forget all clients created with :func:`get_client`."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+
+def _forget_clients():
+    """Forget the clients of the parent process, without closing them."""
+    global _clients_lock
+    _clients.clear()
+    # The lock could have been held by another thread while forking
+    _clients_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_clients)
+
 
 class _MongoConfig(UserDict):
     """Special dictionary used to parse configuration dictionaries for mongodb.
@@ -17,6 +69,17 @@ class _MongoConfig(UserDict):
     All keys are converted from `snake_case` to `lowerCamelCase` format, as
     used by `pymongo`. The special key `database` is removed from the dictionary
     proper, but can be accessed through the property `db_name`.
+
+    Commonly tuned client options are:
+
+    * ``MAX_POOL_SIZE`` and ``MIN_POOL_SIZE``: connections kept by the pool
+      (pymongo defaults to 100 and 0)
+    * ``WAIT_QUEUE_TIMEOUT_MS``: maximum time waiting for a free connection
+    * ``COMPRESSORS``: e.g., ``"zstd,snappy"`` (requires the ``compression``
+      extra, i.e., ``pip install db-plugins[compression]``)
+    * ``READ_PREFERENCE``: e.g., ``"secondaryPreferred"``
+
+    Option names are case-insensitive for pymongo.
     """
 
     REQUIRED_KEYS = {"host", "username", "password", "port", "database"}
@@ -43,10 +106,12 @@ class _MongoConfig(UserDict):
 
 
 class MongoConnection(DatabaseConnection):
-    def __init__(self, config=None):
+    def __init__(self, config=None, shared_client=True):
         self.config = config
         self.client = None
         self.database = None
+        self.shared_client = shared_client
+        self._pid = os.getpid()
 
     @property
     def config(self):
@@ -74,22 +139,42 @@ class MongoConnection(DatabaseConnection):
                     "PORT": 27017, # mongo typically runs on port 27017.
                                    # Notice that we use an int here.
                     "DATABASE": "database",
-                    "AUTH_SOURCE": "admin" # could be admin or the same as DATABASE
+                    "AUTH_SOURCE": "admin", # could be admin or the same as DATABASE
+                    "MAX_POOL_SIZE": 50,  # optional client options
                 }
+
+            See :class:`_MongoConfig` for other client options. Unless
+            `shared_client` is False, the client is shared with the other
+            connections with the same configuration (see :func:`get_client`).
+            After forking, a new client is created in the child process.
         """
         if config is not None:
             self.config = config
-        self.client = self.client or MongoClient(**self.config)
+        if self._pid != os.getpid():
+            # pymongo clients must not be used after forking
+            self.client, self._pid = None, os.getpid()
+        if self.client is None:
+            if self.shared_client:
+                self.client = get_client(self.config)
+            else:
+                self.client = MongoClient(**self.config)
         self.database = self.client[self.config.db_name]
         ModelMetaClass.set_database(self.config.db_name)
 
+    def close(self):
+        """Close the client, unless it is shared with other connections."""
+        if self.client is not None and not self.shared_client:
+            self.client.close()
+        self.client = None
+        self.database = None
+
     def create_db(self):
         ModelMetaClass.metadata.create_all(self.client, self.config.db_name)
 
     def drop_db(self):
         ModelMetaClass.metadata.drop_all(self.client, self.config.db_name)
 
-    def query(self, model=None, name=None):
+    def query(self, model=None, name=None, read_preference=None, max_staleness=None):
         """Create a BaseQuery object that allows you to query the database using
         the PyMongo Collection API, or using the BaseQuery methods
         like ``get_or_create``.
@@ -100,6 +185,12 @@ class MongoConnection(DatabaseConnection):
             Model class to create the query for
         name : str
             Name of collection to use
+        read_preference : str or pymongo.read_preferences.ServerMode, optional
+            Read preference for all reads of the query, e.g.,
+            ``secondaryPreferred``. Writes always go to the primary
+        max_staleness : int, optional
+            Maximum replication lag of the secondaries in seconds
+            (``maxStalenessSeconds``). Requires `read_preference`
 
         Examples
         --------
@@ -113,8 +204,18 @@ class MongoConnection(DatabaseConnection):
             # These two statements are equivalent
             db_conn.query(model=Object).get_or_create(filter_by=filters)
             db_conn.query().get_or_create(model=Object, filter_by=filters)
+            # Exporting from secondaries
+            db_conn.query(
+                model=Object, read_preference="secondaryPreferred", max_staleness=120
+            ).find_all(paginate=False)
         """
-        return MongoQuery(self.database, model=model, name=name)
+        return MongoQuery(
+            self.database,
+            model=model,
+            name=name,
+            read_preference=read_preference,
+            max_staleness=max_staleness,
+        )
 
 
 class MongoDatabaseCreator(DatabaseCreator):
@@ -1,6 +1,13 @@
+from db_plugins.db.instrumentation import instrumented
+from db_plugins.db.mongo.bulk import BulkWriteExecutor
 from db_plugins.db.mongo.connection import MongoConnection
 from pymongo import UpdateOne
 
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, it's only used to rank matrices faster
+    np = None
+
 """
 Helper function to create or update the probabilities for an object
 """
@@ -13,21 +20,72 @@ def get_probabilities(connection: MongoConnection, aids: list):
     return {item["_id"]: item["probabilities"] for item in probabilities}
 
 
-def get_db_operations(
-    classifier: str,
-    version: str,
-    aid: str,
-    object_probabilities: list,
-    probabilities: dict,
-):
+def get_ranked_probabilities(classifier: str, version: str, probabilities: dict):
     """
-    Check if this is really efficient
+    Get the list of probabilities for a classifier, ranked by probability
     """
     # sort by probabilities (for rank)
     sorted_classes_and_prob_list = sorted(
         probabilities.items(), key=lambda val: val[1], reverse=True
     )
+    return [
+        {
+            "classifier_version": version,
+            "classifier_name": classifier,
+            "class_name": object_class,
+            "probability": prob,
+            "ranking": idx + 1,
+        }
+        for idx, (object_class, prob) in enumerate(sorted_classes_and_prob_list)
+    ]
+
+
+def get_ranked_probabilities_matrix(
+    classifier: str, version: str, class_names: list, probabilities
+):
+    """
+    Same as `get_ranked_probabilities` for each row of a matrix with shape
+    (n_objects, n_classes). Rankings are computed with a single `argsort` if numpy
+    is available
+    """
+    error = "Probabilities must have shape (n_objects, n_classes)"
+    if np is None:
+        ranked = []
+        for row in probabilities:
+            if len(row) != len(class_names):
+                raise ValueError(error)
+            probs = dict(zip(class_names, row))
+            ranked.append(get_ranked_probabilities(classifier, version, probs))
+        return ranked
+    probabilities = np.asarray(probabilities, dtype=float)
+    if probabilities.ndim != 2 or probabilities.shape[1] != len(class_names):
+        raise ValueError(error)
+    # stable sort keeps ties in the same order as the pure python version
+    order = np.argsort(-probabilities, axis=1, kind="stable")
+    sorted_probabilities = np.take_along_axis(probabilities, order, axis=1).tolist()
+    sorted_classes = np.asarray(class_names, dtype=object)[order].tolist()
+    return [
+        [
+            {
+                "classifier_version": version,
+                "classifier_name": classifier,
+                "class_name": object_class,
+                "probability": prob,
+                "ranking": idx + 1,
+            }
+            for idx, (object_class, prob) in enumerate(zip(classes, probs))
+        ]
+        for classes, probs in zip(sorted_classes, sorted_probabilities)
+    ]
+
 
+def _merge_operation(
+    classifier: str,
+    version: str,
+    aid: str,
+    object_probabilities: list,
+    new_probabilities: list,
+):
     # Remove all existing probabilities for given classifier and version (if any)
     object_probabilities = [
         item
@@ -36,53 +94,145 @@ def get_db_operations(
         or item["classifier_version"] != version
     ]
     # Add all new probabilities
-    object_probabilities.extend(
+    object_probabilities.extend(new_probabilities)
+
+    return UpdateOne({"_id": aid}, {"$set": {"probabilities": object_probabilities}})
+
+
+def _pipeline_merge_operation(
+    classifier: str,
+    version: str,
+    aid: str,
+    new_probabilities: list,
+):
+    other_probabilities = {
+        "$filter": {
+            "input": {"$ifNull": ["$probabilities", []]},
+            "as": "item",
+            "cond": {
+                "$or": [
+                    {"$ne": ["$$item.classifier_name", {"$literal": classifier}]},
+                    {"$ne": ["$$item.classifier_version", {"$literal": version}]},
+                ]
+            },
+        }
+    }
+    return UpdateOne(
+        {"_id": aid},
         [
             {
-                "classifier_version": version,
-                "classifier_name": classifier,
-                "class_name": object_class,
-                "probability": prob,
-                "ranking": idx + 1,
+                "$set": {
+                    "probabilities": {
+                        "$concatArrays": [
+                            other_probabilities,
+                            {"$literal": new_probabilities},
+                        ]
+                    }
+                }
             }
-            for idx, (object_class, prob) in enumerate(sorted_classes_and_prob_list)
-        ]
+        ],
     )
 
-    operation = UpdateOne(
-        {"_id": aid}, {"$set": {"probabilities": object_probabilities}}
+
+def get_db_operations(
+    classifier: str,
+    version: str,
+    aid: str,
+    object_probabilities: list,
+    probabilities: dict,
+):
+    """
+    Check if this is really efficient
+    """
+    return _merge_operation(
+        classifier,
+        version,
+        aid,
+        object_probabilities,
+        get_ranked_probabilities(classifier, version, probabilities),
     )
 
-    return operation
+
+def get_pipeline_db_operations(
+    classifier: str,
+    version: str,
+    aid: str,
+    probabilities: dict,
+):
+    """
+    Same result as `get_db_operations`, but the existing probabilities are merged
+    inside the database (update with aggregation pipeline), so they are not read first.
+    This also prevents losing probabilities from other classifiers written concurrently
+    """
+    return _pipeline_merge_operation(
+        classifier,
+        version,
+        aid,
+        get_ranked_probabilities(classifier, version, probabilities),
+    )
 
 
+def _write_operations(
+    connection: MongoConnection, db_operations: list, executor: BulkWriteExecutor
+):
+    collection = connection.database["object"]
+    if executor is not None:
+        return executor.execute(collection, db_operations)
+    collection.bulk_write(db_operations, ordered=False)
+
+
+@instrumented("mongo", target="object")
 def create_or_update_probabilities(
     connection: MongoConnection,
     classifier: str,
     version: str,
     aid: str,
     probabilities: dict,
+    server_side: bool = False,
 ):
-    object_probs = get_probabilities(connection, [aid])
+    """
+    If `server_side` is True, the probabilities are merged inside the database
+    (see `get_pipeline_db_operations`). Requires MongoDB 4.2 or newer
+    """
+    if server_side:
+        operation = get_pipeline_db_operations(classifier, version, aid, probabilities)
+    else:
+        object_probs = get_probabilities(connection, [aid])
+        operation = get_db_operations(
+            classifier, version, aid, object_probs[aid], probabilities
+        )
 
-    connection.database["object"].bulk_write(
-        [get_db_operations(classifier, version, aid, object_probs[aid], probabilities)],
-        ordered=False,
-    )
+    connection.database["object"].bulk_write([operation], ordered=False)
 
 
+@instrumented("mongo", documents="aids", target="object")
 def create_or_update_probabilities_bulk(
     connection: MongoConnection,
     classifier: str,
     version: str,
     aids: list,
     probabilities: list,
+    server_side: bool = False,
+    executor: BulkWriteExecutor = None,
 ):
     """
     Bulk update using the actual bulk object of pymongo
+
+    If `server_side` is True, the probabilities are merged inside the database
+    (see `get_pipeline_db_operations`). Requires MongoDB 4.2 or newer
+
+    If an `executor` is given, the operations are sent in chunks (possibly in
+    parallel) and its `BulkWriteSummary` is returned
     """
     db_operations = []
 
+    if server_side:
+        for aid, probs in zip(aids, probabilities):
+            db_operations.append(
+                get_pipeline_db_operations(classifier, version, aid, probs)
+            )
+        return _write_operations(connection, db_operations, executor)
+
     # no warrants that probs will have the same aid order
     object_probabilities = get_probabilities(connection, aids)
 
@@ -93,4 +243,47 @@ def create_or_update_probabilities_bulk(
             )
         )
 
-    connection.database["object"].bulk_write(db_operations, ordered=False)
+    return _write_operations(connection, db_operations, executor)
+
+
+@instrumented("mongo", documents="aids", target="object")
+def create_or_update_probabilities_matrix(
+    connection: MongoConnection,
+    classifier: str,
+    version: str,
+    aids: list,
+    class_names: list,
+    probs,
+    server_side: bool = False,
+    executor: BulkWriteExecutor = None,
+):
+    """
+    Bulk update from a dense matrix of probabilities with shape (n_objects, n_classes),
+    where rows follow the order of `aids` and columns the order of `class_names`.
+    Uses numpy (optional dependency) to rank the whole batch at once
+
+    If `server_side` is True, the probabilities are merged inside the database
+    (see `get_pipeline_db_operations`). Requires MongoDB 4.2 or newer
+
+    If an `executor` is given, the operations are sent in chunks (possibly in
+    parallel) and its `BulkWriteSummary` is returned
+    """
+    ranked = get_ranked_probabilities_matrix(classifier, version, class_names, probs)
+    if len(ranked) != len(aids):
+        raise ValueError("Probabilities must have one row per aid")
+
+    if server_side:
+        db_operations = [
+            _pipeline_merge_operation(classifier, version, aid, new_probabilities)
+            for aid, new_probabilities in zip(aids, ranked)
+        ]
+    else:
+        object_probabilities = get_probabilities(connection, aids)
+        db_operations = [
+            _merge_operation(
+                classifier, version, aid, object_probabilities[aid], new_probabilities
+            )
+            for aid, new_probabilities in zip(aids, ranked)
+        ]
+
+    return _write_operations(connection, db_operations, executor)
@@ -1,28 +1,94 @@
+from collections.abc import Mapping
+
 from pymongo import ASCENDING, DESCENDING, GEOSPHERE, IndexModel
-from .orm import Field, SpecialField, ModelMetaClass
+
+from ..healpix import HEALPIX_ORDER, ang2pix
+from .orm import (
+    Field,
+    SpecialField,
+    ModelMetaClass,
+    _field_steps,
+    _fill_document,
+    _missing_field,
+)
+
+
+def _rows(columns: Mapping):
+    """Iterate over a column-oriented mapping of lists as dictionaries."""
+    keys = list(columns)
+    values = [columns[key] for key in keys]
+    if len({len(value) for value in values}) > 1:
+        raise ValueError("All columns must have the same length")
+    for row in zip(*values):
+        yield dict(zip(keys, row))
 
 
 class BaseModel(dict, metaclass=ModelMetaClass):
     def __init__(self, **kwargs):
-        model = {}
-        if "_id" in kwargs and "_id" not in self._meta.fields:
-            model["_id"] = kwargs["_id"]
-        for field, fclass in self._meta.fields.items():
+        super().__init__()
+        self._meta.construct(self, kwargs)
+
+    @classmethod
+    def _record_steps(cls, keys: tuple):
+        """Get the steps to build documents from records with the given keys.
+
+        These are the steps of the model constructor, but missing attributes
+        are found before building any document and the extra fields are only
+        resolved once.
+        """
+        steps = []
+        present = set(keys)
+        for field, callback in _field_steps(cls._meta.fields):
+            if callback is None and field not in present:
+                raise _missing_field(cls.__name__, field)
+            if field == "extra_fields" and field not in present:
+                extra = list(cls.create_extra_fields(**dict.fromkeys(keys)))
+                callback = lambda **record: {key: record[key] for key in extra}
+            steps.append((field, callback))
+        return steps
+
+    @classmethod
+    def from_records(cls, records):
+        """Lazily create many documents of the model.
+
+        Records can be a list of dictionaries or a column-oriented mapping of
+        lists. Required fields and extra fields are resolved once for each set
+        of keys in the records (usually once per batch), instead of once per
+        document.
+
+        Parameters
+        ----------
+        records : list[dict] or dict[str, list]
+            Attributes of each document
+
+        Yields
+        ------
+        BaseModel
+            Documents in the same order as the records
+        """
+        if isinstance(records, Mapping):
+            records = _rows(records)
+        copy_id = "_id" not in cls._meta.fields
+        shapes = {}
+        for record in records:
+            shape = tuple(record)
             try:
-                try:
-                    model[field] = fclass.callback(**kwargs)
-                except AttributeError:
-                    model[field] = kwargs[field]
+                steps = shapes[shape]
             except KeyError:
-                raise AttributeError(
-                    f"{self.__class__.__name__} model needs {field} attribute"
-                )
-        super().__init__(**model)
+                steps = shapes[shape] = cls._record_steps(shape)
+            document = cls.__new__(cls)
+            _fill_document(document, cls.__name__, steps, copy_id, record)
+            yield document
 
 
 class BaseModelWithExtraFields(BaseModel):
     @classmethod
     def create_extra_fields(cls, **kwargs):
+        """Get the attributes that are not model fields.
+
+        When creating documents with `from_records`, this is called only once
+        for each set of keys, so it must only depend on the keys.
+        """
         if "extra_fields" in kwargs:
             return kwargs["extra_fields"]
         else:
@@ -56,6 +122,9 @@ class Object(BaseModel):
             "coordinates": [kwargs["meanra"] - 180, kwargs["meandec"]],
         }
     )
+    healpix = SpecialField(  # Nested HEALPix pixel of the position
+        lambda **kwargs: ang2pix(HEALPIX_ORDER, kwargs["meanra"], kwargs["meandec"])
+    )
     magstats = SpecialField(lambda **kwargs: kwargs.get("magstats", []))
     features = SpecialField(lambda **kwargs: kwargs.get("features", {}))
     probabilities = SpecialField(lambda **kwargs: kwargs.get("probabilities", []))
@@ -67,6 +136,7 @@ class Object(BaseModel):
         IndexModel([("lastmjd", DESCENDING)], name="lastmjd"),
         IndexModel([("firstmjd", DESCENDING)], name="firstmjd"),
         IndexModel([("loc", GEOSPHERE)], name="radec"),
+        IndexModel([("healpix", ASCENDING)], name="healpix"),
         IndexModel(
             [
                 ("probabilities.classifier_name", ASCENDING),
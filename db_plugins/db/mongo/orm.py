@@ -1,4 +1,5 @@
 """Main classes for using the Mongo ORM"""
+
 from pymongo import MongoClient
 
 
@@ -18,11 +19,60 @@ class Metadata:
         client.drop_database(self.database)
 
 
+def _missing_field(name: str, field: str):
+    """Create the error for a model document without a required attribute."""
+    return AttributeError(f"{name} model needs {field} attribute")
+
+
+def _field_steps(fields: dict):
+    """Split the fields of a model into the steps that fill its documents.
+
+    Each step is a field and, for special fields, its callback (None for plain
+    fields, which are copied from the attributes), keeping the declaration
+    order.
+    """
+    return tuple(
+        (field, fclass.callback if isinstance(fclass, SpecialField) else None)
+        for field, fclass in fields.items()
+    )
+
+
+def _fill_document(document: dict, name: str, steps, copy_id: bool, kwargs: dict):
+    """Fill a model document from its attributes following the steps of its fields."""
+    if copy_id and "_id" in kwargs:
+        document["_id"] = kwargs["_id"]
+    field = None
+    try:
+        for field, callback in steps:
+            if callback is None:
+                document[field] = kwargs[field]
+            else:
+                document[field] = callback(**kwargs)
+    except KeyError:
+        raise _missing_field(name, field) from None
+
+
+def _compile_constructor(name: str, fields: dict):
+    """Create the function that fills a model document from its attributes.
+
+    Fields are split once per model class, so that documents are built
+    without inspecting each field on every instantiation.
+    """
+    steps = _field_steps(fields)
+    copy_id = "_id" not in fields
+
+    def construct(document: dict, kwargs: dict):
+        _fill_document(document, name, steps, copy_id, kwargs)
+
+    return construct
+
+
 class ModelMetadata:
-    def __init__(self, tablename: str, fields: dict, indexes: list):
+    def __init__(self, tablename: str, fields: dict, indexes: list, name: str = None):
         self.tablename = tablename
         self.fields = fields
         self.indexes = indexes
+        self.construct = _compile_constructor(name or tablename, fields)
 
     def __repr__(self):
         dict_repr = {
@@ -53,7 +103,7 @@ class ModelMetaClass(type):
         indexes = attrs.get("__table_args__", [])
 
         mcs.metadata.collections[tablename] = {"indexes": indexes, "fields": fields}
-        cls._meta = ModelMetadata(tablename, fields, indexes)
+        cls._meta = ModelMetadata(tablename, fields, indexes, name)
         return cls
 
     @classmethod
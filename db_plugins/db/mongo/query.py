@@ -1,26 +1,471 @@
+import base64
+import binascii
+import math
+from collections.abc import Sized
+from concurrent.futures import ThreadPoolExecutor
 from itertools import zip_longest
 from typing import Type
 
-from pymongo import UpdateOne
+import bson
+from bson import json_util
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from pymongo.read_preferences import (
+    Nearest,
+    Primary,
+    PrimaryPreferred,
+    Secondary,
+    SecondaryPreferred,
+)
+from pymongo.results import InsertManyResult
 
-from ..generic import BaseQuery, Pagination, PaginationNoCount
+from ..generic import (
+    BaseQuery,
+    CappedCount,
+    Pagination,
+    PaginationNoCount,
+    _normalized_hash,
+)
+from ..healpix import HEALPIX_ORDER, cone_ranges, merge_ranges
+from ..instrumentation import instrumented
+from .bulk import BulkWriteExecutor
 from .models import BaseModel
 
+DUPLICATE_KEY_ERROR = 11000
+POSITION_FIELDS = {"meanra", "meandec"}
+BSON_SAMPLE_INTERVAL = 100  # documents between BSON size samples in bulk inserts
+
 
 class CollectionNotFound(Exception):
     pass
 
 
+def _freeze(value):
+    """Get a hashable version of a document value for matching purposes."""
+    if isinstance(value, dict):
+        return tuple((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _document_chunks(documents, max_count: int = None, max_bytes: int = None):
+    """Split documents in lists with up to `max_count` documents or `max_bytes` of BSON.
+
+    Documents are not encoded to get their sizes. Instead, the size of each
+    one is estimated as the mean BSON size of a sample of the documents (one
+    every `BSON_SAMPLE_INTERVAL`, starting with the first), so chunks of
+    documents with very different sizes can be larger than `max_bytes`
+    (``insert_many`` still splits them as needed). A single document larger
+    than `max_bytes` is yielded in its own chunk.
+    """
+    chunk, size = [], 0
+    sampled, sampled_size = 0, 0
+    for i, document in enumerate(documents):
+        document_size = 0
+        if max_bytes:
+            if i % BSON_SAMPLE_INTERVAL == 0:
+                sampled += 1
+                sampled_size += len(bson.encode(document))
+            document_size = sampled_size / sampled
+        if chunk and max_bytes and size + document_size > max_bytes:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(document)
+        size += document_size
+        if max_count and len(chunk) >= max_count:
+            yield chunk
+            chunk, size = [], 0
+    if chunk:
+        yield chunk
+
+
+def _get_path(document: dict, path: str):
+    """Get the value of a (possibly dotted) field path from a document."""
+    for key in path.split("."):
+        document = document.get(key) if isinstance(document, dict) else None
+    return document
+
+
+def _encode_cursor(document: dict, sort_by: str):
+    """Create an opaque keyset pagination token from the last document of a page."""
+    value = json_util.dumps([_get_path(document, sort_by), document["_id"]])
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def _keyset_match(sort_by: str, sort_direction: int, cursor: str):
+    """Create a filter for the documents after the keyset pagination cursor.
+
+    Documents with null or missing `sort_by` are sorted first in ascending
+    order and last in descending order, but comparisons with null (``$gt``
+    or ``$lt``) match nothing, so they are matched with equality instead.
+    """
+    try:
+        value, _id = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError, TypeError):
+        raise ValueError("Invalid pagination cursor")
+    op = "$gt" if sort_direction == ASCENDING else "$lt"
+    same = {sort_by: value, "_id": {op: _id}}
+    if value is None:
+        if sort_direction == ASCENDING:
+            return {"$or": [same, {sort_by: {"$ne": None}}]}
+        return same
+    after = [{sort_by: {op: value}}, same]
+    if sort_direction != ASCENDING:
+        after.append({sort_by: None})
+    return {"$or": after}
+
+
+def _as_pipeline(filter_by):
+    """Get an aggregation pipeline from a filter dictionary (or pipeline)."""
+    filter_by = filter_by or {}
+    if isinstance(filter_by, dict):
+        return [{"$match": filter_by}]
+    return filter_by
+
+
+def _page_pipeline(filter_by, page, per_page, count, sort_by, sort_direction, cursor):
+    """Create the aggregation pipeline for a page of results."""
+    if sort_by is None:
+        # Calculate number of documents to skip
+        return filter_by + [
+            {"$skip": per_page * (page - 1)},
+            {"$limit": per_page if count else per_page + 1},
+        ]
+    pipeline = list(filter_by)
+    if cursor is not None:
+        pipeline.append({"$match": _keyset_match(sort_by, sort_direction, cursor)})
+    pipeline.append({"$sort": {sort_by: sort_direction, "_id": sort_direction}})
+    pipeline.append({"$limit": per_page + 1})
+    return pipeline
+
+
+def _split_page(items, per_page, count, sort_by):
+    """Get the items of the page, whether there is a next page and its cursor.
+
+    Whether there is a next page is only known (not None) when the pipeline
+    requested an extra item.
+    """
+    has_next, next_cursor = None, None
+    if sort_by is not None or not count:
+        has_next = len(items) > per_page
+        items = items[:per_page]
+        if has_next and sort_by is not None:
+            next_cursor = _encode_cursor(items[-1], sort_by)
+    return items, has_next, next_cursor
+
+
+def _count_pipeline(filter_by: list, limit: int = None):
+    """Create the aggregation pipeline to count the results of another one."""
+    # $sorting can be too slow and is fully irrelevant for counting
+    pipeline = [step for step in filter_by if "$sort" not in step]
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    pipeline.append({"$count": "n"})
+    return pipeline
+
+
+def _cone_filter(ra: float, dec: float, radius_arcsec: float, field: str = "loc"):
+    """Create a filter for the points within a radius of a position (in degrees).
+
+    Points are stored as GeoJSON with RA shifted by -180 degrees (see the
+    ``loc`` field of :class:`Object`), and the radius of ``$centerSphere`` is
+    given in radians.
+    """
+    radius = math.radians(radius_arcsec / 3600)
+    return {field: {"$geoWithin": {"$centerSphere": [[ra - 180, dec], radius]}}}
+
+
+def _healpix_filter(ranges: list, field: str = "healpix"):
+    """Create a filter for the pixels in any of the ranges (excluding the end)."""
+    return {"$or": [{field: {"$gte": start, "$lt": end}} for start, end in ranges]}
+
+
+def _cone_batch_pipeline(cones: list, filter_by: dict = None, ranges: list = None):
+    """Create an aggregation pipeline that matches many cones in one query.
+
+    The first stage selects the points in any of the cones (using the
+    geospatial index), or in any of the HEALPix pixel `ranges` if given, and
+    then ``$facet`` groups them by cone.
+    """
+    match = {"$or": cones} if ranges is None else _healpix_filter(ranges)
+    if filter_by:
+        match = {"$and": [match, filter_by]}
+    facets = {str(i): [{"$match": cone}] for i, cone in enumerate(cones)}
+    return [{"$match": match}, {"$facet": facets}]
+
+
+def _page_arguments(page: int, per_page: int, sort_by: str, cursor: str):
+    """Validate the arguments of a page, getting the normalized page and size."""
+    if cursor is not None and sort_by is None:
+        raise ValueError("A cursor can only be used with 'sort_by'")
+    return max(page, 1), per_page if per_page >= 0 else 10
+
+
+def _page_repeat_arguments(filter_by, count, max_results, sort_by, sort_direction):
+    """Get the arguments of ``paginate`` that other pages of a query must repeat."""
+    return {
+        "filter_by": filter_by,
+        "count": count,
+        "max_results": max_results,
+        "sort_by": sort_by,
+        "sort_direction": sort_direction,
+    }
+
+
+def _is_unfiltered(filter_by: list):
+    """Whether an aggregation pipeline returns all documents of the collection."""
+    return all(step == {"$match": {}} or "$sort" in step for step in filter_by)
+
+
+def _count_key(collection, filter_by: list):
+    """Get the collection name and the hash of the pipeline (without sorting)."""
+    pipeline = [step for step in filter_by if "$sort" not in step]
+    return collection.full_name, _normalized_hash(pipeline)
+
+
+def _new_document(model: Type[BaseModel], filter_by: dict, attrs: dict):
+    """Create a model instance from `attrs`, overridden by the `filter_by` values."""
+    try:
+        return model(**{**attrs, **filter_by})
+    except Exception as e:
+        raise AttributeError(e)
+
+
+def _many_keys(filters: list, documents: list = None):
+    """Validate the arguments of ``get_or_create_many``.
+
+    Returns
+    -------
+    tuple[list[str], callable, list[dict]]
+        Sorted fields of the filters, function to get the key of a document
+        and the additional attributes of each document
+    """
+    documents = documents or [{}] * len(filters)
+    if len(filters) != len(documents):
+        raise ValueError("Length of filters and documents must match")
+    keys = sorted(filters[0])
+    if not keys or any(sorted(filter_) != keys for filter_ in filters):
+        raise ValueError("All filters must have the same non-empty set of fields")
+
+    def get_key(doc):
+        return tuple(_freeze(doc.get(k)) for k in keys)
+
+    return keys, get_key, documents
+
+
+def _keys_query(filters_by_key: dict, keys: list):
+    """Create a filter for the documents matching any of the filters."""
+    if len(keys) == 1:
+        values = [filter_by[keys[0]] for filter_by in filters_by_key.values()]
+        return {keys[0]: {"$in": values}}
+    return {"$or": list(filters_by_key.values())}
+
+
+def _missing_documents(model, filters, documents, item_keys, found):
+    """Create the documents for the keys that were not found (once per key)."""
+    created = {}
+    for filter_by, doc, key in zip(filters, documents, item_keys):
+        if key not in found and key not in created:
+            created[key] = _new_document(model, filter_by, doc)
+    return created
+
+
+def _raced_keys(error: BulkWriteError, created: dict):
+    """Get the keys of the documents that failed to be inserted as duplicates.
+
+    The error is raised again if any insertion failed for another reason.
+    """
+    errors = error.details["writeErrors"]
+    if any(e["code"] != DUPLICATE_KEY_ERROR for e in errors):
+        raise error
+    created_keys = list(created)
+    return {created_keys[e["index"]] for e in errors}
+
+
+def _many_results(item_keys: list, found: dict, created: dict):
+    """Pair each key with its document and whether it was created by this call."""
+    results, seen = [], set()
+    for key in item_keys:
+        if key in found:
+            results.append((found[key], False))
+        else:
+            results.append((created[key], key not in seen))
+            seen.add(key)
+    return results
+
+
+def _bulk_update_model(instances: list, attrs: list, filter_fields: list):
+    """Validate the arguments of ``bulk_update``, getting the model of the instances."""
+    model = type(instances[0])
+    if any(type(instance) != model for instance in instances):
+        raise TypeError("All instances must have the same model class")
+    if len(instances) != len(attrs):
+        raise ValueError("Length of instances and attributes must match")
+    if len(filter_fields) and len(filter_fields) != len(instances):
+        raise ValueError("Length of filter_fields must be 0 or equal to instances")
+    return model
+
+
+def _position_update(instance, attrs: dict):
+    """Add the fields computed from the position (``loc`` and ``healpix``) to an update.
+
+    They are only added for models with those fields when the update changes
+    ``meanra`` or ``meandec``, using the other coordinate of the instance if
+    it is not updated.
+    """
+    fields = getattr(type(instance), "_meta", None)
+    fields = fields.fields if fields else {}
+    if "healpix" not in fields or not POSITION_FIELDS.intersection(attrs):
+        return attrs
+    position = {
+        field: attrs.get(field, instance.get(field)) for field in POSITION_FIELDS
+    }
+    if None in position.values():
+        raise ValueError("Both meanra and meandec are needed to update the position")
+    computed = {
+        field: fields[field].callback(**position)
+        for field in ("loc", "healpix")
+        if field in fields
+    }
+    return {**attrs, **computed}
+
+
+def _update_requests(instances: list, attrs: list, filter_fields: list):
+    """Create the ``UpdateOne`` operations of ``bulk_update``."""
+    return (
+        UpdateOne(filters or instance, {"$set": _position_update(instance, attr)})
+        for instance, attr, filters in zip_longest(instances, attrs, filter_fields)
+    )
+
+
+def _upsert_fields(filter_fields, set_on_insert, add_to_set, replace):
+    """Validate the fields of ``bulk_upsert``, getting them with their defaults."""
+    filter_fields = filter_fields or ["_id"]
+    set_on_insert = set(set_on_insert or [])
+    add_to_set = set(add_to_set or [])
+    if replace and (set_on_insert or add_to_set):
+        raise ValueError("Replacing documents only supports $set semantics")
+    if set_on_insert & add_to_set or set(filter_fields) & (set_on_insert | add_to_set):
+        raise ValueError("Each field can only use one update operator")
+    if "_id" not in filter_fields:
+        set_on_insert.add("_id")
+    return filter_fields, set_on_insert, add_to_set
+
+
+def _upsert_operation(document, filter_fields, set_on_insert, add_to_set, replace):
+    """Create the ``ReplaceOne`` or ``UpdateOne`` operation of a document.
+
+    Returns None if there is nothing to write besides the filter fields.
+    """
+    filters = {field: document[field] for field in filter_fields}
+    if replace:
+        # The _id of an existing document can't be changed by a replacement
+        if "_id" not in filters:
+            document = {k: v for k, v in document.items() if k != "_id"}
+        return ReplaceOne(filters, document, upsert=True)
+    update = {"$set": {}, "$setOnInsert": {}, "$addToSet": {}}
+    for field, value in document.items():
+        if field in filters:
+            continue
+        if field in set_on_insert:
+            update["$setOnInsert"][field] = value
+        elif field in add_to_set:
+            value = value if isinstance(value, list) else [value]
+            update["$addToSet"][field] = {"$each": value}
+        else:
+            update["$set"][field] = value
+    update = {op: fields for op, fields in update.items() if fields}
+    if not update:
+        return None
+    return UpdateOne(filters, update, upsert=True)
+
+
+def _upsert_operations(model, documents, fields, replace):
+    """Create the operations of ``bulk_upsert``, skipping documents without updates.
+
+    All the operations are created before any is sent, so a document without
+    one of the filter fields fails before writing anything.
+    """
+    operations = []
+    for index, document in enumerate(documents):
+        if not isinstance(document, BaseModel):
+            document = model(**document)
+        for field in fields[0]:
+            if field not in document:
+                raise ValueError(f"Document {index} is missing filter field '{field}'")
+        operation = _upsert_operation(document, *fields, replace)
+        if operation is not None:
+            operations.append(operation)
+    return operations
+
+
+def _read_preference(mode, max_staleness: int = None):
+    """Create a pymongo read preference.
+
+    Parameters
+    ----------
+    mode : str or pymongo.read_preferences.ServerMode
+        Name of the mode in camel or snake case (e.g., ``secondaryPreferred``
+        or ``secondary_preferred``) or a pymongo read preference
+    max_staleness : int, optional
+        Maximum replication lag of a secondary in seconds (``maxStalenessSeconds``,
+        at least 90). It can't be used with the primary mode
+
+    Returns
+    -------
+    pymongo.read_preferences.ServerMode
+    """
+    if isinstance(mode, str):
+        try:
+            mode = _READ_PREFERENCES[mode.replace("_", "").lower()]()
+        except KeyError:
+            raise ValueError(f"Unknown read preference '{mode}'")
+    if max_staleness is None:
+        return mode
+    if isinstance(mode, Primary):
+        raise ValueError("Staleness can't be used with the primary read preference")
+    return type(mode)(tag_sets=mode.tag_sets, max_staleness=max_staleness)
+
+
+_READ_PREFERENCES = {
+    "primary": Primary,
+    "primarypreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondarypreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
 class MongoQuery(BaseQuery):
-    def __init__(self, database, model: Type[BaseModel] = None, name: str = None):
+    """Query for the collection of a model (or a collection by name).
+
+    Reads use the read preference of the database unless `read_preference` is
+    given (see :func:`_read_preference`), which is useful to send heavy reads
+    like exports to secondaries. Writes always go to the primary.
+    """
+
+    def __init__(
+        self,
+        database,
+        model: Type[BaseModel] = None,
+        name: str = None,
+        read_preference=None,
+        max_staleness: int = None,
+    ):
         if model and name:
             raise ValueError("Only one of 'model' or 'name' can be defined")
         self.model = model
         self.collection = None
         self._db = database
+        self.read_preference = None
+        if read_preference is not None:
+            self.read_preference = _read_preference(read_preference, max_staleness)
+        elif max_staleness is not None:
+            raise ValueError("'max_staleness' can only be used with 'read_preference'")
         if name:
             # Ignore model and use pure pymongo API
-            self.collection = self._db[name]
+            self.collection = self._with_options(self._db[name])
         elif model:
             # Using custom ORM API
             self.init_collection(model)
@@ -40,12 +485,44 @@ class MongoQuery(BaseQuery):
         """
         if model:
             self.model = model
-            self.collection = self._db[model._meta.tablename]
+            self.collection = self._with_options(self._db[model._meta.tablename])
         elif self.collection is None:
             raise CollectionNotFound(
                 "A valid model must be provided at instantiation or in method call"
             )
 
+    def _span_target(self):
+        return None if self.collection is None else self.collection.name
+
+    def _with_options(self, collection):
+        if self.read_preference is None:
+            return collection
+        return collection.with_options(read_preference=self.read_preference)
+
+    def with_read_preference(self, read_preference, max_staleness: int = None):
+        """Create a copy of the query that reads with another read preference.
+
+        Parameters
+        ----------
+        read_preference : str or pymongo.read_preferences.ServerMode
+            Read preference mode, such as ``secondaryPreferred``
+        max_staleness : int, optional
+            Maximum replication lag of the secondaries in seconds
+
+        Returns
+        -------
+        MongoQuery
+            Query for the same collection
+        """
+        query = MongoQuery(
+            self._db, read_preference=read_preference, max_staleness=max_staleness
+        )
+        query.model = self.model
+        if self.collection is not None:
+            query.collection = query._with_options(self._db[self.collection.name])
+        return query
+
+    @instrumented("mongo")
     def check_exists(self, filter_by: dict = None, model: Type[BaseModel] = None):
         """
         Check if record exists in database.
@@ -66,6 +543,7 @@ class MongoQuery(BaseQuery):
         self.init_collection(model)
         return self.collection.count_documents(filter_by, limit=1) != 0
 
+    @instrumented("mongo")
     def get_or_create(
         self, filter_by: dict = None, model: Type[BaseModel] = None, **kwargs
     ):
@@ -91,18 +569,85 @@ class MongoQuery(BaseQuery):
         if result is not None:
             return result, False
 
-        kwargs.update(filter_by)
+        model_instance = _new_document(self.model, filter_by, kwargs)
         try:
-            model_instance = self.model(**kwargs)
             result = self.collection.insert_one(model_instance)
         except Exception as e:
             raise AttributeError(e)
 
         return result, True
 
+    @instrumented("mongo", documents="filters")
+    def get_or_create_many(
+        self,
+        filters: list,
+        model: Type[BaseModel] = None,
+        documents: list = None,
+    ):
+        """Get or create multiple documents at once.
+
+        Existing documents are searched for with a single query and all the
+        missing ones are created with a single unordered ``insert_many``. All
+        filters must use the same (top-level) fields and only support equality.
+        When a single field is used (e.g., ``_id``), the lookup uses ``$in``.
+
+        Documents inserted by someone else between the lookup and the insertion
+        (duplicate key errors) are retrieved again and reported as not created.
+        Repeated filters within the same call are only created once.
+
+        Parameters
+        ----------
+        filters : list[dict]
+            Attributes for finding each document in the database
+        model : Type[BaseModel]
+            Class of the model to be searched for or created
+        documents : list[dict], optional
+            Additional attributes for creating each document (will be
+            overridden by the corresponding ``filters`` attributes). If
+            defined, it must match the length of `filters`
+
+        Returns
+        -------
+        list[tuple[dict, bool]]
+            For each filter, the document and whether it was created or not
+        """
+        if len(filters) == 0:
+            return []
+        keys, get_key, documents = _many_keys(filters, documents)
+        self.init_collection(model)
+
+        item_keys = [get_key(filter_by) for filter_by in filters]
+        filters_by_key = dict(zip(item_keys, filters))
+        found = self._find_by_keys(filters_by_key, keys, get_key)
+        created = _missing_documents(self.model, filters, documents, item_keys, found)
+
+        if created:
+            try:
+                self.collection.insert_many(list(created.values()), ordered=False)
+            except BulkWriteError as e:
+                raced = _raced_keys(e, created)
+                found.update(
+                    self._find_by_keys(
+                        {k: filters_by_key[k] for k in raced}, keys, get_key
+                    )
+                )
+                if raced.difference(found):  # Duplicated on fields outside filter
+                    raise
+
+        return _many_results(item_keys, found, created)
+
+    def _find_by_keys(self, filters_by_key: dict, keys: list, get_key):
+        """Find documents matching any of the filters, indexed by their key."""
+        query = _keys_query(filters_by_key, keys)
+        return {get_key(doc): doc for doc in self.collection.find(query)}
+
+    @instrumented("mongo")
     def update(self, instance, attrs):
         """Update a document in collection.
 
+        The ``loc`` and ``healpix`` fields of objects are recomputed when
+        `attrs` change their position.
+
         Parameters
         ----------
         instance : BaseModel
@@ -115,9 +660,17 @@ class MongoQuery(BaseQuery):
         pymongo.results.UpdateResult
         """
         self.init_collection(type(instance))
+        attrs = _position_update(instance, attrs)
         return self.collection.update_one(instance, {"$set": attrs})
 
-    def bulk_update(self, instances: list, attrs: list, filter_fields: list = None):
+    @instrumented("mongo", documents="instances")
+    def bulk_update(
+        self,
+        instances: list,
+        attrs: list,
+        filter_fields: list = None,
+        executor: BulkWriteExecutor = None,
+    ):
         """Update multiple documents in a collection at once.
 
         The length of `instances` and `attrs` must be the same.
@@ -126,6 +679,9 @@ class MongoQuery(BaseQuery):
         `instances` and its contents will take precedence over the
         corresponding instance when querying for documents to update.
 
+        As in :meth:`update`, the ``loc`` and ``healpix`` fields of objects
+        are recomputed when the position changes.
+
         Parameters
         ----------
         instances : list[BaseModel]
@@ -134,110 +690,477 @@ class MongoQuery(BaseQuery):
             List with dictionary of fields to update for corresponding instance
         filter_fields : list[dict], optional
             Attributes for finding the document that needs to be updates
+        executor : BulkWriteExecutor, optional
+            Used to send the updates in chunks (possibly in parallel). By
+            default, all updates are sent in a single ``bulk_write``
 
         Returns
         -------
-        pymongo.results.BulkWriteResult
+        pymongo.results.BulkWriteResult or BulkWriteSummary
+            The latter is returned when using an `executor`
         """
         if len(instances) == 0:
             return
-        model = type(instances[0])
-        if any(type(instance) != model for instance in instances):
-            raise TypeError("All instances must have the same model class")
-        if len(instances) != len(attrs):
-            raise ValueError("Length of instances and attributes must match")
         filter_fields = filter_fields or []
-        if len(filter_fields) and len(filter_fields) != len(instances):
-            raise ValueError("Length of filter_fields must be 0 or equal to instances")
+        self.init_collection(_bulk_update_model(instances, attrs, filter_fields))
+
+        requests = _update_requests(instances, attrs, filter_fields)
+        if executor is not None:
+            return executor.execute(self.collection, requests)
+        return self.collection.bulk_write(requests=list(requests), ordered=False)
+
+    @instrumented("mongo", documents="documents", batch_size="chunk_size")
+    def bulk_upsert(
+        self,
+        documents: list,
+        model: Type[BaseModel] = None,
+        filter_fields: list = None,
+        set_on_insert: list = None,
+        add_to_set: list = None,
+        replace: bool = False,
+        chunk_size: int = 1000,
+        executor: BulkWriteExecutor = None,
+    ):
+        """Insert or update multiple documents in a collection at once.
+
+        Raw dictionaries are converted using the model class, while instances
+        of `BaseModel` are used as they are. Each document is searched for
+        using its `filter_fields` values and, by default, the remaining fields
+        are updated with ``$set``. Fields in `set_on_insert` are only written
+        when the document is created (``$setOnInsert``) and values of fields in
+        `add_to_set` are appended to the existing arrays (``$addToSet``).
+        Documents without any field besides `filter_fields` are skipped, and
+        a document without one of the `filter_fields` raises ``ValueError``
+        before any operation is sent.
+
+        The operations are sent as unordered ``bulk_write`` calls with up to
+        `chunk_size` operations each. If any chunk fails, the remaining chunks
+        are still sent and a :class:`BulkWriteExecutionError` is raised at the
+        end. A custom `executor` can be used instead, e.g., to send chunks in
+        parallel or to report failures without raising.
+
+        Parameters
+        ----------
+        documents : list[dict or BaseModel]
+            Documents to be inserted or updated
+        model : Type[BaseModel]
+            Class of the model documents to be upserted
+        filter_fields : list[str], optional
+            Fields used to find the documents. Defaults to ``["_id"]``
+        set_on_insert : list[str], optional
+            Fields that are only set when a new document is inserted. If
+            ``_id`` is not part of `filter_fields`, it is always included
+        add_to_set : list[str], optional
+            Fields whose values (or each element if the value is a list) are
+            added to the existing array in the database
+        replace : bool
+            Whether to replace whole documents (``ReplaceOne``) instead of
+            updating their fields. Cannot be used with `set_on_insert` or
+            `add_to_set`. If ``_id`` is not part of `filter_fields`, it is
+            left out of the replacement, so new documents get a generated one
+        chunk_size : int
+            Maximum number of operations per ``bulk_write`` call (ignored if
+            `executor` is given)
+        executor : BulkWriteExecutor, optional
+            Used to send the operations instead of the default one
+
+        Returns
+        -------
+        BulkWriteSummary
+            Total ``matched_count``, ``modified_count`` and ``upserted_count``
+            among other counts
+        """
+        fields = _upsert_fields(filter_fields, set_on_insert, add_to_set, replace)
+        if len(documents) == 0:
+            return
+        if model is None and isinstance(documents[0], BaseModel):
+            model = type(documents[0])
         self.init_collection(model)
 
-        requests = [
-            UpdateOne(filters or instance, {"$set": attr})
-            for instance, attr, filters in zip_longest(instances, attrs, filter_fields)
-        ]
-        return self.collection.bulk_write(requests=requests, ordered=False)
+        operations = _upsert_operations(self.model, documents, fields, replace)
+        executor = executor or BulkWriteExecutor(chunk_size, raise_on_error=True)
+        return executor.execute(self.collection, operations)
 
-    def bulk_insert(self, documents: list, model: Type[BaseModel] = None):
+    @instrumented("mongo", documents="documents", batch_size="chunk_size")
+    def bulk_insert(
+        self,
+        documents,
+        model: Type[BaseModel] = None,
+        chunk_size: int = None,
+        max_chunk_bytes: int = None,
+        prefetch: bool = False,
+        return_ids: bool = True,
+    ):
         """Insert multiple documents to the database at once.
 
+        Documents are created with :meth:`BaseModel.from_records`, so they can
+        also be given as a column-oriented mapping of lists.
+
+        If `chunk_size` or `max_chunk_bytes` is given, documents can be any
+        iterable (e.g., a generator reading a large file). They are consumed
+        lazily and sent in chunks with unordered ``insert_many`` calls, so only
+        one chunk (two with `prefetch`) is kept in memory at a time. A failed
+        chunk raises ``pymongo.errors.BulkWriteError`` and stops the insertion.
+
         Parameters
         -----------
-        documents : list[dict]
+        documents : iterable[dict] or dict[str, list]
             Documents to be added
         model: Type[BaseModel]
             Class of the model documents to be added
+        chunk_size : int, optional
+            Maximum number of documents per ``insert_many`` call
+        max_chunk_bytes : int, optional
+            Maximum BSON size of the documents in each ``insert_many`` call,
+            estimated from a sample of the documents (see
+            :func:`_document_chunks`)
+        prefetch : bool
+            Whether to build the next chunk while the previous one is being
+            inserted (in a background thread)
+        return_ids : bool
+            Whether to return the inserted ids or only their count (only used
+            when inserting in chunks)
 
         Returns
         -------
-        pymongo.results.InsertManyResult
+        pymongo.results.InsertManyResult or int
+            The number of inserted documents is returned when inserting in
+            chunks without `return_ids`
         """
-        if len(documents) == 0:
+        if isinstance(documents, Sized) and len(documents) == 0:
             return
         self.init_collection(model)
 
-        documents = [self.model(**doc) for doc in documents]
-        return self.collection.insert_many(documents)
+        documents = self.model.from_records(documents)
+        if chunk_size is None and max_chunk_bytes is None:
+            documents = list(documents)
+            if len(documents) == 0:
+                return
+            return self.collection.insert_many(documents)
+
+        inserted_ids, inserted = [], 0
+        for result in self._insert_chunks(
+            _document_chunks(documents, chunk_size, max_chunk_bytes), prefetch
+        ):
+            if return_ids:
+                inserted_ids.extend(result.inserted_ids)
+            inserted += len(result.inserted_ids)
+        if return_ids:
+            return InsertManyResult(inserted_ids, True)
+        return inserted
 
+    def _insert_chunks(self, chunks, prefetch: bool):
+        """Insert each chunk, yielding the results of ``insert_many``."""
+        if not prefetch:
+            for chunk in chunks:
+                yield self.collection.insert_many(chunk, ordered=False)
+            return
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = None
+            for chunk in chunks:
+                if pending is not None:
+                    yield pending.result()
+                pending = pool.submit(self.collection.insert_many, chunk, ordered=False)
+            if pending is not None:
+                yield pending.result()
+
+    @instrumented("mongo")
     def paginate(
-        self, filter_by=None, page=1, per_page=10, count=True, max_results=50000
+        self,
+        filter_by=None,
+        page=1,
+        per_page=10,
+        count=True,
+        max_results=50000,
+        sort_by=None,
+        sort_direction=ASCENDING,
+        cursor=None,
+        count_strategy=None,
+        read_preference=None,
+        max_staleness: int = None,
     ):
         """Return pagination object with selected documents.
 
         https://arpitbhayani.me/blogs/benchmark-and-compare-pagination-approach-in-mongodb
 
+        By default, pages are selected using ``$skip``, which becomes slower for
+        later pages. If `sort_by` is given, keyset pagination is used instead:
+        documents are sorted by `sort_by` and ``_id``, and the next page is
+        requested by passing the ``next_cursor`` of the current page as `cursor`.
+        This way, every page costs the same when `sort_by` is indexed.
+
         Parameters
         -----------
         filter_by : dict, list
             Attributes used to find documents in the database or aggregation pipeline
         page : int
-            Page of the query
+            Page of the query (only used to select documents if not using keyset)
         per_page : int
             Number of items per page
         count : bool
             Whether to count total number of documents in query
         max_results: int
             If counting is used, only count up to this amount of documents
+            (ignored if `count_strategy` is given)
+        sort_by : str, optional
+            Field used for keyset pagination
+        sort_direction : int
+            Either ``pymongo.ASCENDING`` or ``pymongo.DESCENDING``
+        cursor : str, optional
+            Token for the next page in keyset pagination (``None`` for the first page)
+        count_strategy : CountStrategy, optional
+            Strategy used to count the documents, e.g., to use estimates or to
+            cache the totals between pages. Defaults to
+            ``CappedCount(max_results)``
+        read_preference : str or pymongo.read_preferences.ServerMode, optional
+            Read preference for the documents and the count, e.g.,
+            ``secondaryPreferred`` to offload them to secondaries. It is kept
+            by the `next` and `prev` pages
+        max_staleness : int, optional
+            Maximum replication lag of the secondaries in seconds (requires
+            `read_preference`)
 
         Returns
         -------
         Pagination
             Paginated results
         """
-        if page < 1:
-            page = 1
-        if per_page < 0:
-            per_page = 10
+        if read_preference is not None or max_staleness is not None:
+            return self.with_read_preference(read_preference, max_staleness).paginate(
+                filter_by,
+                page,
+                per_page,
+                count,
+                max_results,
+                sort_by,
+                sort_direction,
+                cursor,
+                count_strategy,
+            )
+        page, per_page = _page_arguments(page, per_page, sort_by, cursor)
+        count_strategy = count_strategy or CappedCount(max_results)
 
-        filter_by = filter_by or {}
-        if isinstance(filter_by, dict):
-            filter_by = [{"$match": filter_by}]
-
-        # Calculate number of documents to skip
-        filter_by.append({"$skip": per_page * (page - 1)})
-        filter_by.append({"$limit": per_page if count else per_page + 1})
-        cursor = self.collection.aggregate(filter_by)
+        filter_by = _as_pipeline(filter_by)
+        pipeline = _page_pipeline(
+            filter_by, page, per_page, count, sort_by, sort_direction, cursor
+        )
 
         # Return documents
-        items = list(cursor)
+        items = list(self.collection.aggregate(pipeline))
+        items, has_next, next_cursor = _split_page(items, per_page, count, sort_by)
+        arguments = _page_repeat_arguments(
+            filter_by, count, max_results, sort_by, sort_direction
+        )
+        keyset = sort_by is not None
         if not count:
-            has_next = len(items) > per_page
-            items = items[:-1] if has_next else items
-            return PaginationNoCount(self, page, per_page, items, has_next)
+            return PaginationNoCount(
+                self, page, per_page, items, has_next, next_cursor, arguments, keyset
+            )
         else:
-            filter_by.pop()  # Removes pagination $limit step
-            filter_by.pop()  # Removes pagination $skip step
-            # $sorting can be too slow and is fully irrelevant for counting
-            filter_by = [step for step in filter_by if "$sort" not in step]
-            filter_by.append({"$limit": max_results})
-            filter_by.append({"$count": "n"})
-            summary = list(self.collection.aggregate(filter_by))
-            try:
-                total = summary[0]["n"]
-            except IndexError:
-                total = 0
-            return Pagination(self, page, per_page, total, items)
+            total = count_strategy.count(self, filter_by)
+            return Pagination(
+                self,
+                page,
+                per_page,
+                total,
+                items,
+                next_cursor,
+                count_strategy,
+                arguments,
+                keyset,
+            )
+
+    @instrumented("mongo")
+    def count_results(self, filter_by: list, limit: int = None):
+        """Count the documents returned by an aggregation pipeline.
 
-    def find_one(self, filter_by: dict = None, model: Type[BaseModel] = None, **kwargs):
+        Parameters
+        -----------
+        filter_by : list
+            Aggregation pipeline
+        limit : int, optional
+            Only count up to this amount of documents
+
+        Returns
+        -------
+        int
+            Number of documents
+        """
+        summary = list(self.collection.aggregate(_count_pipeline(filter_by, limit)))
+        try:
+            return summary[0]["n"]
+        except IndexError:
+            return 0
+
+    @instrumented("mongo")
+    def estimated_count(self, filter_by: list):
+        """Get the estimated number of documents in the collection from its metadata.
+
+        It is only available if the aggregation pipeline doesn't filter any
+        documents, otherwise it returns None.
+        """
+        if _is_unfiltered(filter_by):
+            return self.collection.estimated_document_count()
+        return None
+
+    def count_key(self, filter_by: list):
+        """Get the collection name and the hash of the pipeline (without sorting)."""
+        return _count_key(self.collection, filter_by)
+
+    @instrumented("mongo")
+    def cone_search(
+        self,
+        ra: float,
+        dec: float,
+        radius_arcsec: float,
+        filter_by: dict = None,
+        model: Type[BaseModel] = None,
+        limit: int = None,
+        use_healpix: bool = False,
+        read_preference=None,
+        max_staleness: int = None,
+    ):
+        """Find the documents whose ``loc`` is within a radius of a position.
+
+        It uses the ``2dsphere`` index of the ``loc`` field (``radec`` for
+        objects). Coordinates are the usual RA and Dec, the shift of RA in
+        ``loc`` is applied by this method.
+
+        With `use_healpix`, the documents are instead selected with the
+        ``healpix`` index, through the few ranges of pixels that cover the
+        cone, and then filtered by their exact distance. This is faster than
+        the ``2dsphere`` index in dense fields.
+
+        Parameters
+        -----------
+        ra : float
+            Right ascension of the center in degrees (0 to 360)
+        dec : float
+            Declination of the center in degrees
+        radius_arcsec : float
+            Radius of the cone in arcseconds
+        filter_by : dict, optional
+            Additional attributes used to filter the documents
+        model : Type[BaseModel]
+            Class of the model whose collection will be searched
+        limit : int, optional
+            Maximum number of documents to return
+        use_healpix : bool
+            Whether to use the HEALPix pixel index
+        read_preference : str or pymongo.read_preferences.ServerMode, optional
+            Read preference for this query (see :meth:`with_read_preference`)
+        max_staleness : int, optional
+            Maximum replication lag of the secondaries in seconds (requires
+            `read_preference`)
+
+        Returns
+        -------
+        list[dict]
+            Documents within the cone
+        """
+        self.init_collection(model)
+        query = self
+        if read_preference is not None or max_staleness is not None:
+            query = self.with_read_preference(read_preference, max_staleness)
+        filter_by = {**_cone_filter(ra, dec, radius_arcsec), **(filter_by or {})}
+        if not use_healpix:
+            return list(query.collection.find(filter_by, limit=limit or 0))
+        ranges = cone_ranges(ra, dec, radius_arcsec, HEALPIX_ORDER)
+        filter_by = {"$and": [_healpix_filter(ranges), filter_by]}
+        cursor = query.collection.find(filter_by, limit=limit or 0, hint="healpix")
+        return list(cursor)
+
+    @instrumented("mongo", documents="positions", batch_size="batch_size")
+    def cone_search_many(
+        self,
+        positions,
+        radius_arcsec: float,
+        filter_by: dict = None,
+        model: Type[BaseModel] = None,
+        batch_size: int = 100,
+        max_workers: int = 1,
+        use_healpix: bool = False,
+        read_preference=None,
+        max_staleness: int = None,
+    ):
+        """Find the documents within a radius of each of many positions.
+
+        Positions are sent in batches of `batch_size`, each one as a single
+        aggregation that selects the documents in any of its cones and groups
+        them by cone with ``$facet``. Batches are queried by up to
+        `max_workers` threads. The results of a batch must fit in a single
+        document (16 MB), so large radii require smaller batches.
+
+        Parameters
+        -----------
+        positions : iterable[tuple[float, float]]
+            RA and Dec of each position in degrees
+        radius_arcsec : float
+            Radius of the cones in arcseconds
+        filter_by : dict, optional
+            Additional attributes used to filter the documents
+        model : Type[BaseModel]
+            Class of the model whose collection will be searched
+        batch_size : int
+            Number of positions queried together
+        max_workers : int
+            Number of batches queried concurrently
+        use_healpix : bool
+            Whether to select the documents of each batch with the HEALPix
+            pixel index (see :meth:`cone_search`)
+        read_preference : str or pymongo.read_preferences.ServerMode, optional
+            Read preference for these queries (see :meth:`with_read_preference`)
+        max_staleness : int, optional
+            Maximum replication lag of the secondaries in seconds (requires
+            `read_preference`)
+
+        Returns
+        -------
+        list[list[dict]]
+            Documents within the cone of each position, in the same order
+            as the positions
+        """
+        self.init_collection(model)
+        query = self
+        if read_preference is not None or max_staleness is not None:
+            query = self.with_read_preference(read_preference, max_staleness)
+        positions = list(positions)
+        batches = [
+            positions[i : i + batch_size] for i in range(0, len(positions), batch_size)
+        ]
+
+        def search(batch):
+            cones = [_cone_filter(ra, dec, radius_arcsec) for ra, dec in batch]
+            if not use_healpix:
+                pipeline = _cone_batch_pipeline(cones, filter_by)
+                result = query.collection.aggregate(pipeline)
+            else:
+                ranges = merge_ranges(
+                    pixels
+                    for ra, dec in batch
+                    for pixels in cone_ranges(ra, dec, radius_arcsec, HEALPIX_ORDER)
+                )
+                pipeline = _cone_batch_pipeline(cones, filter_by, ranges)
+                result = query.collection.aggregate(pipeline, hint="healpix")
+            result = next(result, {})
+            return [result.get(str(i), []) for i in range(len(batch))]
+
+        if max_workers > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                results = list(pool.map(search, batches))
+        else:
+            results = [search(batch) for batch in batches]
+        return [matches for batch in results for matches in batch]
+
+    @instrumented("mongo")
+    def find_one(
+        self,
+        filter_by: dict = None,
+        model: Type[BaseModel] = None,
+        read_preference=None,
+        max_staleness: int = None,
+        **kwargs,
+    ):
         """Find one item of the specified model.
 
         If there are no items, then it returns None.
@@ -248,6 +1171,11 @@ class MongoQuery(BaseQuery):
             Class of the model to be retrieved
         filter_by : dict
             Attributes used to find object document in the database
+        read_preference : str or pymongo.read_preferences.ServerMode, optional
+            Read preference for this query (see :meth:`with_read_preference`)
+        max_staleness : int, optional
+            Maximum replication lag of the secondaries in seconds (requires
+            `read_preference`)
 
         Returns
         -------
@@ -256,18 +1184,25 @@ class MongoQuery(BaseQuery):
         """
         filter_by = filter_by or {}
         self.init_collection(model)
-        return self.collection.find_one(filter_by, **kwargs)
+        query = self
+        if read_preference is not None or max_staleness is not None:
+            query = self.with_read_preference(read_preference, max_staleness)
+        return query.collection.find_one(filter_by, **kwargs)
 
+    @instrumented("mongo")
     def find_all(
         self,
         filter_by: dict = None,
         model: Type[BaseModel] = None,
         paginate=True,
+        read_preference=None,
+        max_staleness: int = None,
         **kwargs,
     ):
         """Find list of items of the specified model.
 
-        If there are too many items a timeout can happen.
+        If there are too many items a timeout can happen. Large reads, like
+        exports, can be sent to secondaries with `read_preference`.
 
         Parameters
         -----------
@@ -277,6 +1212,11 @@ class MongoQuery(BaseQuery):
             Attributes used to find documents in the database or aggregation pipeline
         paginate : bool
             Whether to get a paginated result
+        read_preference : str or pymongo.read_preferences.ServerMode, optional
+            Read preference for this query (see :meth:`with_read_preference`)
+        max_staleness : int, optional
+            Maximum replication lag of the secondaries in seconds (requires
+            `read_preference`)
         kwargs : dict
             All other arguments are passed to `paginate` and/or
             `pymongo.collection.Collection.aggregate`
@@ -288,14 +1228,15 @@ class MongoQuery(BaseQuery):
             depending on the `paginate` option
         """
         self.init_collection(model)
-        filter_by = filter_by or {}
-        if isinstance(filter_by, dict):
-            filter_by = [{"$match": filter_by}]
+        filter_by = _as_pipeline(filter_by)
+        query = self
+        if read_preference is not None or max_staleness is not None:
+            query = self.with_read_preference(read_preference, max_staleness)
 
         if paginate:
-            return self.paginate(filter_by, **kwargs)
+            return query.paginate(filter_by, **kwargs)
         else:
-            return self.collection.aggregate(filter_by, **kwargs)
+            return query.collection.aggregate(filter_by, **kwargs)
 
     def __repr__(self):
         return f"MongoQuery(model={self.model.__class__.__name__})"
@@ -0,0 +1,162 @@
+"""Log of slow MongoDB commands and SQL statements.
+
+:class:`SlowQueryLog` is an instrumentation listener (see
+:mod:`db_plugins.db.instrumentation`) that records the shape and duration of
+the commands and statements slower than a threshold. A sample of them also
+records their execution plan, obtained in a background thread by running them
+again with ``explain`` (``executionStats`` verbosity) or ``EXPLAIN (ANALYZE,
+BUFFERS)``. Only plain SQL ``SELECT`` statements are explained, without ``WITH``,
+locking clauses or ``INTO``. Records are dictionaries sent to a sink, which is
+any callable.
+
+.. code-block:: python
+
+    from db_plugins.db import instrumentation
+    from db_plugins.db.slow_queries import JSONLinesSink, SlowQueryLog
+
+    listener = instrumentation.instrument_mongo()
+    instrumentation.instrument_engine(sql_conn.engine)
+    mongo_conn.connect(config)
+    listener.client = mongo_conn.client  # Only needed for Mongo plans
+    instrumentation.add_listener(
+        SlowQueryLog(0.5, JSONLinesSink("slow.jsonl"), explain_rate=0.1)
+    )
+"""
+
+import collections
+import datetime
+import json
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LoggingSink:
+    """Sink that logs each record as JSON.
+
+    Parameters
+    ----------
+    logger : logging.Logger, optional
+        Logger used, by default ``db_plugins.slow_queries``
+    level : int
+        Level of the log messages
+    """
+
+    def __init__(self, logger=None, level=logging.WARNING):
+        self.logger = logger or logging.getLogger("db_plugins.slow_queries")
+        self.level = level
+
+    def __call__(self, record):
+        self.logger.log(self.level, "Slow query: %s", json.dumps(record, default=str))
+
+
+class JSONLinesSink:
+    """Sink that appends each record as a line of JSON to a file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock, open(self.path, "a") as file:
+            file.write(line + "\n")
+
+
+class RingBufferSink:
+    """Sink that keeps the last `size` records in memory."""
+
+    def __init__(self, size=1000):
+        self._records = collections.deque(maxlen=size)
+
+    def __call__(self, record):
+        self._records.append(record)
+
+    def records(self):
+        """Get the kept records, from oldest to newest."""
+        return list(self._records)
+
+
+class SlowQueryLog:
+    """Instrumentation listener that records slow commands and statements.
+
+    Only command and statement spans (the ones with a ``statement``) are
+    considered, so MongoDB commands require :func:`instrument_mongo` and SQL
+    statements :func:`instrument_engine`.
+
+    Parameters
+    ----------
+    threshold : float
+        Minimum duration in seconds of the recorded queries
+    sink : callable, optional
+        Receives each record, by default a :class:`LoggingSink`
+    explain_rate : float
+        Fraction of the slow queries whose plan is also recorded. Plans run
+        the query again, so this should be small in production
+    max_pending_explains : int
+        Slow queries are recorded without their plan while this many plans
+        are pending, so that explaining never piles up
+    """
+
+    def __init__(
+        self, threshold=0.1, sink=None, explain_rate=0.0, max_pending_explains=10
+    ):
+        self.threshold = threshold
+        self.sink = sink or LoggingSink()
+        self.explain_rate = explain_rate
+        self.max_pending_explains = max_pending_explains
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        if span.statement is None or span.duration < self.threshold:
+            return
+        record = {
+            "time": datetime.datetime.fromtimestamp(
+                span.start / 1e9, datetime.timezone.utc
+            ).isoformat(),
+            "backend": span.backend,
+            "operation": span.operation,
+            "target": span.target,
+            "duration": span.duration,
+            "documents": span.documents,
+            "statement": span.statement,
+        }
+        executor = self._sample() if span.explain is not None else None
+        if executor is not None:
+            executor.submit(self._explain, record, span.explain)
+        else:
+            self.sink(record)
+
+    def _sample(self):
+        """Get the executor for the plan of a sampled query, or None."""
+        if self.explain_rate <= 0 or random.random() >= self.explain_rate:
+            return None
+        with self._lock:
+            if self._pending >= self.max_pending_explains:
+                return None
+            self._pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="slow-query-explain"
+                )
+            return self._executor
+
+    def _explain(self, record, explain):
+        try:
+            record["plan"] = explain()
+        except Exception as e:
+            record["plan_error"] = repr(e)
+        finally:
+            with self._lock:
+                self._pending -= 1
+        self.sink(record)
+
+    def close(self, wait=True):
+        """Stop the explain thread, waiting for the pending plans by default."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,191 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from ..generic import DatabaseConnection, DatabaseCreator, _chunks
+from .async_query import AsyncSQLQuery
+from .connection import (
+    _copy_columns,
+    _upsert_chunk,
+    engine_options,
+    pool_status,
+    satisfy_keys,
+    settings_map,
+)
+from .models import Base
+
+
+class AsyncSQLConnection(DatabaseConnection):
+    """asyncio version of :class:`SQLConnection`, using an ``AsyncEngine``.
+
+    Instead of a single session, each task opens its own ``AsyncSession``
+    with ``async with conn.session() as session``, so many queries can run
+    concurrently in the same thread.
+    """
+
+    def __init__(self, config=None, engine=None, Base=None, Session=None):
+        self.config = config
+        self.engine = engine
+        self.Base = Base
+        self.Session = Session
+
+    def connect(self, config, base=None, session_options=None, driver="asyncpg"):
+        """
+        Creates the async engine and the session factory.
+
+        Parameters
+        ----------
+        config : dict
+            Database configuration, same as for :meth:`SQLConnection.connect`.
+            (including pool options). If a ``SQLALCHEMY_DATABASE_URL`` is given
+            instead, it must use an async driver
+        base : sqlalchemy.ext.declarative.declarative_base()
+            Base class used by sqlalchemy to create tables
+        session_options : dict
+            Options passed to ``async_sessionmaker``. By default, instances
+            are not expired on commit, since attributes can't be lazy loaded
+            with async sessions
+        driver : str
+            Async driver used to build the URL from the configuration
+
+        Examples
+        --------
+        .. code-block:: python
+
+            conn = AsyncSQLConnection()
+            conn.connect(config)
+            async with conn.session() as session:
+                page = await conn.query(session, Object).paginate(sort_by="firstmjd")
+        """
+        self.config = config
+        if len(satisfy_keys(set(config.keys()))) == 0:
+            self.config["SQLALCHEMY_DATABASE_URL"] = settings_map(self.config, driver)
+        if self.engine is None:
+            url = self.config["SQLALCHEMY_DATABASE_URL"]
+            self.engine = create_async_engine(url, **engine_options(self.config, url))
+        self.Base = base or Base
+        session_options = {"expire_on_commit": False, **(session_options or {})}
+        if self.Session is None:
+            self.Session = async_sessionmaker(bind=self.engine, **session_options)
+
+    def session(self):
+        """Create a new ``AsyncSession``, to be used as an async context manager."""
+        return self.Session()
+
+    def pool_status(self):
+        """Get the state of the connection pool (see :func:`pool_status`)."""
+        return pool_status(self.engine.sync_engine)
+
+    async def create_db(self):
+        async with self.engine.begin() as connection:
+            await connection.run_sync(self.Base.metadata.create_all)
+
+    async def drop_db(self):
+        async with self.engine.begin() as connection:
+            await connection.run_sync(self.Base.metadata.drop_all)
+
+    async def dispose(self):
+        """Close all connections of the engine."""
+        await self.engine.dispose()
+
+    async def copy_insert(
+        self, model, rows, on_conflict_do_nothing=False, columns=None
+    ):
+        """
+        Inserts rows into the table of a model using PostgreSQL ``COPY``.
+
+        See :meth:`SQLConnection.copy_insert`. It requires the ``asyncpg``
+        driver, which sends the rows using the binary ``COPY`` format.
+        Rows are consumed lazily.
+
+        Returns
+        -------
+        int
+            Number of rows inserted in the table
+        """
+        if self.engine.dialect.driver != "asyncpg":
+            raise ValueError("copy_insert requires the asyncpg driver")
+        table = model.__table__
+        columns, rows = _copy_columns(table, rows, columns)
+        records = (
+            (
+                tuple(row.get(column) for column in columns)
+                if isinstance(row, dict)
+                else tuple(row)
+            )
+            for row in rows
+        )
+        async with self.engine.begin() as connection:
+            raw = (await connection.get_raw_connection()).driver_connection
+            if not on_conflict_do_nothing:
+                status = await raw.copy_records_to_table(
+                    table.name,
+                    records=records,
+                    columns=columns,
+                    schema_name=table.schema,
+                )
+                return int(status.split()[-1])
+            preparer = self.engine.dialect.identifier_preparer
+            staging = f"{table.name}_staging"
+            column_list = ", ".join(preparer.quote(column) for column in columns)
+            await connection.exec_driver_sql(
+                f"CREATE TEMPORARY TABLE {preparer.quote(staging)} "
+                f"(LIKE {preparer.format_table(table)} INCLUDING DEFAULTS) "
+                "ON COMMIT DROP"
+            )
+            await raw.copy_records_to_table(staging, records=records, columns=columns)
+            result = await connection.exec_driver_sql(
+                f"INSERT INTO {preparer.format_table(table)} ({column_list}) "
+                f"SELECT {column_list} FROM {preparer.quote(staging)} "
+                "ON CONFLICT DO NOTHING"
+            )
+            return result.rowcount
+
+    async def bulk_upsert(self, model, rows, update_columns=None, chunk_size=10000):
+        """
+        Inserts or updates rows of a model, using its primary key to detect conflicts.
+
+        See :meth:`SQLConnection.bulk_upsert`.
+
+        Returns
+        -------
+        int
+            Number of rows sent to the database (after removing repeated keys)
+        """
+        total = 0
+        async with self.engine.begin() as connection:
+            for chunk in _chunks(rows, chunk_size):
+                statement, chunk = _upsert_chunk(model.__table__, chunk, update_columns)
+                await connection.execute(statement, chunk)
+                total += len(chunk)
+        return total
+
+    def query(self, session, *entities):
+        """
+        Creates an AsyncSQLQuery object for a session, which can be used with
+        the BaseQuery methods like ``get_or_create`` and ``paginate``
+
+        Parameters
+        ----------
+        session : sqlalchemy.ext.asyncio.AsyncSession
+            Session used to run the queries
+        entities : tuple
+            Entities selected by the query, for example a model.
+
+        Examples
+        --------
+        .. code-block:: python
+
+            async with db_conn.session() as session:
+                await db_conn.query(session, Probability).find_all(filter_by=filters)
+                await db_conn.query(session).get_or_create(
+                    model=Object, filter_by=filters
+                )
+                await session.commit()
+        """
+        return AsyncSQLQuery(session, select(*entities) if entities else None)
+
+
+class AsyncSQLDatabaseCreator(DatabaseCreator):
+    @classmethod
+    def create_database(cls) -> AsyncSQLConnection:
+        return AsyncSQLConnection()
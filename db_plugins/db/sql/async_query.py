@@ -0,0 +1,197 @@
+from sqlalchemy import func, select
+
+from ..generic import (
+    ASCENDING,
+    BaseQuery,
+    Pagination,
+    PaginationNoCount,
+    _normalized_hash,
+)
+from .query import _cone_criteria, _page_query, _page_repeat_arguments, _split_page
+
+
+class AsyncSQLQuery(BaseQuery):
+    """asyncio counterpart of :class:`SQLQuery` for an ``AsyncSession``.
+
+    ``AsyncSession`` only supports 2.0 style ``select`` statements, so this
+    class wraps one. The methods `filter`, `filter_by` and `order_by` return
+    a new query with the modified statement, while the methods that access
+    the database are coroutines.
+    """
+
+    def __init__(self, session, statement=None):
+        self.session = session
+        self.statement = statement
+
+    def _derive(self, statement):
+        return AsyncSQLQuery(self.session, statement)
+
+    def _query_for(self, model=None):
+        return self._derive(select(model)) if model else self
+
+    def _entity(self):
+        return self.statement.column_descriptions[0]["entity"]
+
+    def filter(self, *criteria):
+        return self._derive(self.statement.filter(*criteria))
+
+    def filter_by(self, **kwargs):
+        return self._derive(self.statement.filter_by(**kwargs))
+
+    def order_by(self, *clauses):
+        return self._derive(self.statement.order_by(*clauses))
+
+    async def _all(self, statement):
+        result = await self.session.execute(statement)
+        if len(statement.column_descriptions) == 1:
+            return result.scalars().all()
+        return result.all()
+
+    async def check_exists(self, model=None, filter_by=None):
+        """Check if a record exists in the database.
+
+        See :meth:`SQLQuery.check_exists`.
+        """
+        statement = self._query_for(model).statement.filter_by(**(filter_by or {}))
+        return await self.session.scalar(select(statement.exists()))
+
+    async def get_or_create(self, model=None, filter_by=None, **kwargs):
+        """Initialize a model by creating it or getting it from the database.
+
+        See :meth:`SQLQuery.get_or_create`.
+        """
+        model = model or self._entity()
+        filter_by = filter_by or {}
+        instance = await self.session.scalar(
+            select(model).filter_by(**filter_by).limit(1)
+        )
+        if instance is not None:
+            return instance, False
+        instance = model(**{**kwargs, **filter_by})
+        self.session.add(instance)
+        return instance, True
+
+    def update(self, instance, args):
+        """Update a model instance with specified args (not committed)."""
+        for key, value in args.items():
+            setattr(instance, key, value)
+        return instance
+
+    async def bulk_insert(self, objects: list, model=None):
+        """Insert multiple records (as dictionaries) with a single ``executemany``.
+
+        See :meth:`SQLQuery.bulk_insert`.
+        """
+        if len(objects) == 0:
+            return
+        model = model or self._entity()
+        await self.session.execute(model.__table__.insert(), objects)
+
+    async def paginate(
+        self,
+        page=1,
+        per_page=10,
+        count=True,
+        max_results=50000,
+        sort_by=None,
+        sort_direction=ASCENDING,
+        cursor=None,
+        count_strategy=None,
+    ):
+        """Return pagination object with the results of the query.
+
+        See :meth:`SQLQuery.paginate`. Both queries are sent sequentially,
+        since a session uses a single connection. Count strategies are not
+        supported, since they count synchronously.
+
+        Returns
+        -------
+        Pagination
+            Paginated results
+        """
+        if page < 1:
+            page = 1
+        if per_page < 0:
+            per_page = 10
+        if cursor is not None and sort_by is None:
+            raise ValueError("A cursor can only be used with 'sort_by'")
+        if count_strategy is not None:
+            raise ValueError("Count strategies are not supported by async queries")
+
+        statements, columns = _page_query(
+            self.statement,
+            self._entity(),
+            page,
+            per_page,
+            sort_by,
+            sort_direction,
+            cursor,
+        )
+        items = []
+        for statement in statements:
+            items += await self._all(statement.limit(per_page + 1 - len(items)))
+            if len(items) > per_page:
+                break
+        items, has_next, next_cursor = _split_page(items, per_page, columns)
+        arguments = _page_repeat_arguments(count, max_results, sort_by, sort_direction)
+        keyset = sort_by is not None
+        if not count:
+            return PaginationNoCount(
+                self, page, per_page, items, has_next, next_cursor, arguments, keyset
+            )
+        total = await self.count_results(limit=max_results)
+        return Pagination(
+            self,
+            page,
+            per_page,
+            total,
+            items,
+            next_cursor,
+            arguments=arguments,
+            keyset=keyset,
+        )
+
+    async def count_results(self, filter_by=None, limit=None):
+        """Count the results of the query, up to `limit` if defined.
+
+        See :meth:`SQLQuery.count_results`.
+        """
+        statement = self.statement.order_by(None)
+        if limit is not None:
+            statement = statement.limit(limit)
+        return await self.session.scalar(
+            select(func.count()).select_from(statement.subquery())
+        )
+
+    def count_key(self, filter_by=None):
+        """Get the hash of the query statement and its parameters."""
+        compiled = self.statement.order_by(None).compile()
+        return _normalized_hash([str(compiled), compiled.params])
+
+    def cone_search(self, ra, dec, radius_arcsec, model=None, use_healpix=False):
+        """Filter the records whose mean position is within a radius of a position.
+
+        See :meth:`SQLQuery.cone_search`.
+        """
+        query = self._query_for(model)
+        return query.filter(
+            *_cone_criteria(query._entity(), ra, dec, radius_arcsec, use_healpix)
+        )
+
+    async def find_one(self, filter_by=None, model=None, **kwargs):
+        """Retrieve the first record that matches the filters, or None if there are no matches.
+
+        See :meth:`SQLQuery.find_one`.
+        """
+        statement = self._query_for(model).statement.filter_by(**(filter_by or {}))
+        return await self.session.scalar(statement.limit(1))
+
+    async def find_all(self, filter_by=None, model=None, paginate=True, **kwargs):
+        """Retrieve the records that match the filters.
+
+        See :meth:`SQLQuery.find_all`.
+        """
+        query = self._query_for(model).filter_by(**(filter_by or {}))
+        if paginate:
+            return await query.paginate(**kwargs)
+        return await query._all(query.statement)
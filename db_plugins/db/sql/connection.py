@@ -1,8 +1,20 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session, Query
+import datetime
+import functools
+import itertools
+import math
+import threading
+import time
 
-from ..generic import DatabaseConnection, DatabaseCreator
-from .models import Base
+from sqlalchemy import create_engine, make_url
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import NullPool
+
+from ..generic import DatabaseConnection, DatabaseCreator, _chunks
+from ..instrumentation import instrumented
+from .models import Base, _position_healpix
+from .query import SQLQuery
+from .routing import ReplicaRouter, RoutingSession
 
 MAP_KEYS = {"HOST", "USER", "PASSWORD", "PORT", "DB_NAME", "ENGINE"}
 
@@ -11,8 +23,253 @@ def satisfy_keys(config_keys):
     return MAP_KEYS.difference(config_keys)
 
 
-def settings_map(config):
-    return f"{config['ENGINE']}://{config['USER']}:{config['PASSWORD']}@{config['HOST']}:{config['PORT']}/{config['DB_NAME']}"
+def settings_map(config, driver=None):
+    engine = config["ENGINE"]
+    if driver is not None:
+        engine = f"{engine.split('+')[0]}+{driver}"
+    return f"{engine}://{config['USER']}:{config['PASSWORD']}@{config['HOST']}:{config['PORT']}/{config['DB_NAME']}"
+
+
+def _csv_value(value):
+    """Format a single value as a PostgreSQL CSV field (NULL is an empty field)."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "NaN"
+        if math.isinf(value):
+            return "Infinity" if value > 0 else "-Infinity"
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        value = _array_literal(value)
+    elif isinstance(value, (datetime.date, datetime.time)):
+        value = value.isoformat()
+    # Strings are always quoted, so that empty strings are not read as NULL
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _array_literal(values):
+    items = []
+    for value in values:
+        if value is None:
+            items.append("NULL")
+        elif isinstance(value, (list, tuple)):
+            items.append(_array_literal(value))
+        else:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+            items.append(f'"{value}"')
+    return "{" + ",".join(items) + "}"
+
+
+POOL_KEYS = {
+    "POOL_SIZE": "pool_size",
+    "MAX_OVERFLOW": "max_overflow",
+    "POOL_TIMEOUT": "pool_timeout",
+    "POOL_RECYCLE": "pool_recycle",
+    "POOL_PRE_PING": "pool_pre_ping",
+}
+
+
+class _PoolStats:
+    """Number of checkouts and time spent waiting for them in a pool."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def add(self, wait_time):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+
+def _timed_pool_class(pool_class):
+    """Create a subclass of a pool that measures the time spent in each checkout."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return pool_class._do_get(self)
+        finally:
+            self.stats.add(time.perf_counter() - start)
+
+    def __init__(self, *args, **kwargs):
+        pool_class.__init__(self, *args, **kwargs)
+        self.stats = _PoolStats()
+
+    return type(
+        f"Timed{pool_class.__name__}",
+        (pool_class,),
+        {"__init__": __init__, "_do_get": _do_get},
+    )
+
+
+def engine_options(config, url):
+    """Get the keyword arguments for creating an engine from the configuration.
+
+    Pool options are given with the keys in `POOL_KEYS`. ``NULL_POOL`` disables
+    pooling (e.g., when using PgBouncer in transaction mode), and
+    ``STATEMENT_TIMEOUT_MS`` sets the PostgreSQL ``statement_timeout`` of each
+    connection.
+    """
+    url = make_url(url)
+    options = {key: config[name] for name, key in POOL_KEYS.items() if name in config}
+    if config.get("NULL_POOL"):
+        pool_class = NullPool
+        for key in ("pool_size", "max_overflow", "pool_timeout"):
+            options.pop(key, None)
+    else:
+        pool_class = url.get_dialect().get_pool_class(url)
+    options["poolclass"] = _timed_pool_class(pool_class)
+    timeout = config.get("STATEMENT_TIMEOUT_MS")
+    if timeout is not None:
+        if url.get_driver_name() == "asyncpg":
+            connect_args = {"server_settings": {"statement_timeout": str(timeout)}}
+        else:
+            connect_args = {"options": f"-c statement_timeout={timeout}"}
+        options["connect_args"] = connect_args
+    return options
+
+
+def pool_status(engine):
+    """Get the state of the connection pool of an engine.
+
+    Returns the pool class, its size, the connections checked in and out,
+    the overflow and, for pools created with `engine_options`, the number of
+    checkouts and the total and maximum time waited for them (in seconds).
+    """
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+    for key, method in [
+        ("size", "size"),
+        ("checked_in", "checkedin"),
+        ("checked_out", "checkedout"),
+        ("overflow", "overflow"),
+    ]:
+        value = getattr(pool, method, None)
+        if callable(value):
+            status[key] = value()
+    stats = getattr(pool, "stats", None)
+    if stats is not None:
+        status["checkouts"] = stats.checkouts
+        status["wait_time"] = stats.wait_time
+        status["max_wait_time"] = stats.max_wait_time
+    return status
+
+
+POSITION_COLUMNS = {"meanra", "meandec"}
+
+
+def _needs_healpix(table, row: dict):
+    """Whether the pixel of a row must be computed from its position."""
+    return (
+        "healpix" in table.columns
+        and "healpix" not in row
+        and POSITION_COLUMNS.issubset(row)
+    )
+
+
+def _with_healpix(row: dict):
+    """Get a copy of the row with the pixel of its position (None without one)."""
+    return {
+        **row,
+        "healpix": _position_healpix(row.get("meanra"), row.get("meandec")),
+    }
+
+
+def _upsert_chunk(table, chunk, update_columns=None):
+    """Get the upsert statement for a chunk of rows and the rows without repeated keys.
+
+    The ``healpix`` column is computed and updated for rows with a position.
+    """
+    primary_key = [column.name for column in table.primary_key.columns]
+    if _needs_healpix(table, chunk[0]):
+        chunk = [_with_healpix(row) for row in chunk]
+    columns = update_columns
+    if columns is None:
+        columns = [key for key in chunk[0] if key not in primary_key]
+    elif "healpix" in chunk[0] and POSITION_COLUMNS.intersection(columns):
+        columns = list(columns) + ["healpix"]
+    statement = insert(table)
+    if columns:
+        statement = statement.on_conflict_do_update(
+            index_elements=primary_key,
+            set_={column: statement.excluded[column] for column in columns},
+        )
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=primary_key)
+    # Postgres can't update the same row twice in a single statement
+    chunk = {tuple(row[key] for key in primary_key): row for row in chunk}
+    return statement, list(chunk.values())
+
+
+def _copy_columns(table, rows, columns=None):
+    """Get the columns sent by ``COPY`` and the rows (the first one may be peeked).
+
+    Unless `columns` is given, these are the table columns found in the first
+    row if it is a dictionary, or all the table columns otherwise. Columns
+    left out of ``COPY`` get their server defaults. The ``healpix`` column is
+    computed for dictionary rows if the first one has a position (and no
+    pixel), and it is NULL for later rows without a complete position.
+    """
+    if columns is not None:
+        return list(columns), rows
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return [column.name for column in table.columns], []
+    columns = [column.name for column in table.columns]
+    rows = itertools.chain([first], rows)
+    if isinstance(first, dict):
+        if _needs_healpix(table, first):
+            first = _with_healpix(first)
+            rows = map(_with_healpix, rows)
+        columns = [column for column in columns if column in first]
+    return columns, rows
+
+
+class _CopyStream:
+    """File-like object that lazily serializes rows as CSV for ``COPY``.
+
+    Rows can be dictionaries (missing columns are NULL) or sequences with
+    values in the same order as `columns`.
+    """
+
+    def __init__(self, rows, columns):
+        self._rows = iter(rows)
+        self._columns = columns
+        self._pending = ""
+
+    def _format(self, row):
+        if isinstance(row, dict):
+            row = [row.get(column) for column in self._columns]
+        elif len(row) != len(self._columns):
+            raise ValueError(
+                f"Expected {len(self._columns)} values per row, got {len(row)}"
+            )
+        return ",".join(_csv_value(value) for value in row) + "\n"
+
+    def read(self, size=-1):
+        chunks, length = [self._pending], len(self._pending)
+        for row in self._rows:
+            line = self._format(row)
+            chunks.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        data = "".join(chunks)
+        if size < 0:
+            self._pending = ""
+            return data
+        self._pending = data[size:]
+        return data[:size]
 
 
 class SQLConnection(DatabaseConnection):
@@ -23,6 +280,7 @@ class SQLConnection(DatabaseConnection):
         self.Session = Session
         self.session = session
         self.use_scoped = False
+        self.router = None
 
     def connect(
         self,
@@ -51,6 +309,19 @@ class SQLConnection(DatabaseConnection):
                     "PORT": 5432, # postgresql tipically runs on port 5432. Notice that we use an int here.
                     "DB_NAME": "database",
                 }
+
+            It can also include the connection pool options ``POOL_SIZE``,
+            ``MAX_OVERFLOW``, ``POOL_TIMEOUT``, ``POOL_RECYCLE`` and
+            ``POOL_PRE_PING``, ``NULL_POOL`` (to disable pooling, e.g., when
+            using PgBouncer in transaction mode) and ``STATEMENT_TIMEOUT_MS``.
+            See :func:`engine_options`.
+
+            Read replicas are given with ``REPLICAS``, a list of URLs or of
+            configurations (which override the keys of the primary one).
+            ``REPLICA_STRATEGY`` is either ``round_robin`` (default) or
+            ``least_connections`` and ``MAX_REPLICA_LAG_S`` is the maximum
+            replication lag before falling back to the primary. See
+            :class:`ReplicaRouter`
         base : sqlalchemy.ext.declarative.declarative_base()
             Base class used by sqlalchemy to create tables
         session_options : dict
@@ -79,18 +350,39 @@ class SQLConnection(DatabaseConnection):
         self.config = config
         if len(satisfy_keys(set(config.keys()))) == 0:
             self.config["SQLALCHEMY_DATABASE_URL"] = settings_map(self.config)
-        self.engine = self.engine or create_engine(
-            self.config["SQLALCHEMY_DATABASE_URL"]
-        )
+        if self.engine is None:
+            url = self.config["SQLALCHEMY_DATABASE_URL"]
+            self.engine = create_engine(url, **engine_options(self.config, url))
         self.Base = base or Base
         session_options = session_options or {}
-        session_options["query_cls"] = Query
+        session_options["query_cls"] = SQLQuery
+        replicas = [
+            create_engine(url, **engine_options(self.config, url))
+            for url in map(self._replica_url, self.config.get("REPLICAS", []))
+        ]
+        if replicas:
+            self.router = ReplicaRouter(
+                self.engine,
+                replicas,
+                strategy=self.config.get("REPLICA_STRATEGY", "round_robin"),
+                max_lag=self.config.get("MAX_REPLICA_LAG_S"),
+            )
+            session_options.update(class_=RoutingSession, router=self.router)
         if self.Session is None:
             self.Session = sessionmaker(bind=self.engine, **session_options)
         if create_session:
             self.create_session(use_scoped, scope_func)
 
-    def create_session(self, use_scoped, scope_func=None):
+    def _replica_url(self, replica):
+        if isinstance(replica, str):
+            return replica
+        return settings_map({**self.config, **replica})
+
+    def pool_status(self):
+        """Get the state of the connection pool (see :func:`pool_status`)."""
+        return pool_status(self.engine)
+
+    def create_session(self, use_scoped, scope_func=None, read_only=False):
         """
         Creates a SQLAlchemy Session object to interact with the database.
 
@@ -101,19 +393,27 @@ class SQLConnection(DatabaseConnection):
             Read more about scoped sessions at: `<https://docs.sqlalchemy.org/en/13/orm/contextual.html?highlight=scoped>`_
         scope_func : function
             A function which serves as the scope for the session. The session will live only in the scope of that function.
+        read_only : Boolean
+            Whether all queries of the session are sent to the read replicas (if any).
+            Flushes still use the primary database.
         """
+        session_factory = self.Session
+        if read_only and self.router is not None:
+            session_factory = functools.partial(self.Session, read_only=True)
         if not use_scoped:
-            self._create_unscoped_session()
+            self._create_unscoped_session(session_factory)
         else:
-            self._create_scoped_session(scope_func)
+            self._create_scoped_session(scope_func, session_factory)
 
-    def _create_scoped_session(self, scope_func):
-        self.session = scoped_session(self.Session, scopefunc=scope_func)
-        self.Base.query = self.session.query_property(query_cls=Query)
+    def _create_scoped_session(self, scope_func, session_factory=None):
+        self.session = scoped_session(
+            session_factory or self.Session, scopefunc=scope_func
+        )
+        self.Base.query = self.session.query_property(query_cls=SQLQuery)
         self.use_scoped = True
 
-    def _create_unscoped_session(self):
-        self.session = self.Session()
+    def _create_unscoped_session(self, session_factory=None):
+        self.session = (session_factory or self.Session)()
 
     def end_session(self):
         if self.use_scoped:
@@ -122,21 +422,160 @@ class SQLConnection(DatabaseConnection):
             self.session.close()
         self.session = None
 
+    def dispose(self):
+        """Close all connections of the primary and replica engines."""
+        self.engine.dispose()
+        if self.router is not None:
+            self.router.dispose()
+
     def create_db(self):
         self.Base.metadata.create_all(bind=self.engine)
 
     def drop_db(self):
         self.Base.metadata.drop_all(bind=self.engine)
 
-    def query(self, *args):
+    @instrumented("sql", documents="rows")
+    def copy_insert(
+        self,
+        model,
+        rows,
+        on_conflict_do_nothing=False,
+        buffer_size=65536,
+        columns=None,
+    ):
+        """
+        Inserts rows into the table of a model using PostgreSQL ``COPY FROM STDIN``.
+
+        Rows are serialized lazily as CSV while they are sent, so any iterable
+        can be used without loading all rows in memory. Everything runs in its
+        own transaction (independent of the session).
+
+        Only the columns in the first row (if it is a dictionary) or in
+        `columns` are copied, so the rest get their server defaults. Python
+        side defaults of the models (``default=`` in ``Column``) are not
+        applied by ``COPY``, except for the ``healpix`` pixel of objects,
+        which is computed for dictionary rows with ``meanra`` and ``meandec``.
+
+        Parameters
+        ----------
+        model : Base
+            Model class whose table will receive the rows
+        rows : iterable[dict or tuple]
+            Rows to insert. Dictionaries are matched by column name (columns
+            of the first row missing in a later row are set to NULL), while
+            tuples must have one value per copied column, in the same order
+            as the table definition (or as `columns`)
+        on_conflict_do_nothing : Boolean
+            Whether to copy into a temporary staging table first and then
+            move the rows using ``INSERT ... ON CONFLICT DO NOTHING``, so that
+            duplicated primary keys are ignored instead of aborting the copy
+        buffer_size : int
+            Size of the chunks read from the rows stream during the copy
+        columns : list[str], optional
+            Names of the copied columns, in the order of the values of tuple
+            rows. By default, the table columns of the first row are used
+            (all of them for tuple rows)
+
+        Returns
+        -------
+        int
+            Number of rows inserted in the table
+
+        Examples
+        --------
+        .. code-block:: python
+
+            db_conn.copy_insert(Detection, detections, on_conflict_do_nothing=True)
+        """
+        preparer = self.engine.dialect.identifier_preparer
+        columns, rows = _copy_columns(model.__table__, rows, columns)
+        column_list = ", ".join(preparer.quote(column) for column in columns)
+        table = preparer.format_table(model.__table__)
+        stream = _CopyStream(rows, columns)
+        with self.engine.begin() as connection:
+            cursor = connection.connection.cursor()
+            try:
+                if not on_conflict_do_nothing:
+                    cursor.copy_expert(
+                        f"COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv)",
+                        stream,
+                        size=buffer_size,
+                    )
+                    return cursor.rowcount
+                staging = preparer.quote(f"{model.__table__.name}_staging")
+                cursor.execute(
+                    f"CREATE TEMPORARY TABLE {staging} "
+                    f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP"
+                )
+                cursor.copy_expert(
+                    f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)",
+                    stream,
+                    size=buffer_size,
+                )
+                cursor.execute(
+                    f"INSERT INTO {table} ({column_list}) "
+                    f"SELECT {column_list} FROM {staging} ON CONFLICT DO NOTHING"
+                )
+                return cursor.rowcount
+            finally:
+                cursor.close()
+
+    @instrumented("sql", documents="rows", batch_size="chunk_size")
+    def bulk_upsert(self, model, rows, update_columns=None, chunk_size=10000):
+        """
+        Inserts or updates rows of a model, using its primary key to detect conflicts.
+
+        Each chunk of rows is sent as a single ``executemany`` of
+        ``INSERT ... ON CONFLICT (primary key) DO UPDATE SET col = EXCLUDED.col``,
+        which SQLAlchemy batches as multi-row ``VALUES`` statements. If a chunk
+        has repeated primary keys, only the last row is kept. Everything runs in
+        its own transaction (independent of the session). The ``healpix``
+        pixel of objects is computed (and updated) for rows with ``meanra``
+        and ``meandec``.
+
+        Parameters
+        ----------
+        model : Base
+            Model class whose table will receive the rows
+        rows : iterable[dict]
+            Rows to insert or update. All rows must have the same keys
+        update_columns : list[str]
+            Columns updated when a row already exists. By default, all non
+            primary key columns in the rows are updated. If there are no columns
+            to update, conflicting rows are ignored (``DO NOTHING``)
+        chunk_size : int
+            Maximum number of rows per ``executemany``
+
+        Returns
+        -------
+        int
+            Number of rows sent to the database (after removing repeated keys)
+
+        Examples
+        --------
+        .. code-block:: python
+
+            db_conn.bulk_upsert(Feature, features, update_columns=["value"])
+        """
+        total = 0
+        with self.engine.begin() as connection:
+            for chunk in _chunks(rows, chunk_size):
+                statement, chunk = _upsert_chunk(model.__table__, chunk, update_columns)
+                connection.execute(statement, chunk)
+                total += len(chunk)
+        return total
+
+    def query(self, *args, read_only=False):
         """
-        Creates a BaseQuery object that allows you to query the database using the SQLAlchemy API,
-        or using the BaseQuery methods like ``get_or_create``
+        Creates a SQLQuery object that allows you to query the database using the SQLAlchemy API,
+        or using the BaseQuery methods like ``get_or_create`` and ``paginate``
 
         Parameters
         ----------
         args : tuple
             Args you can pass to SQLALchemy Query class, for example a model.
+        read_only : Boolean
+            Whether to send the query to a read replica (if any)
 
         Examples
         --------
@@ -145,10 +584,20 @@ class SQLConnection(DatabaseConnection):
             # Using SQLAlchemy API
             db_conn.query(Probability).all()
             # Using db-plugins
-            db_conn.query(Probability).find(filter_by=**filters)
-            db_conn.query().get_or_create(model=Object, filter_by=**filters)
+            db_conn.query(Probability).find_all(filter_by=filters)
+            db_conn.query().get_or_create(model=Object, filter_by=filters)
+            # Keyset pagination
+            page = db_conn.query(Object).paginate(sort_by="firstmjd")
+            db_conn.query(Object).paginate(
+                sort_by="firstmjd", cursor=page.next_cursor
+            )
+            # Read from a replica
+            db_conn.query(Detection, read_only=True).filter_by(oid=oid).all()
         """
-        return self.session.query(*args)
+        query = self.session.query(*args)
+        if read_only:
+            query = query.execution_options(read_only=True)
+        return query
 
 
 class SQLDatabaseCreator(DatabaseCreator):
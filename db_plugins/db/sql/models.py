@@ -12,8 +12,11 @@ from sqlalchemy import (
     ForeignKeyConstraint,
 )
 
+from sqlalchemy import event, inspect
 from sqlalchemy.orm import declarative_base
 
+from ..healpix import HEALPIX_ORDER, ang2pix
+
 Base = declarative_base()
 
 
@@ -32,6 +35,19 @@ class Step(Base):
     date = Column(DateTime, nullable=False)
 
 
+def _position_healpix(ra, dec):
+    """Compute the HEALPix pixel of a position (None if it is incomplete)."""
+    if ra is None or dec is None:
+        return None
+    return ang2pix(HEALPIX_ORDER, ra, dec)
+
+
+def _healpix(context):
+    """Compute the HEALPix pixel of an inserted object from its mean position."""
+    parameters = context.get_current_parameters()
+    return _position_healpix(parameters.get("meanra"), parameters.get("meandec"))
+
+
 class Object(Base):
     __tablename__ = "object"
 
@@ -57,6 +73,7 @@ class Object(Base):
     step_id_corr = Column(String)
     diffpos = Column(Boolean)
     reference_change = Column(Boolean)
+    healpix = Column(BigInteger, default=_healpix)  # Nested pixel of the position
 
     __table_args__ = (
         Index("ix_object_ndet", "ndet", postgresql_using="btree"),
@@ -65,12 +82,27 @@ class Object(Base):
         Index("ix_object_g_r_mean_corr", "g_r_mean_corr", postgresql_using="btree"),
         Index("ix_object_meanra", "meanra", postgresql_using="btree"),
         Index("ix_object_meandec", "meandec", postgresql_using="btree"),
+        Index("ix_object_healpix", "healpix", postgresql_using="btree"),
     )
 
     def __repr__(self):
         return "<Object(oid='%s')>" % (self.oid)
 
 
+@event.listens_for(Object, "before_update")
+def _update_healpix(mapper, connection, target):
+    """Recompute the pixel of an object whose position changed in the session.
+
+    ``UPDATE`` statements of flushes only have the changed columns, so the
+    pixel can't be computed by an ``onupdate`` default. Bulk writes (see
+    :meth:`SQLConnection.bulk_upsert` and :meth:`SQLConnection.copy_insert`)
+    compute it from the rows instead.
+    """
+    state = inspect(target)
+    if any(state.attrs[key].history.has_changes() for key in ("meanra", "meandec")):
+        target.healpix = _position_healpix(target.meanra, target.meandec)
+
+
 class Taxonomy(Base):
     __tablename__ = "taxonomy"
     classifier_name = Column(String, primary_key=True)
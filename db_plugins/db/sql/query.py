@@ -0,0 +1,472 @@
+import base64
+import binascii
+import json
+import math
+import operator
+from collections.abc import Mapping
+
+from sqlalchemy import Table, and_, func, inspect, or_, text, tuple_
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Query
+
+from ..generic import (
+    ASCENDING,
+    DESCENDING,
+    BaseQuery,
+    CappedCount,
+    Pagination,
+    PaginationNoCount,
+    _normalized_hash,
+)
+from ..healpix import HEALPIX_ORDER, cone_ranges
+from ..instrumentation import instrumented
+
+
+def _encode_cursor(values: list):
+    """Create an opaque keyset pagination token from the keys of the last item."""
+    value = json.dumps(values, default=str)
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def _decode_cursor(cursor: str, size: int):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError, TypeError):
+        raise ValueError("Invalid pagination cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid pagination cursor")
+    return values
+
+
+def _keyset_criteria(column, keys, values, descending):
+    """Create the filters for the rows after the keyset pagination cursor.
+
+    Rows are sorted as in a btree index on `column`, with NULL values last in
+    ascending order and first in descending order. Each filter selects a
+    single range of that index: either rows with a value, compared as a row
+    value such as ``(firstmjd, oid) > (:firstmjd, :oid)``, or rows with NULL,
+    compared by primary key. The page continues with the next filter when
+    the rows of the previous one run out.
+    """
+    value, key_values = values[0], values[1:]
+    after = operator.lt if descending else operator.gt
+    if value is None:
+        criteria = [and_(column.is_(None), after(tuple_(*keys), tuple_(*key_values)))]
+        if descending:
+            criteria.append(column.is_not(None))
+        return criteria
+    criteria = [after(tuple_(column, *keys), tuple_(value, *key_values))]
+    if not descending and getattr(column, "nullable", True):
+        criteria.append(column.is_(None))
+    return criteria
+
+
+def _page_query(query, entity, page, per_page, sort_by, sort_direction, cursor):
+    """Create the queries that select a page of results, in order.
+
+    Works with both ``Query`` and ``Select`` objects. Returns the queries,
+    without a limit, and the columns used for keyset pagination (empty when
+    using offset). The page is taken from the queries in order until it
+    has `per_page` results plus one, to know if there is a next page.
+    """
+    if sort_by is None:
+        return [query.offset(per_page * (page - 1))], []
+    if isinstance(sort_by, str):
+        sort_by = getattr(entity, sort_by)
+    keys = list(inspect(entity).primary_key)
+    columns = [sort_by] + keys
+    descending = sort_direction == DESCENDING
+    order = [column.desc() if descending else column for column in columns]
+    if getattr(sort_by, "nullable", True):
+        order[0] = order[0].nulls_first() if descending else order[0].nulls_last()
+    query = query.order_by(None).order_by(*order)
+    if cursor is None:
+        return [query], columns
+    values = _decode_cursor(cursor, len(columns))
+    criteria = _keyset_criteria(sort_by, keys, values, descending)
+    return [query.filter(criterion) for criterion in criteria], columns
+
+
+def _page_repeat_arguments(count, max_results, sort_by, sort_direction):
+    """Get the arguments of ``paginate`` that other pages of a query must repeat."""
+    return {
+        "count": count,
+        "max_results": max_results,
+        "sort_by": sort_by,
+        "sort_direction": sort_direction,
+    }
+
+
+def _split_page(items, per_page, columns):
+    """Get the items of the page, whether there is a next page and its cursor."""
+    has_next = len(items) > per_page
+    items = items[:per_page]
+    next_cursor = None
+    if has_next and columns:
+        next_cursor = _encode_cursor(
+            [getattr(items[-1], column.key) for column in columns]
+        )
+    return items, has_next, next_cursor
+
+
+def _estimated_rows(connection, statement):
+    """Get the rows of a statement estimated by PostgreSQL (or None)."""
+    froms = statement.get_final_froms()
+    if statement.whereclause is None and len(froms) == 1:
+        if isinstance(froms[0], Table):
+            total = connection.execute(
+                text(
+                    "SELECT reltuples::bigint FROM pg_class "
+                    "WHERE oid = CAST(:table AS regclass)"
+                ),
+                {"table": froms[0].fullname},
+            ).scalar()
+            if total is not None and total >= 0:
+                return total
+    # Expanding parameters (e.g., from ``in_``) are only rendered on execution
+    compiled = statement.compile(
+        dialect=connection.dialect, compile_kwargs={"render_postcompile": True}
+    )
+    plan = connection.exec_driver_sql(
+        f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+    ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def _cone_criteria(entity, ra, dec, radius_arcsec, use_healpix):
+    """Get the criteria for the records whose mean position is within a cone.
+
+    Candidates are selected with the ranges of HEALPix pixels that cover the
+    cone, or with a declination band, and then filtered by their haversine
+    distance (compared without the inverse functions).
+    """
+    radius = radius_arcsec / 3600
+    if use_healpix:
+        ranges = cone_ranges(ra, dec, radius_arcsec, HEALPIX_ORDER)
+        candidates = or_(
+            *[
+                and_(entity.healpix >= start, entity.healpix < end)
+                for start, end in ranges
+            ]
+        )
+    else:
+        candidates = entity.meandec.between(dec - radius, dec + radius)
+    ddec = func.sin(func.radians(entity.meandec - dec) / 2)
+    dra = func.sin(func.radians(entity.meanra - ra) / 2)
+    cos_dec = func.cos(func.radians(entity.meandec)) * math.cos(math.radians(dec))
+    haversine = ddec * ddec + cos_dec * dra * dra
+    return candidates, haversine <= math.sin(math.radians(radius) / 2) ** 2
+
+
+class SQLQuery(BaseQuery, Query):
+    """SQLAlchemy Query with the methods defined in :class:`BaseQuery`.
+
+    It is used by :class:`SQLConnection` sessions, so that any query created
+    with ``db_conn.query(Model)`` can use both APIs.
+    """
+
+    def _query_for(self, model=None):
+        return self.session.query(model) if model else self
+
+    def _entity(self):
+        return self.column_descriptions[0]["entity"]
+
+    def _span_target(self):
+        descriptions = self.column_descriptions
+        entity = descriptions[0]["entity"] if descriptions else None
+        return getattr(entity, "__tablename__", None)
+
+    @instrumented("sql")
+    def check_exists(self, model=None, filter_by=None):
+        """Check if a record exists in the database.
+
+        Parameters
+        ----------
+        model : Base
+            Model class to be searched for (uses the query entity by default)
+        filter_by : dict
+            Attributes used to find the record
+
+        Returns
+        -------
+        bool
+            Whether the record exists or not
+        """
+        query = self._query_for(model).filter_by(**(filter_by or {}))
+        return self.session.query(query.exists()).scalar()
+
+    @instrumented("sql")
+    def get_or_create(self, model=None, filter_by=None, **kwargs):
+        """Initialize a model by creating it or getting it from the database.
+
+        New instances are added to the session, but not committed.
+
+        Parameters
+        ----------
+        model : Base
+            Model class to be searched for or created (uses the query entity by default)
+        filter_by : dict
+            Attributes used to find the record
+        **kwargs
+            Additional attributes for creating the record (will be overridden by ``filter_by`` attributes)
+
+        Returns
+        -------
+        tuple[Base, bool]
+            The model instance and whether it was created or not
+        """
+        model = model or self._entity()
+        filter_by = filter_by or {}
+        instance = self.session.query(model).filter_by(**filter_by).first()
+        if instance is not None:
+            return instance, False
+        instance = model(**{**kwargs, **filter_by})
+        self.session.add(instance)
+        return instance, True
+
+    def update(self, instance, args=None, **kwargs):
+        """Update a model instance with specified args (not committed).
+
+        When called with a single mapping of values, as in
+        ``query.filter_by(oid="ZTF1").update({"ndet": 2})``, this behaves as
+        SQLAlchemy's bulk ``Query.update`` and returns the number of rows
+        matched. A second positional argument is then taken as the
+        `synchronize_session` strategy.
+
+        Parameters
+        ----------
+        instance : Base or dict
+            Model instance to update, or values for a bulk update
+        args : dict or str
+            Attributes to set on the instance
+        """
+        if isinstance(instance, Mapping):
+            if args is not None:
+                kwargs["synchronize_session"] = args
+            return Query.update(self, instance, **kwargs)
+        for key, value in args.items():
+            setattr(instance, key, value)
+        return instance
+
+    @instrumented("sql", documents="objects")
+    def bulk_insert(self, objects: list, model=None):
+        """Insert multiple records (as dictionaries) with a single ``executemany``.
+
+        Parameters
+        ----------
+        objects : list[dict]
+            Records to be inserted
+        model : Base
+            Model class of the records (uses the query entity by default)
+        """
+        if len(objects) == 0:
+            return
+        model = model or self._entity()
+        self.session.execute(model.__table__.insert(), objects)
+
+    @instrumented("sql")
+    def paginate(
+        self,
+        page=1,
+        per_page=10,
+        count=True,
+        max_results=50000,
+        sort_by=None,
+        sort_direction=ASCENDING,
+        cursor=None,
+        count_strategy=None,
+    ):
+        """Return pagination object with the results of the query.
+
+        By default, pages are selected using ``OFFSET``, which becomes slower
+        for later pages. If `sort_by` is given, keyset pagination is used
+        instead: results are sorted by `sort_by` and the primary key, and the
+        next page is filtered with a row-value comparison such as
+        ``(firstmjd, oid) > (:firstmjd, :oid)``. The next page is requested by
+        passing the ``next_cursor`` of the current page as `cursor`, so every
+        page costs the same when `sort_by` is indexed. NULL values of a
+        nullable `sort_by` column are sorted as in its index, last in
+        ascending order and first in descending order.
+
+        Parameters
+        ----------
+        page : int
+            Page of the query (only used to select results if not using keyset)
+        per_page : int
+            Number of items per page
+        count : bool
+            Whether to count total number of results in query
+        max_results : int
+            If counting is used, only count up to this amount of results
+            (ignored if `count_strategy` is given)
+        sort_by : sqlalchemy.orm.attributes.InstrumentedAttribute or str, optional
+            Column (or its name) used for keyset pagination, e.g.,
+            ``Object.firstmjd``
+        sort_direction : int
+            Either ``ASCENDING`` or ``DESCENDING`` (from
+            :mod:`db_plugins.db.generic`, with the same values as pymongo)
+        cursor : str, optional
+            Token for the next page in keyset pagination (``None`` for the first page)
+        count_strategy : CountStrategy, optional
+            Strategy used to count the results, e.g., to use estimates or to
+            cache the totals between pages. Defaults to
+            ``CappedCount(max_results)``
+
+        Returns
+        -------
+        Pagination
+            Paginated results
+        """
+        if page < 1:
+            page = 1
+        if per_page < 0:
+            per_page = 10
+        if cursor is not None and sort_by is None:
+            raise ValueError("A cursor can only be used with 'sort_by'")
+        count_strategy = count_strategy or CappedCount(max_results)
+
+        queries, columns = _page_query(
+            self, self._entity(), page, per_page, sort_by, sort_direction, cursor
+        )
+        items = []
+        for query in queries:
+            items += query.limit(per_page + 1 - len(items)).all()
+            if len(items) > per_page:
+                break
+        items, has_next, next_cursor = _split_page(items, per_page, columns)
+
+        arguments = _page_repeat_arguments(count, max_results, sort_by, sort_direction)
+        keyset = sort_by is not None
+        if not count:
+            return PaginationNoCount(
+                self, page, per_page, items, has_next, next_cursor, arguments, keyset
+            )
+        total = count_strategy.count(self, self)
+        return Pagination(
+            self,
+            page,
+            per_page,
+            total,
+            items,
+            next_cursor,
+            count_strategy,
+            arguments,
+            keyset,
+        )
+
+    @instrumented("sql")
+    def count_results(self, filter_by=None, limit=None):
+        """Count the results of the query, up to `limit` if defined.
+
+        The `filter_by` argument is ignored, since the filters are part of the
+        query itself.
+        """
+        query = self.order_by(None)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.count()
+
+    @instrumented("sql")
+    def estimated_count(self, filter_by=None):
+        """Get the estimated number of results from PostgreSQL statistics.
+
+        Queries over a single table without filters use ``pg_class.reltuples``,
+        while any other query uses the rows estimated by ``EXPLAIN``. Returns
+        None for other databases or if no estimate is available. Statistics
+        are read inside a ``SAVEPOINT``, so a failure does not abort the
+        transaction of the session.
+        """
+        connection = self.session.connection()
+        if connection.dialect.name != "postgresql":
+            return None
+        statement = self.order_by(None).statement
+        try:
+            with self.session.begin_nested():
+                return _estimated_rows(connection, statement)
+        except DBAPIError:
+            return None
+
+    def count_key(self, filter_by=None):
+        """Get the hash of the query statement and its parameters."""
+        compiled = self.order_by(None).statement.compile()
+        return _normalized_hash([str(compiled), compiled.params])
+
+    def cone_search(self, ra, dec, radius_arcsec, model=None, use_healpix=False):
+        """Filter the records whose mean position is within a radius of a position.
+
+        By default, candidates are selected with the ``meandec`` index. With
+        `use_healpix`, they are selected with a few ranges over the ``healpix``
+        index instead, which scans much fewer rows. Candidates are then
+        filtered by their exact distance.
+
+        Parameters
+        ----------
+        ra : float
+            Right ascension of the center in degrees
+        dec : float
+            Declination of the center in degrees
+        radius_arcsec : float
+            Radius of the cone in arcseconds
+        model : Base
+            Model class with ``meanra``, ``meandec`` and ``healpix`` columns
+            (uses the query entity by default)
+        use_healpix : bool
+            Whether to use the HEALPix pixel index
+
+        Returns
+        -------
+        SQLQuery
+            Filtered query, to be paginated or iterated
+
+        Examples
+        --------
+        .. code-block:: python
+
+            db_conn.query(Object).cone_search(
+                10.5, -20.1, 2.0, use_healpix=True
+            ).all()
+        """
+        query = self._query_for(model)
+        return query.filter(
+            *_cone_criteria(query._entity(), ra, dec, radius_arcsec, use_healpix)
+        )
+
+    @instrumented("sql")
+    def find_one(self, filter_by=None, model=None, **kwargs):
+        """Retrieve the first record that matches the filters, or None if there are no matches.
+
+        Parameters
+        ----------
+        filter_by : dict
+            Attributes used to find the record
+        model : Base
+            Model class to be retrieved (uses the query entity by default)
+        """
+        return self._query_for(model).filter_by(**(filter_by or {})).first()
+
+    @instrumented("sql")
+    def find_all(self, filter_by=None, model=None, paginate=True, **kwargs):
+        """Retrieve the records that match the filters.
+
+        Parameters
+        ----------
+        filter_by : dict
+            Attributes used to find the records
+        model : Base
+            Model class to be retrieved (uses the query entity by default)
+        paginate : bool
+            Whether to get a paginated result
+        kwargs : dict
+            All other arguments are passed to `paginate`
+
+        Returns
+        -------
+        list or Pagination
+            Records or a pagination object, depending on the `paginate` option
+        """
+        query = self._query_for(model).filter_by(**(filter_by or {}))
+        if paginate:
+            return query.paginate(**kwargs)
+        return query.all()
@@ -0,0 +1,128 @@
+"""Routing of read-only queries to replica databases"""
+
+import itertools
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+STRATEGIES = {"round_robin", "least_connections"}
+
+# The last replayed transaction gets older while the primary is idle, so the
+# lag is only measured when the replica hasn't replayed all the received WAL
+REPLICA_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(date_part('epoch', now() - pg_last_xact_replay_timestamp()), 0) "
+    "END"
+)
+
+
+class ReplicaRouter:
+    """Chooses the engine for each query among a primary and its replicas.
+
+    Replicas are chosen in turns (``round_robin``) or by the smallest number
+    of checked out connections (``least_connections``). If `max_lag` is set,
+    replicas whose replication lag (in seconds) is larger are skipped, and the
+    primary is used when no replica is available. The lag of each replica is
+    measured at most once every `lag_check_interval` seconds.
+
+    Parameters
+    ----------
+    primary : sqlalchemy.engine.Engine
+        Engine used for writes (and reads when no replica is available)
+    replicas : list[sqlalchemy.engine.Engine]
+        Engines of the read replicas
+    strategy : str
+        Either ``round_robin`` or ``least_connections``
+    max_lag : float, optional
+        Maximum replication lag in seconds
+    lag_check_interval : float
+        Seconds between replication lag queries of each replica
+    """
+
+    def __init__(
+        self,
+        primary,
+        replicas,
+        strategy="round_robin",
+        max_lag=None,
+        lag_check_interval=5.0,
+    ):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown replica strategy '{strategy}'")
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.strategy = strategy
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self._turns = itertools.cycle(range(len(self.replicas)))
+        self._lock = threading.Lock()
+        self._lags = {}
+
+    def replica_lag(self, engine):
+        """Get the replication lag of a replica in seconds (cached)."""
+        now = time.monotonic()
+        with self._lock:
+            checked, lag = self._lags.get(engine, (None, None))
+        if checked is not None and now - checked < self.lag_check_interval:
+            return lag
+        try:
+            with engine.connect() as connection:
+                lag = float(connection.execute(REPLICA_LAG_QUERY).scalar())
+        except Exception:
+            lag = float("inf")  # Unreachable replicas are skipped
+        with self._lock:
+            self._lags[engine] = (now, lag)
+        return lag
+
+    def _available(self, engine):
+        return self.max_lag is None or self.replica_lag(engine) <= self.max_lag
+
+    def get_engine(self, read_only=False):
+        """Get the engine for a query, which is always the primary for writes."""
+        if not read_only or not self.replicas:
+            return self.primary
+        if self.strategy == "round_robin":
+            with self._lock:
+                start = next(self._turns)
+            candidates = self.replicas[start:] + self.replicas[:start]
+        else:
+            candidates = sorted(self.replicas, key=_checked_out)
+        for engine in candidates:
+            if self._available(engine):
+                return engine
+        return self.primary
+
+    def dispose(self):
+        for engine in self.replicas:
+            engine.dispose()
+
+
+def _checked_out(engine):
+    checkedout = getattr(engine.pool, "checkedout", None)
+    return checkedout() if callable(checkedout) else 0
+
+
+class RoutingSession(Session):
+    """Session that sends read-only queries to the replicas of a router.
+
+    Queries are read-only if the whole session is (``read_only=True``) or if
+    they have the ``read_only`` execution option. Flushes always use the
+    primary, as well as any statement when there is no router.
+    """
+
+    def __init__(self, router=None, read_only=False, **kwargs):
+        super().__init__(**kwargs)
+        self.router = router
+        self.read_only = read_only
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.router is None:
+            return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+        read_only = self.read_only and not self._flushing
+        if clause is not None and not self._flushing:
+            read_only = read_only or clause.get_execution_options().get(
+                "read_only", False
+            )
+        return self.router.get_engine(read_only)
@@ -0,0 +1,93 @@
+"""
+Compares the client side and server side modes of the probability helpers.
+
+It needs the docker services used by the integration tests and it is not
+collected by default. Run it explicitly with (``BENCH_N`` sets the number of objects)
+
+.. code-block:: console
+
+    pytest -s tests/integration/bench_update_probs.py
+"""
+import os
+import time
+
+import pytest
+
+from db_plugins.db.mongo.connection import MongoConnection
+from db_plugins.db.mongo.helpers.update_probs import (
+    create_or_update_probabilities_bulk,
+)
+from db_plugins.db.mongo.models import Object
+
+N_OBJECTS = int(os.getenv("BENCH_N", 100000))
+CLASSES = [f"CLASS{i}" for i in range(15)]
+
+
+def make_object(i):
+    return Object(
+        aid=f"aid{i}",
+        oid=[f"oid{i}"],
+        tid=["ztf"],
+        sid=["ztf"],
+        corrected=False,
+        stellar=False,
+        firstmjd=59000.0,
+        lastmjd=59001.0,
+        ndet=1,
+        meanra=i % 360,
+        sigmara=0.1,
+        meandec=0.0,
+        sigmadec=0.1,
+        probabilities=[
+            {
+                "classifier_name": "stamp_classifier",
+                "classifier_version": "1.0.0",
+                "class_name": "SN",
+                "probability": 1.0,
+                "ranking": 1,
+            }
+        ],
+    )
+
+
+@pytest.fixture
+def connection(mongo_service):
+    host, port = mongo_service.split(":")
+    conn = MongoConnection()
+    conn.connect(
+        {
+            "HOST": host,
+            "USERNAME": "mongo",
+            "PASSWORD": "mongo",
+            "PORT": int(port),
+            "DATABASE": "bench",
+            "AUTH_SOURCE": "admin",
+        }
+    )
+    conn.create_db()
+    conn.database["object"].insert_many(make_object(i) for i in range(N_OBJECTS))
+    yield conn
+    conn.drop_db()
+
+
+@pytest.mark.parametrize("server_side", [False, True])
+def test_create_or_update_probabilities_bulk(connection, server_side):
+    aids = [f"aid{i}" for i in range(N_OBJECTS)]
+    probabilities = [
+        {name: (i + j) % len(CLASSES) / 100 for j, name in enumerate(CLASSES)}
+        for i in range(N_OBJECTS)
+    ]
+    start = time.perf_counter()
+    create_or_update_probabilities_bulk(
+        connection,
+        "lc_classifier",
+        "1.0.0",
+        aids,
+        probabilities,
+        server_side=server_side,
+    )
+    elapsed = time.perf_counter() - start
+    mode = "server side" if server_side else "client side"
+    print(f"\n{mode}: {N_OBJECTS} objects in {elapsed:.2f} s")
+    obj = connection.database["object"].find_one({"_id": aids[-1]})
+    assert len(obj["probabilities"]) == len(CLASSES) + 1
@@ -1,4 +1,4 @@
-from db_plugins.db.sql.models import Object
+from db_plugins.db.sql.models import Object, NonDetection, Feature, FeatureVersion
 from db_plugins.db.sql.connection import (
     SQLConnection,
     create_engine,
@@ -88,4 +88,42 @@ class SQLConnectionTest(unittest.TestCase):
 
     def test_query(self):
         query = self.db.query(Object)
-        self.assertIsInstance(query, Query)
\ No newline at end of file
+        self.assertIsInstance(query, Query)
+
+    def test_copy_insert(self):
+        self.db.connect(
+            self.config, session_options=self.session_options, use_scoped=False
+        )
+        self.db.create_db()
+        self.db.session.add(Object(oid="oid1"))
+        self.db.session.commit()
+        rows = [
+            {"oid": "oid1", "fid": 1, "mjd": 59000.5, "diffmaglim": 19.5},
+            ("oid1", 2, 59000.5, None),
+        ]
+        self.assertEqual(self.db.copy_insert(NonDetection, rows), 2)
+        inserted = self.db.copy_insert(
+            NonDetection,
+            rows + [("oid1", 1, 59001.5, 20.0)],
+            on_conflict_do_nothing=True,
+        )
+        self.assertEqual(inserted, 1)
+        self.assertEqual(self.db.query(NonDetection).count(), 3)
+        self.db.session.close()
+
+    def test_bulk_upsert(self):
+        self.db.connect(
+            self.config, session_options=self.session_options, use_scoped=False
+        )
+        self.db.create_db()
+        self.db.session.add_all([Object(oid="oid1"), FeatureVersion(version="1")])
+        self.db.session.commit()
+        rows = [
+            {"oid": "oid1", "name": "amplitude", "fid": 1, "version": "1", "value": v}
+            for v in range(3)
+        ]
+        self.db.bulk_upsert(Feature, rows[:1])
+        self.db.bulk_upsert(Feature, rows[1:])
+        feature = self.db.query(Feature).one()
+        self.assertEqual(feature.value, 2)
+        self.db.session.close()
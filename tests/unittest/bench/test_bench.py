@@ -0,0 +1,136 @@
+from db_plugins.bench import Benchmark, compare, data, load, run_mongo, run_sql, save
+from db_plugins.db.mongo import models
+from db_plugins.db.mongo.connection import MongoConnection
+from db_plugins.db.sql.connection import SQLConnection
+from db_plugins.db.sql.models import Object
+from sqlalchemy import exc, inspect
+import mongomock
+import os
+import tempfile
+import unittest
+
+
+class DataTest(unittest.TestCase):
+    def setUp(self):
+        self.alerts = data.SyntheticAlerts(25, seed=1, batch_size=10)
+
+    def documents(self, model):
+        return list(
+            model.from_records(self.alerts.mongo_documents(model.__tablename__))
+        )
+
+    def test_mongo_records_are_consistent(self):
+        self.assertEqual(len(self.alerts), 3)
+        objects = self.documents(models.Object)
+        detections = self.documents(models.Detection)
+        forced_photometry = self.documents(models.ForcedPhotometry)
+        non_detections = self.documents(models.NonDetection)
+        self.assertEqual(len(objects), 25)
+        self.assertEqual(objects[1]["_id"], "AL20aaaaaab")
+        self.assertEqual(objects[1]["oid"], ["ZTF20aaaaaab"])
+        self.assertEqual(len(detections), sum(obj["ndet"] for obj in objects))
+        candids = [doc["_id"] for doc in detections + forced_photometry]
+        self.assertEqual(len(set(candids)), len(candids))
+        for obj in objects:
+            lightcurve = [
+                [doc for doc in docs if doc["aid"] == obj["_id"]]
+                for docs in [non_detections, forced_photometry, detections]
+            ]
+            self.assertEqual(
+                {doc["oid"] for doc in sum(lightcurve, [])}, {obj["oid"][0]}
+            )
+            mjds = [doc["mjd"] for doc in sum(lightcurve, [])]
+            self.assertEqual(mjds, sorted(mjds))
+            self.assertEqual(
+                (lightcurve[2][0]["mjd"], lightcurve[2][-1]["mjd"]),
+                (obj["firstmjd"], obj["lastmjd"]),
+            )
+            ras = [doc["ra"] for doc in lightcurve[2]]
+            self.assertAlmostEqual(obj["meanra"], sum(ras) / len(ras))
+            probabilities = [item["probability"] for item in obj["probabilities"]]
+            self.assertEqual(probabilities, sorted(probabilities, reverse=True))
+            self.assertEqual(
+                [item["ranking"] for item in obj["probabilities"]], list(range(1, 16))
+            )
+
+    def test_sql_rows(self):
+        objects = list(self.alerts.sql_rows("object"))
+        detections = list(self.alerts.sql_rows("detection"))
+        self.assertEqual(len(detections), sum(row["ndet"] for row in objects))
+        self.assertIsInstance(detections[0]["candid"], int)
+        rows = list(self.alerts.sql_rows("probability"))
+        self.assertEqual(len(rows), 25 * len(data.CLASSES))
+        first = rows[: len(data.CLASSES)]
+        self.assertEqual({row["oid"] for row in first}, {objects[0]["oid"]})
+        self.assertAlmostEqual(sum(row["probability"] for row in first), 1)
+        ranked = sorted(first, key=lambda row: row["ranking"])
+        self.assertEqual(
+            [row["probability"] for row in ranked],
+            sorted((row["probability"] for row in first), reverse=True),
+        )
+        with self.assertRaisesRegex(ValueError, "no SQL model"):
+            self.alerts.batch(0).sql_rows("forced_photometry")
+
+    def test_batches_are_reproducible(self):
+        other = data.SyntheticAlerts(25, seed=1, batch_size=10)
+        self.assertEqual(
+            other.batch(2).sql_rows("detection"),
+            list(self.alerts)[2].sql_rows("detection"),
+        )
+        self.assertNotEqual(
+            other.batch(1).sql_rows("object"), other.batch(2).sql_rows("object")
+        )
+        seed = data.SyntheticAlerts(25, seed=2, batch_size=10)
+        self.assertNotEqual(
+            seed.batch(0).sql_rows("object"), other.batch(0).sql_rows("object")
+        )
+
+    def test_cones_on_centers(self):
+        cones = data.cones(4, centers=[(10.0, 20.0)])
+        self.assertEqual(cones[0], (10.0, 20.0))
+        self.assertEqual(cones[2], (10.0, 20.0))
+        self.assertNotEqual(cones[1], (10.0, 20.0))
+
+
+class BenchmarkTest(unittest.TestCase):
+    def test_report_and_compare(self):
+        benchmark = Benchmark(10, seed=3)
+        with benchmark.timer("mongo", "bulk_insert.object") as result:
+            result["documents"] = 10
+        with benchmark.timer("sql", "paginate.offset", 5):
+            pass
+        report = benchmark.report()
+        self.assertEqual((report["scale"], report["seed"]), (10, 3))
+        self.assertEqual(
+            [(r["backend"], r["name"], r["documents"]) for r in report["results"]],
+            [("mongo", "bulk_insert.object", 10), ("sql", "paginate.offset", 5)],
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bench.json")
+            save(report, path)
+            self.assertEqual(load(path), report)
+
+        current = {"results": [dict(report["results"][0], seconds=2.0)]}
+        report["results"][0]["seconds"] = 1.0
+        (item,) = compare(report, current)
+        self.assertEqual(item["name"], "bulk_insert.object")
+        self.assertEqual((item["baseline"], item["current"], item["ratio"]), (1, 2, 2))
+
+    def test_mongo_database_must_be_empty(self):
+        connection = MongoConnection()
+        connection.client = mongomock.MongoClient()
+        connection.database = connection.client["db"]
+        connection.database["object"].insert_one({"_id": "aid"})
+        with self.assertRaisesRegex(ValueError, "not empty"):
+            run_mongo(Benchmark(10), connection)
+        self.assertEqual(connection.database["object"].count_documents({}), 1)
+
+    def test_sql_tables_must_not_exist(self):
+        connection = SQLConnection()
+        connection.connect({"SQLALCHEMY_DATABASE_URL": "sqlite://"})
+        Object.__table__.create(connection.engine)
+        with self.assertRaises(exc.OperationalError):
+            run_sql(Benchmark(10), connection)
+        self.assertTrue(inspect(connection.engine).has_table("object"))
+        connection.end_session()
+        connection.dispose()
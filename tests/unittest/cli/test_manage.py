@@ -1,3 +1,4 @@
+import os
 import unittest
 from unittest import mock
 from db_plugins.cli import manage
@@ -116,3 +117,47 @@ class TestManage(unittest.TestCase):
             assert (
                 "Database created with credentials from {}".format(td) in result.output
             )
+
+    @mock.patch("db_plugins.bench.run_sql")
+    @mock.patch("db_plugins.bench.run_mongo")
+    @mock.patch("db_plugins.cli.manage.MongoConnection")
+    def test_bench(self, mock_connection, mock_run_mongo, mock_run_sql):
+        def run(benchmark, connection):
+            with benchmark.timer("mongo", "bulk_insert.object", 10):
+                pass
+
+        mock_run_mongo.side_effect = run
+        with self.runner.isolated_filesystem(temp_dir=self.settings_path) as td:
+            with open("settings.py", "w") as f:
+                f.write("DB_CONFIG=")
+                DB_CONFIG = {"MONGO": {"HOST": "", "DATABASE": "bench"}}
+                f.write(str(DB_CONFIG))
+            with open("baseline.json", "w") as f:
+                f.write(
+                    '{"results": [{"backend": "mongo", '
+                    '"name": "bulk_insert.object", "seconds": 1e-12}]}'
+                )
+            result = self.runner.invoke(
+                manage.bench,
+                ["--settings_path", td, "--scale", "10", "--compare", "baseline.json"],
+            )
+            assert result.exit_code == 0, result.output
+            mock_connection.return_value.connect.assert_called_with(DB_CONFIG["MONGO"])
+            mock_run_sql.assert_not_called()
+            assert "bulk_insert.object" in result.output
+            assert "Compared with baseline.json" in result.output
+            assert os.path.exists("bench.json")
+
+    @mock.patch.dict(os.environ)
+    @mock.patch("pytest.main", return_value=0)
+    def test_bench_docker(self, mock_main):
+        with self.runner.isolated_filesystem(temp_dir=self.settings_path):
+            os.makedirs(os.path.join("tests", "integration"))
+            path = os.path.join("tests", "integration", "bench_suite.py")
+            open(path, "w").close()
+            with open("bench.json", "w") as f:
+                f.write('{"results": []}')
+            result = self.runner.invoke(manage.bench, ["--backend", "sql"])
+            assert result.exit_code == 0, result.output
+            mock_main.assert_called_once_with(["-q", "-s", path])
+            assert os.environ["BENCH_BACKENDS"] == "sql"
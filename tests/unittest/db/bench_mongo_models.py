@@ -0,0 +1,87 @@
+"""
+Micro-benchmarks for the construction of Mongo model documents.
+
+Compares the compiled constructor of the models against the previous
+implementation, which inspected every field on each instantiation. It is not
+collected by default. Run it explicitly with (``BENCH_N`` sets the number of documents)
+
+.. code-block:: console
+
+    pytest -s tests/unittest/db/bench_mongo_models.py
+"""
+
+import os
+import timeit
+
+from db_plugins.db.mongo import models
+
+N_DOCUMENTS = int(os.getenv("BENCH_N", 100000))
+
+DETECTION = dict(
+    tid="tid",
+    aid="aid",
+    oid="oid",
+    sid="sid",
+    candid="candid",
+    mjd=59000.0,
+    fid=1,
+    ra=10.0,
+    dec=20.0,
+    e_ra=0.1,
+    e_dec=0.1,
+    mag=18.0,
+    e_mag=0.1,
+    mag_corr=18.0,
+    e_mag_corr=0.1,
+    e_mag_corr_ext=0.1,
+    isdiffpos=1,
+    corrected=True,
+    dubious=False,
+    parent_candid=None,
+    has_stamp=True,
+    rb=0.9,
+    rbversion="t8_f5_c3",
+)
+
+
+def legacy_construct(model, **kwargs):
+    document = {}
+    if "_id" in kwargs and "_id" not in model._meta.fields:
+        document["_id"] = kwargs["_id"]
+    for field, fclass in model._meta.fields.items():
+        try:
+            try:
+                document[field] = fclass.callback(**kwargs)
+            except AttributeError:
+                document[field] = kwargs[field]
+        except KeyError:
+            raise AttributeError(f"{model.__name__} model needs {field} attribute")
+    return dict(**document)
+
+
+def test_detection_construction():
+    legacy = timeit.timeit(
+        lambda: legacy_construct(models.Detection, **DETECTION), number=N_DOCUMENTS
+    )
+    compiled = timeit.timeit(lambda: models.Detection(**DETECTION), number=N_DOCUMENTS)
+    print(
+        f"\n{N_DOCUMENTS} detections: legacy {legacy:.2f} s, "
+        f"compiled {compiled:.2f} s ({legacy / compiled:.1f}x)"
+    )
+    assert models.Detection(**DETECTION) == legacy_construct(
+        models.Detection, **DETECTION
+    )
+
+
+def test_detection_from_records():
+    records = [DETECTION] * N_DOCUMENTS
+    constructor = timeit.timeit(
+        lambda: [models.Detection(**record) for record in records], number=1
+    )
+    batch = timeit.timeit(
+        lambda: list(models.Detection.from_records(records)), number=1
+    )
+    print(
+        f"\n{N_DOCUMENTS} detections: constructor {constructor:.2f} s, "
+        f"from_records {batch:.2f} s ({constructor / batch:.1f}x)"
+    )
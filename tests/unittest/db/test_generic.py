@@ -0,0 +1,83 @@
+from db_plugins.db.generic import (
+    CachedCount,
+    CappedCount,
+    EstimatedCount,
+    ExactCount,
+    Pagination,
+)
+from unittest import mock
+import unittest
+
+
+class CountStrategyTest(unittest.TestCase):
+    def setUp(self):
+        self.query = mock.Mock()
+        self.query.count_results.return_value = 10
+        self.query.estimated_count.return_value = None
+        self.query.count_key.side_effect = lambda filter_by: str(filter_by)
+
+    def test_exact_count(self):
+        self.assertEqual(ExactCount().count(self.query, {}), 10)
+        self.query.count_results.assert_called_once_with({})
+
+    def test_capped_count(self):
+        CappedCount(5).count(self.query, {})
+        self.query.count_results.assert_called_once_with({}, limit=5)
+
+    def test_estimated_count_uses_estimate(self):
+        self.query.estimated_count.return_value = 100
+        self.assertEqual(EstimatedCount().count(self.query, {}), 100)
+        self.query.count_results.assert_not_called()
+
+    def test_estimated_count_uses_fallback(self):
+        self.assertEqual(EstimatedCount(ExactCount()).count(self.query, {}), 10)
+        self.query.count_results.assert_called_once_with({})
+
+    def test_cached_count(self):
+        strategy = CachedCount(ExactCount(), maxsize=1)
+        self.assertEqual(strategy.count(self.query, {"a": 1}), 10)
+        self.assertEqual(strategy.count(self.query, {"a": 1}), 10)
+        self.assertEqual(self.query.count_results.call_count, 1)
+        strategy.count(self.query, {"a": 2})  # Removes {"a": 1} from cache
+        strategy.count(self.query, {"a": 1})
+        self.assertEqual(self.query.count_results.call_count, 3)
+
+    @mock.patch("db_plugins.db.generic.time.monotonic")
+    def test_cached_count_expires(self, mock_time):
+        mock_time.return_value = 0
+        strategy = CachedCount(ExactCount(), ttl=10)
+        strategy.count(self.query, {})
+        mock_time.return_value = 11
+        strategy.count(self.query, {})
+        self.assertEqual(self.query.count_results.call_count, 2)
+
+    def test_pagination_reuses_count_strategy(self):
+        strategy = CachedCount()
+        pagination = Pagination(self.query, 1, 10, 20, [], count_strategy=strategy)
+        pagination.next()
+        self.query.paginate.assert_called_once_with(
+            page=2, per_page=10, count_strategy=strategy
+        )
+
+    def test_pagination_repeats_arguments(self):
+        arguments = {"filter_by": {"a": 1}, "sort_by": "b"}
+        pagination = Pagination(self.query, 2, 10, 20, [], arguments=arguments)
+        pagination.prev()
+        self.query.paginate.assert_called_once_with(
+            page=1, per_page=10, count_strategy=None, filter_by={"a": 1}, sort_by="b"
+        )
+
+    def test_keyset_pagination_uses_cursor(self):
+        pagination = Pagination(
+            self.query, 1, 10, 20, [], next_cursor="token", keyset=True
+        )
+        pagination.next()
+        self.query.paginate.assert_called_once_with(
+            page=2, per_page=10, count_strategy=None, cursor="token"
+        )
+        with self.assertRaises(ValueError):
+            pagination.prev()
+        pagination.next_cursor = None
+        self.assertFalse(pagination.has_next)
+        with self.assertRaises(ValueError):
+            pagination.next()
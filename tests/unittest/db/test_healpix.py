@@ -0,0 +1,75 @@
+from db_plugins.db import healpix
+import math
+import random
+import unittest
+
+
+def _random_point_in_cone(ra, dec, radius):
+    """Get a random position within `radius` degrees of another one."""
+    distance = math.radians(radius * math.sqrt(random.random()))
+    angle = random.uniform(0, 2 * math.pi)
+    dec0 = math.radians(dec)
+    sin_dec = math.sin(dec0) * math.cos(distance) + math.cos(dec0) * math.sin(
+        distance
+    ) * math.cos(angle)
+    dra = math.atan2(
+        math.sin(angle) * math.sin(distance) * math.cos(dec0),
+        math.cos(distance) - math.sin(dec0) * sin_dec,
+    )
+    return (ra + math.degrees(dra)) % 360, math.degrees(math.asin(sin_dec))
+
+
+class HealpixTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+
+    def test_ang2pix_of_pixel_centers(self):
+        for order in range(4):
+            for pixel in range(12 * 4**order):
+                ra, dec = healpix.pix2ang(order, pixel)
+                self.assertEqual(healpix.ang2pix(order, ra, dec), pixel)
+
+    def test_base_pixels(self):
+        self.assertEqual(healpix.pix2ang(0, 0), (45.0, math.degrees(math.asin(2 / 3))))
+        self.assertEqual(healpix.ang2pix(0, 0.0, 0.0), 4)
+        self.assertEqual(healpix.ang2pix(0, 45.0, -60.0), 8)
+
+    def test_pixels_are_nested(self):
+        for _ in range(100):
+            ra, dec = random.uniform(0, 360), random.uniform(-90, 90)
+            pixel = healpix.ang2pix(healpix.HEALPIX_ORDER, ra, dec)
+            for order in (0, 5, 12, 20):
+                shift = 2 * (healpix.HEALPIX_ORDER - order)
+                self.assertEqual(pixel >> shift, healpix.ang2pix(order, ra, dec))
+
+    def test_cone_ranges_contain_all_points_in_cone(self):
+        centers = [(0.0, 0.0), (359.99, 89.99), (120.0, -89.99), (45.0, 41.81)]
+        centers += [
+            (random.uniform(0, 360), random.uniform(-90, 90)) for _ in range(20)
+        ]
+        for ra, dec in centers:
+            for radius_arcsec in (1.0, 30.0, 3600.0):
+                ranges = healpix.cone_ranges(ra, dec, radius_arcsec)
+                self.assertLessEqual(len(ranges), 12)
+                for _ in range(50):
+                    point = _random_point_in_cone(ra, dec, radius_arcsec / 3600)
+                    pixel = healpix.ang2pix(healpix.HEALPIX_ORDER, *point)
+                    self.assertTrue(any(a <= pixel < b for a, b in ranges))
+
+    def test_cone_ranges_with_search_order(self):
+        ranges = healpix.cone_ranges(10.0, 10.0, 1.0, order=10, search_order=10)
+        pixel = healpix.ang2pix(10, 10.0, 10.0)
+        self.assertTrue(any(a <= pixel < b for a, b in ranges))
+        self.assertLessEqual(sum(b - a for a, b in ranges), 12)
+
+    def test_query_order(self):
+        order = healpix.query_order(2.0)
+        self.assertGreaterEqual(healpix.max_pixrad(order), 2.0 / 3600)
+        self.assertLess(healpix.max_pixrad(order + 1), 2.0 / 3600)
+        self.assertEqual(healpix.query_order(1e-6, order=10), 10)
+
+    def test_merge_ranges(self):
+        self.assertEqual(
+            healpix.merge_ranges([(8, 10), (0, 2), (2, 4), (3, 5)]),
+            [(0, 5), (8, 10)],
+        )
@@ -1,9 +1,12 @@
 from db_plugins.db.mongo.models import Object
 from unittest import mock
+from db_plugins.db.mongo.helpers import update_probs
 from db_plugins.db.mongo.helpers.update_probs import (
     create_or_update_probabilities,
     create_or_update_probabilities_bulk,
+    create_or_update_probabilities_matrix,
 )
+from db_plugins.db.mongo.bulk import BulkWriteExecutor
 from db_plugins.db.mongo.connection import MongoConnection
 import unittest
 import mongomock
@@ -296,3 +299,131 @@ class TestMongoProbabilities(unittest.TestCase):
 
         self.assertEqual(f1["probabilities"], expected_probabilities_1)
         self.assertEqual(f2["probabilities"], expected_probabilities_2)
+
+    def test_server_side_matches_client_side(self):
+        probabilities = [{"CLASS1": 0.3, "CLASS2": 0.7}, {"CLASS1": 0.8, "CLASS2": 0.2}]
+        results = []
+        for server_side in [False, True]:
+            self.obj_collection.delete_many({})
+            self.create_2_objects()
+            create_or_update_probabilities_bulk(
+                self.mongo_connection,
+                "stamp_classifier",
+                "stamp_classifier_1.0.0",
+                ["aid1", "aid2"],
+                probabilities,
+                server_side=server_side,
+            )
+            create_or_update_probabilities(
+                self.mongo_connection,
+                "lc_classifier",
+                "lc_classifier_1.0.0",
+                "aid2",
+                {"CLASS1": 0.1, "CLASS2": 0.9},
+                server_side=server_side,
+            )
+            results.append(list(self.obj_collection.find({}, {"probabilities": True})))
+        self.assertEqual(results[0], results[1])
+
+    def test_server_side_does_not_read_probabilities(self):
+        self.create_2_objects()
+        with mock.patch(
+            "db_plugins.db.mongo.helpers.update_probs.get_probabilities"
+        ) as get_probabilities:
+            create_or_update_probabilities_bulk(
+                self.mongo_connection,
+                "new_classifier",
+                "1.0.0",
+                ["aid1"],
+                [{"CLASS1": 0.3, "CLASS2": 0.7}],
+                server_side=True,
+            )
+            get_probabilities.assert_not_called()
+        f1 = self.obj_collection.find_one({"_id": "aid1"})
+        self.assertEqual(len(f1["probabilities"]), 6)
+        self.assertEqual(
+            f1["probabilities"][-2:],
+            [
+                {
+                    "classifier_version": "1.0.0",
+                    "classifier_name": "new_classifier",
+                    "class_name": "CLASS2",
+                    "probability": 0.7,
+                    "ranking": 1,
+                },
+                {
+                    "classifier_version": "1.0.0",
+                    "classifier_name": "new_classifier",
+                    "class_name": "CLASS1",
+                    "probability": 0.3,
+                    "ranking": 2,
+                },
+            ],
+        )
+
+    def _assert_matrix_matches_bulk(self, server_side):
+        class_names = ["CLASS1", "CLASS2", "CLASS3"]
+        matrix = [[0.3, 0.5, 0.2], [0.4, 0.2, 0.4]]
+        results = []
+        for use_matrix in [False, True]:
+            self.obj_collection.delete_many({})
+            self.create_2_objects()
+            if use_matrix:
+                create_or_update_probabilities_matrix(
+                    self.mongo_connection,
+                    "stamp_classifier",
+                    "stamp_classifier_1.0.0",
+                    ["aid1", "aid2"],
+                    class_names,
+                    matrix,
+                    server_side=server_side,
+                )
+            else:
+                create_or_update_probabilities_bulk(
+                    self.mongo_connection,
+                    "stamp_classifier",
+                    "stamp_classifier_1.0.0",
+                    ["aid1", "aid2"],
+                    [dict(zip(class_names, row)) for row in matrix],
+                    server_side=server_side,
+                )
+            results.append(list(self.obj_collection.find({}, {"probabilities": True})))
+        self.assertEqual(results[0], results[1])
+
+    @unittest.skipIf(update_probs.np is None, "numpy is not installed")
+    def test_matrix_matches_bulk(self):
+        self._assert_matrix_matches_bulk(server_side=False)
+        self._assert_matrix_matches_bulk(server_side=True)
+
+    @mock.patch("db_plugins.db.mongo.helpers.update_probs.np", None)
+    def test_matrix_matches_bulk_without_numpy(self):
+        self._assert_matrix_matches_bulk(server_side=False)
+        self._assert_matrix_matches_bulk(server_side=True)
+
+    def test_matrix_fails_with_wrong_shape(self):
+        with self.assertRaisesRegex(ValueError, "must have shape"):
+            create_or_update_probabilities_matrix(
+                self.mongo_connection, "clf", "1.0", ["aid1"], ["A", "B"], [[0.1]]
+            )
+        with self.assertRaisesRegex(ValueError, "one row per aid"):
+            create_or_update_probabilities_matrix(
+                self.mongo_connection, "clf", "1.0", ["aid1"], ["A"], [[0.1], [0.2]]
+            )
+
+    def test_bulk_with_executor(self):
+        self.create_2_objects()
+        probabilities = [{"CLASS1": 0.3, "CLASS2": 0.7}, {"CLASS1": 0.8, "CLASS2": 0.2}]
+        for server_side in [False, True]:
+            summary = create_or_update_probabilities_bulk(
+                self.mongo_connection,
+                "new_classifier",
+                "1.0.0",
+                ["aid1", "aid2"],
+                probabilities,
+                server_side=server_side,
+                executor=BulkWriteExecutor(chunk_size=1, max_workers=2),
+            )
+            self.assertEqual(summary.matched_count, 2)
+            self.assertEqual(summary.chunks, 2)
+        f1 = self.obj_collection.find_one({"_id": "aid1"})
+        self.assertEqual(len(f1["probabilities"]), 6)
@@ -0,0 +1,172 @@
+from db_plugins.db import instrumentation
+from db_plugins.db.mongo.query import MongoQuery
+from db_plugins.db.mongo.models import Taxonomy
+from db_plugins.db.sql.models import Object
+from db_plugins.db.sql.query import SQLQuery
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from unittest import mock
+import contextlib
+import mongomock
+import unittest
+
+
+def taxonomy(i):
+    return {"classifier_name": f"c{i}", "classifier_version": "1", "classes": []}
+
+
+class InstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        self.spans = []
+        instrumentation.add_listener(self.spans.append)
+        self.query = MongoQuery(mongomock.MongoClient()["db"], model=Taxonomy)
+
+    def tearDown(self):
+        instrumentation.remove_listener(self.spans.append)
+
+    def test_no_spans_without_listeners(self):
+        instrumentation.remove_listener(self.spans.append)
+        self.query.bulk_insert([taxonomy(0)])
+        self.assertEqual(self.spans, [])
+
+    def test_mongo_query_spans(self):
+        self.query.bulk_insert([taxonomy(i) for i in range(5)], chunk_size=2)
+        span = self.spans[-1]
+        self.assertEqual(span.name, "mongo.bulk_insert")
+        self.assertEqual(span.target, "taxonomy")
+        self.assertEqual(span.documents, 5)
+        self.assertEqual(span.batch_size, 2)
+        self.assertGreaterEqual(span.duration, 0)
+        self.assertIsNone(span.error)
+
+        self.spans.clear()
+        self.query.find_all({"classifier_version": "1"}, per_page=3)
+        self.assertEqual(
+            [span.operation for span in self.spans],
+            ["count_results", "paginate", "find_all"],
+        )
+        self.assertEqual(self.spans[0].documents, 5)
+        self.assertEqual(self.spans[1].documents, 3)
+
+    def test_span_of_failed_operation(self):
+        with self.assertRaises(ValueError):
+            self.query.paginate(cursor="cursor")
+        self.assertEqual(self.spans[-1].operation, "paginate")
+        self.assertIsInstance(self.spans[-1].error, ValueError)
+
+    def test_listener_errors_are_logged(self):
+        failing = mock.Mock(side_effect=RuntimeError("listener"))
+        instrumentation.add_listener(failing)
+        self.addCleanup(instrumentation.remove_listener, failing)
+        with self.assertLogs("db_plugins.db.instrumentation", "ERROR") as logs:
+            self.query.bulk_insert([taxonomy(0)])
+        self.assertIn("listener", logs.output[0])
+        self.assertEqual(self.query.collection.count_documents({}), 1)
+        self.assertEqual(self.spans[-1].operation, "bulk_insert")
+
+        engine = instrumentation.instrument_engine(create_engine("sqlite://"))
+        with self.assertLogs("db_plugins.db.instrumentation", "ERROR"):
+            with engine.connect() as connection:
+                self.assertEqual(connection.exec_driver_sql("SELECT 1").scalar(), 1)
+        engine.dispose()
+
+    def test_span_errors_keep_the_error_of_the_call(self):
+        with self.assertLogs("db_plugins.db.instrumentation", "ERROR"):
+            with self.assertRaisesRegex(TypeError, "unexpected keyword"):
+                self.query.check_exists(unknown=True)
+        with mock.patch.object(
+            instrumentation, "_statement_span", side_effect=RuntimeError("span")
+        ):
+            engine = instrumentation.instrument_engine(create_engine("sqlite://"))
+            with self.assertLogs("db_plugins.db.instrumentation", "ERROR"):
+                with engine.connect() as connection:
+                    connection.exec_driver_sql("SELECT 1")
+            engine.dispose()
+
+    def test_sql_spans(self):
+        engine = instrumentation.instrument_engine(create_engine("sqlite://"))
+        instrumentation.instrument_engine(engine)
+        Object.__table__.create(engine)
+        session = sessionmaker(bind=engine, query_cls=SQLQuery)()
+        self.spans.clear()
+        session.query(Object).bulk_insert([{"oid": "oid1"}, {"oid": "oid2"}])
+        self.assertEqual(
+            [(span.name, span.target) for span in self.spans],
+            [("sql.INSERT", "object"), ("sql.bulk_insert", "object")],
+        )
+        self.assertEqual(self.spans[0].batch_size, 2)
+        self.assertEqual(self.spans[1].documents, 2)
+
+        self.spans.clear()
+        session.query().find_one({"oid": "oid1"}, model=Object)
+        self.assertEqual(self.spans[-1].name, "sql.find_one")
+        self.assertEqual(self.spans[-1].target, "object")
+        session.close()
+        engine.dispose()
+
+    def test_only_plain_selects_are_explained(self):
+        engine = instrumentation.instrument_engine(create_engine("sqlite://"))
+        Object.__table__.create(engine)
+        self.spans.clear()
+        statements = [
+            "SELECT oid FROM object",
+            "WITH o AS (SELECT oid FROM object) SELECT oid FROM o",
+            "SELECT oid FROM object FOR UPDATE",
+            "SELECT oid FROM object FOR NO KEY UPDATE SKIP LOCKED",
+            "SELECT oid FROM object FOR SHARE",
+            "SELECT oid INTO copy FROM object",
+            "DELETE FROM object",
+        ]
+        with engine.connect() as connection:
+            for statement in statements:
+                # sqlite doesn't support locking clauses nor SELECT INTO
+                with contextlib.suppress(OperationalError):
+                    connection.exec_driver_sql(statement)
+        engine.dispose()
+        self.assertEqual(
+            [span.explain is not None for span in self.spans],
+            [True] + [False] * (len(statements) - 1),
+        )
+
+    def test_mongo_command_listener(self):
+        listener = instrumentation.MongoCommandListener()
+        started = mock.Mock(
+            command={"insert": "object", "documents": [{}, {}]},
+            command_name="insert",
+            connection_id=("host", 27017),
+            request_id=1,
+        )
+        listener.started(started)
+        listener.succeeded(
+            mock.Mock(
+                command_name="insert",
+                connection_id=("host", 27017),
+                request_id=1,
+                duration_micros=1500,
+                reply={"n": 2, "ok": 1},
+            )
+        )
+        span = self.spans[-1]
+        self.assertEqual(span.name, "mongo.insert")
+        self.assertEqual(span.target, "object")
+        self.assertEqual((span.documents, span.batch_size), (2, 2))
+        self.assertEqual(span.duration, 0.0015)
+
+    def test_open_telemetry_listener(self):
+        tracer = mock.Mock()
+        listener = instrumentation.OpenTelemetryListener(tracer)
+        span = instrumentation.Span(
+            "mongo", "find_one", target="object", start=1000, duration=0.5
+        )
+        listener(span)
+        tracer.start_span.assert_called_once_with(
+            "mongo.find_one",
+            start_time=1000,
+            attributes={
+                "db.system": "mongo",
+                "db.operation": "find_one",
+                "db.collection.name": "object",
+            },
+        )
+        tracer.start_span.return_value.end.assert_called_once_with(end_time=500001000)
@@ -1,16 +1,51 @@
-from db_plugins.db.generic import new_DBConnection
+from db_plugins.db import healpix
+from db_plugins.db.generic import new_DBConnection, CachedCount, EstimatedCount
+from db_plugins.db.mongo.bulk import BulkWriteExecutor
 from db_plugins.db.mongo.connection import (
     MongoConnection,
     MongoDatabaseCreator,
     _MongoConfig,
+    _forget_clients,
+    close_clients,
 )
-from db_plugins.db.mongo.query import MongoQuery, CollectionNotFound
-from db_plugins.db.mongo.models import Object, NonDetection
+from db_plugins.db.mongo.query import (
+    MongoQuery,
+    CollectionNotFound,
+    _cone_filter,
+    _document_chunks,
+    _healpix_filter,
+    _read_preference,
+    _upsert_operation,
+)
+from db_plugins.db.mongo.models import Object, NonDetection, Taxonomy
 from unittest import mock
+from pymongo import ASCENDING, DESCENDING
+from pymongo.read_preferences import Primary, Secondary, SecondaryPreferred
+import bson
+import math
 import unittest
 import mongomock
 
 
+def object_attributes(**fields):
+    """Get the attributes of an Object document, overriding the given ones."""
+    return {
+        "sid": "sid",
+        "oid": ["oid"],
+        "tid": ["tid"],
+        "corrected": False,
+        "stellar": False,
+        "sigmara": 0.1,
+        "sigmadec": 0.2,
+        "firstmjd": 1.0,
+        "lastmjd": 2.0,
+        "meanra": 100.0,
+        "meandec": 50.0,
+        "ndet": 1,
+        **fields,
+    }
+
+
 class MongoConnectionTest(unittest.TestCase):
     def setUp(self):
         self.config = {
@@ -31,6 +66,33 @@ class MongoConnectionTest(unittest.TestCase):
             new_conf, {**new_conf, **{"someOtherAttribute": "test", "host": "host"}}
         )
 
+    def tearDown(self):
+        close_clients()
+
+    @mock.patch("db_plugins.db.mongo.connection.MongoClient", mongomock.MongoClient)
+    def test_connections_share_client(self):
+        other = MongoConnection(config={**self.config, "DATABASE": "other"})
+        self.conn.connect()
+        other.connect()
+        self.assertIs(self.conn.client, other.client)
+        different = MongoConnection(config={**self.config, "MAX_POOL_SIZE": 10})
+        different.connect()
+        self.assertIsNot(self.conn.client, different.client)
+        unshared = MongoConnection(config=self.config, shared_client=False)
+        unshared.connect()
+        self.assertIsNot(self.conn.client, unshared.client)
+        unshared.close()
+        self.assertIsNone(unshared.client)
+
+    @mock.patch("db_plugins.db.mongo.connection.MongoClient", mongomock.MongoClient)
+    def test_new_client_after_fork(self):
+        self.conn.connect()
+        client = self.conn.client
+        _forget_clients()
+        with mock.patch("os.getpid", return_value=-1):
+            self.conn.connect()
+        self.assertIsNot(self.conn.client, client)
+
     def test_factory_method(self):
         conn = new_DBConnection(MongoDatabaseCreator)
         self.assertIsInstance(conn, MongoConnection)
@@ -101,6 +163,18 @@ class MongoConnectionTest(unittest.TestCase):
         self.assertIsInstance(query.collection, mongomock.Collection)
         self.assertEqual(query.model, Object)
 
+    @mock.patch("db_plugins.db.mongo.connection.MongoClient")
+    def test_query_with_read_preference(self, mock_mongo):
+        mock_mongo.return_value = mongomock.MongoClient()
+        self.conn.connect()
+
+        query = self.conn.query(
+            model=Object, read_preference="secondary_preferred", max_staleness=120
+        )
+        self.assertEqual(
+            query.collection.read_preference, SecondaryPreferred(max_staleness=120)
+        )
+
 
 class MongoQueryTest(unittest.TestCase):
     def setUp(self):
@@ -132,64 +206,61 @@ class MongoQueryTest(unittest.TestCase):
         result, created = self.query.get_or_create({"test": "test"})
         self.assertIsNotNone(result)
         self.assertFalse(created)
-        result, created = self.query.get_or_create(
-            {
-                "aid": "test",
-                "sid": "test",
-                "oid": ["test"],
-                "tid": ["test"],
-                "corrected": False,
-                "stellar": False,
-                "sigmara": 0.1,
-                "sigmadec": 0.2,
-                "firstmjd": "test",
-                "lastmjd": "test",
-                "meanra": 100.0,
-                "meandec": 50.0,
-                "ndet": "test",
-            }
-        )
+        result, created = self.query.get_or_create(object_attributes(aid="test"))
         self.assertIsNotNone(result)
         self.assertTrue(created)
 
     def test_get_or_create_with_kwargs(self):
         result, created = self.query.get_or_create(
-            {
-                "aid": "test",
-                "sid": "test",
-                "oid": ["test"],
-                "tid": ["test"],
-                "corrected": False,
-                "stellar": False,
-                "sigmara": 0.1,
-                "sigmadec": 0.2,
-                "firstmjd": "test",
-                "lastmjd": "test",
-                "meanra": 100.0,
-                "meandec": 50.0,
-                "ndet": "test",
-            },
+            object_attributes(aid="test"),
             _id="test",
         )
         self.assertEqual(result.inserted_id, "test")
         self.assertTrue(created)
 
-    def test_update(self):
-        model = Object(
-            aid="aid",
-            oid="oid",
-            tid="tid",
-            sid="sid",
-            corrected=False,
-            stellar=False,
-            sigmara=0.1,
-            sigmadec=0.2,
-            lastmjd="lastmjd",
-            firstmjd="firstmjd",
-            meanra=100.0,
-            meandec=50.0,
-            ndet="ndet",
+    def test_get_or_create_many(self):
+        base = object_attributes()
+        self.obj_collection.insert_one(Object(aid="existing", **base))
+        results = self.query.get_or_create_many(
+            [{"_id": "existing"}, {"_id": "new"}, {"_id": "new"}],
+            documents=[base, base, base],
         )
+        self.assertEqual([created for _, created in results], [False, True, False])
+        self.assertEqual([doc["_id"] for doc, _ in results], ["existing", "new", "new"])
+        self.assertEqual(self.obj_collection.count_documents({}), 3)
+
+    def test_get_or_create_many_with_multiple_fields(self):
+        self.obj_collection.insert_one({"test": "test", "other": 1})
+        results = self.query.get_or_create_many(
+            [{"test": "test", "other": 1}, {"other": 1, "test": "test"}]
+        )
+        self.assertEqual([created for _, created in results], [False, False])
+        self.assertEqual(results[0][0]["other"], 1)
+
+    def test_get_or_create_many_fails_with_different_filter_fields(self):
+        with self.assertRaisesRegex(ValueError, "same non-empty set of fields"):
+            self.query.get_or_create_many([{"_id": "a"}, {"aid": "b"}])
+
+    def test_get_or_create_many_handles_duplicate_key_race(self):
+        base = object_attributes()
+        original_find = self.obj_collection.find
+
+        def racing_find(*args, **kwargs):
+            # Another consumer inserts the document right after the lookup
+            result = list(original_find(*args, **kwargs))
+            if self.obj_collection.count_documents({"_id": "raced"}) == 0:
+                self.obj_collection.insert_one(Object(aid="raced", **base))
+            return result
+
+        with mock.patch.object(self.obj_collection, "find", side_effect=racing_find):
+            results = self.query.get_or_create_many(
+                [{"_id": "raced"}, {"_id": "new"}], documents=[base, base]
+            )
+        self.assertEqual([created for _, created in results], [False, True])
+        self.assertEqual(self.obj_collection.count_documents({}), 3)
+
+    def test_update(self):
+        model = Object(aid="aid", **object_attributes())
         self.obj_collection.insert_one(model)
         self.query.update(model, {"oid": "edited"})
         f = self.obj_collection.find_one({"oid": "edited"})
@@ -197,36 +268,8 @@ class MongoQueryTest(unittest.TestCase):
         self.assertEqual(self.query.model, Object)
 
     def test_bulk_update(self):
-        model1 = Object(
-            aid="aid1",
-            sid="sid",
-            oid=["oid"],
-            tid=["tid"],
-            corrected=False,
-            stellar=False,
-            sigmara=0.1,
-            sigmadec=0.2,
-            lastmjd="lastmjd",
-            firstmjd="firstmjd",
-            meanra=100.0,
-            meandec=50.0,
-            ndet="ndet",
-        )
-        model2 = Object(
-            aid="aid2",
-            sid="sid",
-            oid=["oid"],
-            tid=["tid"],
-            corrected=False,
-            stellar=False,
-            sigmara=0.1,
-            sigmadec=0.2,
-            lastmjd="lastmjd",
-            firstmjd="firstmjd",
-            meanra=100.0,
-            meandec=50.0,
-            ndet="ndet",
-        )
+        model1 = Object(aid="aid1", **object_attributes())
+        model2 = Object(aid="aid2", **object_attributes())
         self.obj_collection.insert_one(model1)
         self.obj_collection.insert_one(model2)
         self.query.bulk_update(
@@ -239,37 +282,38 @@ class MongoQueryTest(unittest.TestCase):
         self.assertIsNotNone(f)
         self.assertEqual(f["_id"], "aid2")
 
-    def test_bulk_update_using_filter(self):
-        model1 = Object(
-            aid="aid1",
-            sid="sid",
-            oid=["oid"],
-            tid=["tid"],
-            corrected=False,
-            stellar=False,
-            sigmara=0.1,
-            sigmadec=0.2,
-            lastmjd="lastmjd",
-            firstmjd="firstmjd",
-            meanra=100.0,
-            meandec=50.0,
-            ndet="ndet",
-        )
-        model2 = Object(
-            aid="aid2",
-            sid="sid",
-            oid=["oid"],
-            tid=["tid"],
-            corrected=False,
-            stellar=False,
-            sigmara=0.1,
-            sigmadec=0.2,
-            lastmjd="lastmjd",
-            firstmjd="firstmjd",
-            meanra=100.0,
-            meandec=50.0,
-            ndet="ndet",
+    def test_update_recomputes_position_fields(self):
+        model = Object(aid="aid", **object_attributes())
+        self.obj_collection.insert_one(model)
+        self.query.update(model, {"meanra": 10.0})
+        f = self.obj_collection.find_one({"_id": "aid"})
+        self.assertEqual(f["healpix"], healpix.ang2pix(healpix.HEALPIX_ORDER, 10, 50))
+        self.assertEqual(f["loc"]["coordinates"], [-170.0, 50.0])
+        self.query.bulk_update(
+            [model], [{"meanra": 20.0, "meandec": -5.0}], filter_fields=[{"_id": "aid"}]
+        )
+        f = self.obj_collection.find_one({"_id": "aid"})
+        self.assertEqual(f["healpix"], healpix.ang2pix(healpix.HEALPIX_ORDER, 20, -5))
+        self.assertEqual(f["loc"]["coordinates"], [-160.0, -5.0])
+        self.query.bulk_update([model], [{"ndet": 2}], filter_fields=[{"_id": "aid"}])
+        self.assertEqual(self.obj_collection.find_one({"_id": "aid"})["loc"], f["loc"])
+
+    def test_bulk_update_with_executor(self):
+        base = object_attributes()
+        models = [Object(aid=aid, **base) for aid in ["aid1", "aid2", "aid3"]]
+        self.obj_collection.insert_many(models)
+        summary = self.query.bulk_update(
+            models,
+            [{"ndet": 2}] * 3,
+            executor=BulkWriteExecutor(chunk_size=2, max_workers=2),
         )
+        self.assertEqual(summary.modified_count, 3)
+        self.assertEqual(summary.chunks, 2)
+        self.assertEqual(self.obj_collection.count_documents({"ndet": 2}), 3)
+
+    def test_bulk_update_using_filter(self):
+        model1 = Object(aid="aid1", **object_attributes())
+        model2 = Object(aid="aid2", **object_attributes())
         self.obj_collection.insert_one(model1)
         self.obj_collection.insert_one(model2)
 
@@ -281,21 +325,7 @@ class MongoQueryTest(unittest.TestCase):
         self.assertEqual(f["_id"], "aid2")
 
     def test_bulk_update_fails_if_not_all_instances_have_same_model(self):
-        model1 = Object(
-            aid="aid1",
-            sid="sid",
-            oid=["oid"],
-            tid=["tid"],
-            corrected=False,
-            stellar=False,
-            sigmara=0.1,
-            sigmadec=0.2,
-            lastmjd="lastmjd",
-            firstmjd="firstmjd",
-            meanra=100.0,
-            meandec=50.0,
-            ndet="ndet",
-        )
+        model1 = Object(aid="aid1", **object_attributes())
         model2 = NonDetection(
             candid="candid",
             aid="aid",
@@ -314,36 +344,8 @@ class MongoQueryTest(unittest.TestCase):
             )
 
     def test_bulk_update_fails_if_instances_and_attributes_do_not_match_size(self):
-        model1 = Object(
-            aid="aid1",
-            sid="sid",
-            oid=["oid"],
-            tid=["tid"],
-            corrected=False,
-            stellar=False,
-            sigmara=0.1,
-            sigmadec=0.2,
-            lastmjd="lastmjd",
-            firstmjd="firstmjd",
-            meanra=100.0,
-            meandec=50.0,
-            ndet="ndet",
-        )
-        model2 = Object(
-            aid="aid2",
-            sid="sid",
-            oid=["oid"],
-            tid=["tid"],
-            corrected=False,
-            stellar=False,
-            sigmara=0.1,
-            sigmadec=0.2,
-            lastmjd="lastmjd",
-            firstmjd="firstmjd",
-            meanra=100.0,
-            meandec=50.0,
-            ndet="ndet",
-        )
+        model1 = Object(aid="aid1", **object_attributes())
+        model2 = Object(aid="aid2", **object_attributes())
         self.obj_collection.insert_one(model1)
         self.obj_collection.insert_one(model2)
         with self.assertRaisesRegex(
@@ -353,55 +355,292 @@ class MongoQueryTest(unittest.TestCase):
 
     def test_bulk_insert(self):
         self.assertEqual(self.obj_collection.count_documents({}), 1)
+        self.query.bulk_insert([object_attributes(aid=f"test{i}") for i in range(2)])
+        self.assertEqual(self.obj_collection.count_documents({}), 3)
+
+    def test_bulk_insert_with_columns(self):
         self.query.bulk_insert(
+            {
+                "classifier_name": ["clf1", "clf2"],
+                "classifier_version": ["1.0", "1.0"],
+                "classes": [["A"], ["B"]],
+            },
+            model=Taxonomy,
+        )
+        self.assertEqual(
+            self.database["taxonomy"].count_documents({"classifier_version": "1.0"}), 2
+        )
+
+    def taxonomies(self, n):
+        return (
+            {"classifier_name": f"clf{i}", "classifier_version": "1.0", "classes": []}
+            for i in range(n)
+        )
+
+    def test_bulk_insert_in_chunks(self):
+        collection = self.database["taxonomy"]
+        with mock.patch.object(
+            collection, "insert_many", wraps=collection.insert_many
+        ) as insert_many:
+            result = self.query.bulk_insert(
+                self.taxonomies(5), model=Taxonomy, chunk_size=2
+            )
+        self.assertEqual(insert_many.call_count, 3)
+        self.assertEqual(len(result.inserted_ids), 5)
+        self.assertEqual(collection.count_documents({}), 5)
+
+    def test_bulk_insert_in_chunks_by_size_with_prefetch(self):
+        result = self.query.bulk_insert(
+            self.taxonomies(5),
+            model=Taxonomy,
+            max_chunk_bytes=1,
+            prefetch=True,
+            return_ids=False,
+        )
+        self.assertEqual(result, 5)
+        self.assertEqual(self.database["taxonomy"].count_documents({}), 5)
+
+    def test_document_chunks(self):
+        documents = [{"a": "x" * 10} for _ in range(5)]
+        size = len(bson.encode(documents[0]))
+        chunks = list(_document_chunks(documents, max_bytes=2 * size))
+        self.assertEqual([len(c) for c in chunks], [2, 2, 1])
+        chunks = list(_document_chunks(documents, max_count=4, max_bytes=3 * size))
+        self.assertEqual([len(c) for c in chunks], [3, 2])
+        chunks = list(_document_chunks(documents, max_bytes=1))
+        self.assertEqual([len(c) for c in chunks], [1, 1, 1, 1, 1])
+
+    @mock.patch("db_plugins.db.mongo.query.BSON_SAMPLE_INTERVAL", 2)
+    def test_document_chunks_only_encodes_a_sample(self):
+        documents = [{"a": "x" * 10} for _ in range(5)]
+        size = len(bson.encode(documents[0]))
+        with mock.patch("bson.encode", wraps=bson.encode) as encode:
+            list(_document_chunks(documents, max_count=2))
+            encode.assert_not_called()
+            chunks = list(_document_chunks(documents, max_bytes=2 * size))
+        self.assertEqual(encode.call_count, 3)
+        self.assertEqual([len(c) for c in chunks], [2, 2, 1])
+
+    def test_bulk_upsert(self):
+        base = object_attributes(oid=["oid1"], firstmjd="firstmjd")
+        self.obj_collection.insert_one(Object(aid="aid1", **base))
+        result = self.query.bulk_upsert(
             [
-                {
-                    "aid": f"test{i}",
-                    "sid": "sid",
-                    "oid": ["test"],
-                    "tid": ["test"],
-                    "corrected": False,
-                    "stellar": False,
-                    "sigmara": 0.1,
-                    "sigmadec": 0.2,
-                    "firstmjd": "test",
-                    "lastmjd": "test",
-                    "meanra": 100.0,
-                    "meandec": 50.0,
-                    "ndet": "test",
-                }
-                for i in range(2)
-            ]
+                {**base, "aid": "aid1", "oid": ["oid2"], "firstmjd": "new", "ndet": 2},
+                Object(**{**base, "aid": "aid2", "firstmjd": "new"}),
+            ],
+            set_on_insert=["firstmjd"],
+            add_to_set=["oid"],
+            chunk_size=1,
         )
-        self.assertEqual(self.obj_collection.count_documents({}), 3)
+        self.assertEqual(result.matched_count, 1)
+        self.assertEqual(result.modified_count, 1)
+        self.assertEqual(result.upserted_count, 1)
+        self.assertEqual(result.chunks, 2)
+        f = self.obj_collection.find_one({"_id": "aid1"})
+        self.assertEqual(f["oid"], ["oid1", "oid2"])
+        self.assertEqual(f["firstmjd"], "firstmjd")
+        self.assertEqual(f["ndet"], 2)
+        f = self.obj_collection.find_one({"_id": "aid2"})
+        self.assertEqual(f["oid"], ["oid1"])
+        self.assertEqual(f["firstmjd"], "new")
+
+    def test_bulk_upsert_with_replace_and_filter_fields(self):
+        document = {
+            "candid": "candid",
+            "aid": "aid",
+            "sid": "sid",
+            "tid": "tid",
+            "oid": "oid",
+            "mjd": 100,
+            "fid": 1,
+            "diffmaglim": 2,
+        }
+        self.database["non_detection"].insert_one(NonDetection(**document))
+        operation = _upsert_operation(
+            NonDetection(**{**document, "candid": "other"}), ["aid"], set(), set(), True
+        )
+        self.assertNotIn("_id", operation._doc)
+        self.query.bulk_upsert(
+            [{**document, "candid": "other", "diffmaglim": 3}],
+            model=NonDetection,
+            filter_fields=["aid", "fid", "mjd"],
+            replace=True,
+        )
+        f = self.database["non_detection"].find_one({"aid": "aid"})
+        self.assertEqual(f["_id"], "candid")
+        self.assertEqual(f["diffmaglim"], 3)
+
+    def test_bulk_upsert_skips_documents_without_updates(self):
+        document = {
+            "classifier_name": "clf",
+            "classifier_version": "1.0",
+            "classes": [],
+        }
+        result = self.query.bulk_upsert(
+            [document, {**document, "classifier_name": "new", "_id": "new"}],
+            model=Taxonomy,
+            filter_fields=["classifier_name", "classifier_version", "classes"],
+        )
+        self.assertEqual(result.operations, 1)
+        self.assertEqual(self.database["taxonomy"].find_one()["_id"], "new")
+
+    def test_bulk_upsert_fails_with_missing_filter_field(self):
+        document = {
+            "_id": "clf",
+            "classifier_name": "clf",
+            "classifier_version": "1.0",
+            "classes": [],
+        }
+        with self.assertRaisesRegex(
+            ValueError, "Document 1 is missing filter field '_id'"
+        ):
+            self.query.bulk_upsert(
+                [document, {k: v for k, v in document.items() if k != "_id"}],
+                model=Taxonomy,
+                chunk_size=1,
+            )
+        self.assertIsNone(self.database["taxonomy"].find_one())
+
+    def test_bulk_upsert_fails_with_repeated_operators(self):
+        with self.assertRaisesRegex(ValueError, "only use one update operator"):
+            self.query.bulk_upsert([{}], set_on_insert=["oid"], add_to_set=["oid"])
+        with self.assertRaisesRegex(ValueError, "only supports \\$set"):
+            self.query.bulk_upsert([{}], set_on_insert=["oid"], replace=True)
 
     def test_find_all(self):
         result = self.query.find_all(filter_by={"test": "test"})
         self.assertEqual(result.total, 1)
         self.assertEqual(result.items[0]["test"], "test")
 
+    def test_find_all_with_read_preference(self):
+        with mock.patch.object(
+            MongoQuery, "paginate", autospec=True, return_value="page"
+        ) as paginate:
+            self.query.find_all({"test": "test"}, read_preference="secondary")
+        query = paginate.call_args.args[0]
+        self.assertIsNot(query, self.query)
+        self.assertEqual(query.collection.read_preference, Secondary())
+        self.assertEqual(query.collection.name, "object")
+        self.assertIsNone(self.query.read_preference)
+
+    def test_find_one_with_read_preference(self):
+        result = self.query.find_one({"test": "test"}, read_preference="nearest")
+        self.assertEqual(result["test"], "test")
+
+    def test_pagination_with_read_preference(self):
+        paginate = self.query.paginate(
+            {"test": "test"}, read_preference="secondaryPreferred", max_staleness=90
+        )
+        self.assertEqual(paginate.total, 1)
+        self.assertEqual(
+            paginate.query.collection.read_preference,
+            SecondaryPreferred(max_staleness=90),
+        )
+
+    def test_max_staleness_requires_read_preference(self):
+        with self.assertRaisesRegex(ValueError, "only be used with 'read_preference'"):
+            MongoQuery(self.database, model=Object, max_staleness=90)
+        with self.assertRaisesRegex(ValueError, "only be used with 'read_preference'"):
+            self.query.paginate({"test": "test"}, max_staleness=90)
+        with self.assertRaisesRegex(ValueError, "only be used with 'read_preference'"):
+            self.query.find_one({"test": "test"}, max_staleness=90)
+
+    def test_read_preference(self):
+        self.assertEqual(_read_preference("primary"), Primary())
+        self.assertEqual(
+            _read_preference("PrimaryPreferred").mongos_mode, "primaryPreferred"
+        )
+        self.assertEqual(
+            _read_preference(Secondary(), 100), Secondary(max_staleness=100)
+        )
+        with self.assertRaisesRegex(ValueError, "Unknown read preference"):
+            _read_preference("secondaries")
+        with self.assertRaisesRegex(ValueError, "primary read preference"):
+            _read_preference("primary", 100)
+
+    def test_cone_filter(self):
+        cone = _cone_filter(10.0, -20.0, 3600)
+        center, radius = cone["loc"]["$geoWithin"]["$centerSphere"]
+        self.assertEqual(center, [-170.0, -20.0])
+        self.assertAlmostEqual(radius, math.pi / 180)
+
+    def test_cone_search(self):
+        self.query.collection = mock.MagicMock()
+        self.query.collection.find.return_value = [{"_id": "aid"}]
+        result = self.query.cone_search(10.0, -20.0, 1.5, filter_by={"ndet": 2})
+        self.assertEqual(result, [{"_id": "aid"}])
+        self.query.collection.find.assert_called_once_with(
+            {**_cone_filter(10.0, -20.0, 1.5), "ndet": 2}, limit=0
+        )
+
+    def test_cone_search_with_healpix(self):
+        self.query.collection = mock.MagicMock()
+        self.query.collection.find.return_value = [{"_id": "aid"}]
+        result = self.query.cone_search(10.0, -20.0, 1.5, use_healpix=True, limit=5)
+        self.assertEqual(result, [{"_id": "aid"}])
+        ranges = healpix.cone_ranges(10.0, -20.0, 1.5)
+        self.query.collection.find.assert_called_once_with(
+            {"$and": [_healpix_filter(ranges), _cone_filter(10.0, -20.0, 1.5)]},
+            limit=5,
+            hint="healpix",
+        )
+
+    def test_cone_search_many_with_healpix(self):
+        positions = [(10.0, -20.0), (10.0, -20.0005)]
+        self.query.collection = mock.MagicMock()
+        self.query.collection.aggregate.return_value = iter([{"0": [], "1": []}])
+        result = self.query.cone_search_many(positions, 1.5, use_healpix=True)
+        self.assertEqual(result, [[], []])
+        pipeline = self.query.collection.aggregate.call_args.args[0]
+        ranges = healpix.merge_ranges(
+            healpix.cone_ranges(10.0, -20.0, 1.5)
+            + healpix.cone_ranges(10.0, -20.0005, 1.5)
+        )
+        self.assertEqual(pipeline[0], {"$match": _healpix_filter(ranges)})
+        self.assertEqual(
+            pipeline[1]["$facet"]["1"], [{"$match": _cone_filter(10.0, -20.0005, 1.5)}]
+        )
+        self.assertEqual(
+            self.query.collection.aggregate.call_args.kwargs, {"hint": "healpix"}
+        )
+
+    def test_cone_search_many(self):
+        positions = [(10.0, -20.0), (11.0, -21.0), (12.0, -22.0)]
+        self.query.collection = mock.MagicMock()
+        self.query.collection.aggregate.side_effect = [
+            iter([{"0": [{"_id": "first"}], "1": []}]),
+            iter([{"0": [{"_id": "third"}, {"_id": "other"}]}]),
+        ]
+        result = self.query.cone_search_many(
+            positions, 1.5, filter_by={"ndet": 2}, batch_size=2
+        )
+        self.assertEqual(
+            result, [[{"_id": "first"}], [], [{"_id": "third"}, {"_id": "other"}]]
+        )
+        pipeline = self.query.collection.aggregate.call_args_list[0].args[0]
+        cones = [_cone_filter(ra, dec, 1.5) for ra, dec in positions[:2]]
+        self.assertEqual(
+            pipeline[0], {"$match": {"$and": [{"$or": cones}, {"ndet": 2}]}}
+        )
+        self.assertEqual(pipeline[1]["$facet"]["1"], [{"$match": cones[1]}])
+
+    def test_cone_search_many_in_parallel(self):
+        self.query.collection = mock.MagicMock()
+        self.query.collection.aggregate.side_effect = lambda pipeline: iter(
+            [{"0": [pipeline[1]["$facet"]["0"][0]["$match"]]}]
+        )
+        positions = [(float(ra), 0.0) for ra in range(10)]
+        result = self.query.cone_search_many(
+            positions, 1.0, batch_size=1, max_workers=4
+        )
+        self.assertEqual(
+            result, [[_cone_filter(ra, dec, 1.0)] for ra, dec in positions]
+        )
+
     def test_pagination_without_counting(self):
         self.assertEqual(self.obj_collection.count_documents({}), 1)
-        self.query.bulk_insert(
-            [
-                {
-                    "aid": f"test{i}",
-                    "oid": "test",
-                    "sid": "sid",
-                    "tid": "test",
-                    "corrected": False,
-                    "stellar": False,
-                    "sigmara": 0.1,
-                    "sigmadec": 0.2,
-                    "firstmjd": "test",
-                    "lastmjd": "test",
-                    "meanra": 100.0,
-                    "meandec": 50.0,
-                    "ndet": "test",
-                }
-                for i in range(2)
-            ]
-        )
+        self.query.bulk_insert([object_attributes(aid=f"test{i}") for i in range(2)])
         self.assertEqual(self.obj_collection.count_documents({}), 3)
 
         paginate = self.query.paginate(page=1, per_page=2, count=False)
@@ -416,26 +655,7 @@ class MongoQueryTest(unittest.TestCase):
 
     def test_pagination_with_counting(self):
         self.assertEqual(self.obj_collection.count_documents({}), 1)
-        self.query.bulk_insert(
-            [
-                {
-                    "aid": f"test{i}",
-                    "oid": "test",
-                    "sid": "sid",
-                    "tid": "test",
-                    "corrected": False,
-                    "stellar": False,
-                    "sigmara": 0.1,
-                    "sigmadec": 0.2,
-                    "firstmjd": "test",
-                    "lastmjd": "test",
-                    "meanra": 100.0,
-                    "meandec": 50.0,
-                    "ndet": "test",
-                }
-                for i in range(2)
-            ]
-        )
+        self.query.bulk_insert([object_attributes(aid=f"test{i}") for i in range(2)])
         self.assertEqual(self.obj_collection.count_documents({}), 3)
 
         paginate = self.query.paginate(page=1, per_page=2, count=True)
@@ -450,26 +670,7 @@ class MongoQueryTest(unittest.TestCase):
 
     def test_pagination_with_empty_query(self):
         self.assertEqual(self.obj_collection.count_documents({}), 1)
-        self.query.bulk_insert(
-            [
-                {
-                    "aid": f"test{i}",
-                    "oid": "test",
-                    "sid": "sid",
-                    "tid": "test",
-                    "corrected": False,
-                    "stellar": False,
-                    "sigmara": 0.1,
-                    "sigmadec": 0.2,
-                    "firstmjd": "test",
-                    "lastmjd": "test",
-                    "meanra": 100.0,
-                    "meandec": 50.0,
-                    "ndet": "test",
-                }
-                for i in range(2)
-            ]
-        )
+        self.query.bulk_insert([object_attributes(aid=f"test{i}") for i in range(2)])
         self.assertEqual(self.obj_collection.count_documents({}), 3)
 
         paginate = self.query.paginate({"_id": "fake"}, page=1, per_page=2, count=True)
@@ -479,3 +680,130 @@ class MongoQueryTest(unittest.TestCase):
         paginate = self.query.paginate({"_id": "fake"}, page=1, per_page=2, count=False)
         self.assertIsNone(paginate.total)
         self.assertListEqual(paginate.items, [])
+
+    def insert_objects_with_lastmjd(self, lastmjds):
+        self.query.bulk_insert(
+            [
+                object_attributes(aid=f"aid{i}", lastmjd=lastmjd)
+                for i, lastmjd in enumerate(lastmjds)
+            ]
+        )
+
+    def test_keyset_pagination_without_counting(self):
+        self.insert_objects_with_lastmjd([3.0, 1.0, 2.0, 2.0, 5.0])
+        pages, cursor = [], None
+        while True:
+            paginate = self.query.paginate(
+                {"sid": "sid"},
+                per_page=2,
+                count=False,
+                sort_by="lastmjd",
+                sort_direction=DESCENDING,
+                cursor=cursor,
+            )
+            self.assertIsNone(paginate.total)
+            pages.append([item["_id"] for item in paginate.items])
+            if not paginate.has_next:
+                self.assertIsNone(paginate.next_cursor)
+                break
+            cursor = paginate.next_cursor
+        self.assertEqual(pages, [["aid4", "aid0"], ["aid3", "aid2"], ["aid1"]])
+
+    def test_keyset_pagination_with_null_and_missing_values(self):
+        self.insert_objects_with_lastmjd([3.0, None, 2.0, None, 1.0, None])
+        self.obj_collection.update_one({"_id": "aid3"}, {"$unset": {"lastmjd": ""}})
+        for sort_direction, expected in [
+            (ASCENDING, ["aid1", "aid3", "aid5", "aid4", "aid2", "aid0"]),
+            (DESCENDING, ["aid0", "aid2", "aid4", "aid5", "aid3", "aid1"]),
+        ]:
+            for per_page in range(1, 4):
+                ids, cursor = [], None
+                while True:
+                    paginate = self.query.paginate(
+                        {"sid": "sid"},
+                        per_page=per_page,
+                        count=False,
+                        sort_by="lastmjd",
+                        sort_direction=sort_direction,
+                        cursor=cursor,
+                    )
+                    ids.extend(item["_id"] for item in paginate.items)
+                    if not paginate.has_next:
+                        break
+                    cursor = paginate.next_cursor
+                self.assertEqual(ids, expected)
+
+    def test_keyset_pagination_with_counting(self):
+        self.insert_objects_with_lastmjd([3.0, 1.0, 2.0])
+        paginate = self.query.find_all(
+            {"sid": "sid"}, per_page=2, sort_by="lastmjd", count=True
+        )
+        self.assertEqual(paginate.total, 3)
+        self.assertEqual([item["_id"] for item in paginate.items], ["aid1", "aid2"])
+        paginate = self.query.find_all(
+            {"sid": "sid"},
+            page=2,
+            per_page=2,
+            sort_by="lastmjd",
+            cursor=paginate.next_cursor,
+        )
+        self.assertEqual(paginate.total, 3)
+        self.assertEqual([item["_id"] for item in paginate.items], ["aid0"])
+        self.assertIsNone(paginate.next_cursor)
+        self.assertFalse(paginate.has_next)
+
+    def test_next_and_prev_keep_the_query(self):
+        self.insert_objects_with_lastmjd([3.0, 1.0, 2.0, 2.0, 5.0])
+        self.obj_collection.insert_one({"_id": "other", "sid": "other"})
+        paginate = self.query.paginate(
+            {"sid": "sid"}, per_page=2, sort_by="lastmjd", sort_direction=DESCENDING
+        )
+        paginate = paginate.next()
+        self.assertEqual([item["_id"] for item in paginate.items], ["aid3", "aid2"])
+        self.assertEqual(paginate.total, 5)
+        with self.assertRaisesRegex(ValueError, "can't request previous pages"):
+            paginate.prev()
+        paginate = paginate.next()
+        self.assertEqual([item["_id"] for item in paginate.items], ["aid1"])
+        with self.assertRaisesRegex(ValueError, "no next page"):
+            paginate.next()
+
+        paginate = self.query.paginate({"sid": "sid"}, page=2, per_page=2)
+        self.assertEqual(paginate.next().total, 5)
+        paginate = paginate.prev()
+        self.assertEqual(paginate.total, 5)
+        with self.assertRaisesRegex(ValueError, "no previous page"):
+            paginate.prev()
+
+    def test_keyset_pagination_fails_with_invalid_cursor(self):
+        with self.assertRaisesRegex(ValueError, "Invalid pagination cursor"):
+            self.query.paginate(sort_by="lastmjd", cursor="invalid")
+        with self.assertRaisesRegex(ValueError, "only be used with 'sort_by'"):
+            self.query.paginate(cursor="invalid")
+
+    def test_pagination_with_estimated_count(self):
+        self.insert_objects_with_lastmjd([3.0, 1.0, 2.0])
+        with mock.patch.object(
+            self.obj_collection, "estimated_document_count", return_value=100
+        ) as estimated:
+            paginate = self.query.paginate(count_strategy=EstimatedCount())
+            self.assertEqual(paginate.total, 100)
+            paginate = self.query.paginate(
+                {"sid": "sid"}, count_strategy=EstimatedCount()
+            )
+            self.assertEqual(paginate.total, 3)
+            estimated.assert_called_once()
+
+    def test_pagination_with_cached_count(self):
+        strategy = CachedCount()
+        self.insert_objects_with_lastmjd([3.0, 1.0, 2.0])
+        paginate = self.query.paginate({"sid": "sid"}, count_strategy=strategy)
+        self.assertEqual(paginate.total, 3)
+        self.assertIs(paginate.count_strategy, strategy)
+        self.obj_collection.insert_one({"_id": "new", "sid": "sid"})
+        paginate = self.query.paginate(
+            [{"$match": {"sid": "sid"}}, {"$sort": {"lastmjd": 1}}],
+            page=2,
+            count_strategy=strategy,
+        )
+        self.assertEqual(paginate.total, 3)
@@ -0,0 +1,194 @@
+from db_plugins.db.generic import (
+    new_DBConnection,
+    CachedCount,
+    Pagination,
+    PaginationNoCount,
+)
+from db_plugins.db.mongo.async_connection import (
+    AsyncMongoConnection,
+    AsyncMongoDatabaseCreator,
+)
+from db_plugins.db.mongo.async_query import AsyncMongoQuery
+from db_plugins.db.mongo.models import Object, Taxonomy
+from db_plugins.db.mongo.query import CollectionNotFound
+from mongomock_motor import AsyncMongoMockClient
+from pymongo import DESCENDING
+from unittest import mock
+import unittest
+
+
+class AsyncMongoConnectionTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.config = {
+            "HOST": "host",
+            "USERNAME": "username",
+            "PASSWORD": "pwd",
+            "PORT": 27017,
+            "DATABASE": "database",
+        }
+        self.conn = AsyncMongoConnection()
+        self.conn.client = AsyncMongoMockClient()
+
+    def test_factory_method(self):
+        conn = new_DBConnection(AsyncMongoDatabaseCreator)
+        self.assertIsInstance(conn, AsyncMongoConnection)
+
+    @mock.patch("db_plugins.db.mongo.async_connection.AsyncIOMotorClient", None)
+    def test_connect_without_motor(self):
+        with self.assertRaisesRegex(ImportError, "motor is required"):
+            AsyncMongoConnection().connect(self.config)
+
+    async def test_create_and_drop_db(self):
+        self.conn.connect(self.config)
+        await self.conn.create_db()
+        indexes = await self.conn.database["object"].index_information()
+        self.assertIn("radec", indexes)
+        await self.conn.drop_db()
+        self.assertNotIn("database", await self.conn.client.list_database_names())
+
+    def test_query(self):
+        self.conn.connect(self.config)
+        query = self.conn.query(model=Object)
+        self.assertIsInstance(query, AsyncMongoQuery)
+        self.assertEqual(query.collection.name, "object")
+
+
+class AsyncMongoQueryTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.database = AsyncMongoMockClient()["database"]
+        self.collection = self.database["taxonomy"]
+        await self.collection.insert_many(
+            [
+                {
+                    "_id": i,
+                    "classifier_name": f"clf{i}",
+                    "classifier_version": "1.0",
+                    "classes": [],
+                    "rank": i % 3,
+                }
+                for i in range(5)
+            ]
+        )
+        self.query = AsyncMongoQuery(self.database, model=Taxonomy)
+
+    def test_requires_collection(self):
+        with self.assertRaises(CollectionNotFound):
+            AsyncMongoQuery(self.database).init_collection()
+
+    async def test_check_exists(self):
+        self.assertTrue(await self.query.check_exists({"classifier_name": "clf1"}))
+        self.assertFalse(await self.query.check_exists({"classifier_name": "fake"}))
+
+    async def test_get_or_create(self):
+        result, created = await self.query.get_or_create({"classifier_name": "clf1"})
+        self.assertFalse(created)
+        self.assertEqual(result["_id"], 1)
+        result, created = await self.query.get_or_create(
+            {"classifier_name": "new"}, classifier_version="2.0", classes=["A"]
+        )
+        self.assertTrue(created)
+        self.assertEqual(await self.collection.count_documents({}), 6)
+
+    async def test_update_and_bulk_update(self):
+        document = Taxonomy(**await self.query.find_one({"_id": 1}))
+        await self.query.update(document, {"classes": ["A"]})
+        self.assertEqual((await self.query.find_one({"_id": 1}))["classes"], ["A"])
+        result = await self.query.bulk_update(
+            [document] * 2,
+            [{"classes": ["B"]}, {"classes": ["C"]}],
+            filter_fields=[{"_id": 1}, {"_id": 2}],
+        )
+        self.assertEqual(result.modified_count, 2)
+
+    async def test_bulk_insert(self):
+        await self.query.bulk_insert(
+            [
+                {"classifier_name": "new", "classifier_version": "2.0", "classes": []},
+            ]
+        )
+        self.assertEqual(await self.collection.count_documents({}), 6)
+
+    async def test_get_or_create_many(self):
+        results = await self.query.get_or_create_many(
+            [{"classifier_name": "clf1"}, {"classifier_name": "new"}],
+            documents=[{}, {"classifier_version": "2.0", "classes": []}],
+        )
+        self.assertEqual([created for _, created in results], [False, True])
+        self.assertEqual(results[0][0]["_id"], 1)
+        self.assertEqual(await self.collection.count_documents({}), 6)
+
+    async def test_bulk_upsert(self):
+        summary = await self.query.bulk_upsert(
+            [
+                {
+                    "_id": 1,
+                    "classifier_name": "clf1",
+                    "classifier_version": "2.0",
+                    "classes": [],
+                },
+                {
+                    "_id": 9,
+                    "classifier_name": "new",
+                    "classifier_version": "2.0",
+                    "classes": [],
+                },
+            ],
+            chunk_size=1,
+        )
+        self.assertEqual(summary.chunks, 2)
+        self.assertEqual(summary.modified_count, 1)
+        self.assertEqual(summary.upserted_count, 1)
+        document = await self.query.find_one({"_id": 1})
+        self.assertEqual(document["classifier_version"], "2.0")
+
+    async def test_paginate(self):
+        paginate = await self.query.paginate(per_page=2, page=2)
+        self.assertIsInstance(paginate, Pagination)
+        self.assertEqual(paginate.total, 5)
+        self.assertEqual([item["_id"] for item in paginate.items], [2, 3])
+        paginate = await paginate.next()
+        self.assertEqual([item["_id"] for item in paginate.items], [4])
+        self.assertFalse(paginate.has_next)
+
+    async def test_paginate_counts_concurrently(self):
+        with mock.patch.object(
+            self.query, "count_results", wraps=self.query.count_results
+        ) as count_results:
+            paginate = await self.query.find_all(
+                {"rank": {"$gt": 0}}, per_page=1, max_results=2
+            )
+        count_results.assert_called_once_with([{"$match": {"rank": {"$gt": 0}}}], 2)
+        self.assertEqual(paginate.total, 2)
+
+    async def test_paginate_without_counting(self):
+        paginate = await self.query.paginate(per_page=4, count=False)
+        self.assertIsInstance(paginate, PaginationNoCount)
+        self.assertTrue(paginate.has_next)
+
+    async def test_keyset_pagination(self):
+        pages, cursor = [], None
+        while True:
+            paginate = await self.query.paginate(
+                per_page=2,
+                count=False,
+                sort_by="rank",
+                sort_direction=DESCENDING,
+                cursor=cursor,
+            )
+            pages.append([item["_id"] for item in paginate.items])
+            if not paginate.has_next:
+                break
+            cursor = paginate.next_cursor
+        self.assertEqual(pages, [[2, 4], [1, 3], [0]])
+
+    async def test_paginate_fails_with_count_strategy(self):
+        with self.assertRaisesRegex(ValueError, "not supported"):
+            await self.query.paginate(count_strategy=CachedCount())
+
+    async def test_find_all_without_pagination(self):
+        cursor = await self.query.find_all({"rank": 0}, paginate=False)
+        self.assertEqual([item["_id"] async for item in cursor], [0, 3])
+
+    async def test_estimated_count(self):
+        self.assertEqual(await self.query.estimated_count([{"$match": {}}]), 5)
+        self.assertIsNone(await self.query.estimated_count([{"$match": {"rank": 1}}]))
@@ -0,0 +1,66 @@
+from db_plugins.db.mongo.bulk import (
+    BulkWriteExecutionError,
+    BulkWriteExecutor,
+    BulkWriteSummary,
+)
+from pymongo import InsertOne, UpdateOne
+import unittest
+import mongomock
+
+
+class BulkWriteExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.collection = mongomock.MongoClient().db.collection
+
+    def operations(self, n):
+        return (InsertOne({"_id": i, "value": i}) for i in range(n))
+
+    def test_execute_in_chunks(self):
+        progress = []
+        executor = BulkWriteExecutor(
+            chunk_size=3, progress=lambda s: progress.append(s.operations)
+        )
+        summary = executor.execute(self.collection, self.operations(10))
+        self.assertIsInstance(summary, BulkWriteSummary)
+        self.assertTrue(summary.acknowledged)
+        self.assertEqual(summary.inserted_count, 10)
+        self.assertEqual(summary.chunks, 4)
+        self.assertEqual(progress, [3, 6, 9, 10])
+        self.assertEqual(self.collection.count_documents({}), 10)
+
+    def test_execute_in_parallel(self):
+        executor = BulkWriteExecutor(chunk_size=2, max_workers=2)
+        summary = executor.execute(self.collection, self.operations(11))
+        self.assertEqual(summary.inserted_count, 11)
+        self.assertEqual(summary.chunks, 6)
+        summary = executor.execute(
+            self.collection,
+            (UpdateOne({"_id": i}, {"$set": {"value": -i}}) for i in range(11)),
+        )
+        self.assertEqual(summary.matched_count, 11)
+        self.assertEqual(summary.modified_count, 10)
+
+    def test_failed_chunks_do_not_stop_execution(self):
+        self.collection.insert_one({"_id": 1})
+        summary = BulkWriteExecutor(chunk_size=2).execute(
+            self.collection, self.operations(6)
+        )
+        self.assertFalse(summary.acknowledged)
+        self.assertEqual(len(summary.failures), 1)
+        failure = summary.failures[0]
+        self.assertEqual((failure.index, failure.offset, failure.size), (0, 0, 2))
+        self.assertEqual(summary.inserted_count, 5)
+        self.assertEqual(self.collection.count_documents({}), 6)
+
+    def test_raise_on_error(self):
+        self.collection.insert_one({"_id": 4})
+        executor = BulkWriteExecutor(chunk_size=2, raise_on_error=True)
+        with self.assertRaisesRegex(BulkWriteExecutionError, "chunk 2 \\(offset 4\\)"):
+            executor.execute(self.collection, self.operations(6))
+        self.assertEqual(self.collection.count_documents({}), 6)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            BulkWriteExecutor(chunk_size=0)
+        with self.assertRaises(ValueError):
+            BulkWriteExecutor(max_workers=0)
@@ -1,4 +1,5 @@
 import unittest
+from db_plugins.db.healpix import HEALPIX_ORDER, ang2pix
 from db_plugins.db.mongo import models
 
 
@@ -22,6 +23,7 @@ class MongoModelsTest(unittest.TestCase):
         self.assertIsInstance(o, models.Object)
         self.assertIsInstance(o, dict)
         self.assertEqual(o["loc"], {"type": "Point", "coordinates": [-80.0, 50]})
+        self.assertEqual(o["healpix"], ang2pix(HEALPIX_ORDER, 100.0, 50.0))
         self.assertEqual(
             o._meta.tablename,
             models.Object.__tablename__,
@@ -225,3 +227,110 @@ class MongoModelsTest(unittest.TestCase):
         )
         o = models.Taxonomy(extra="extra", **as_dict)
         self.assertDictEqual(o, as_dict)
+
+    def test_model_keeps_id_and_field_order(self):
+        o = models.Taxonomy(
+            _id="id", classes=[], classifier_version="1.0", classifier_name="clf"
+        )
+        self.assertEqual(
+            list(o), ["_id", "classifier_name", "classifier_version", "classes"]
+        )
+
+    def test_special_field_fails_creation(self):
+        with self.assertRaises(AttributeError) as e:
+            models.Object(
+                aid="aid",
+                oid="oid",
+                tid="tid",
+                sid="sid",
+                lastmjd="lastmjd",
+                firstmjd="firstmjd",
+                corrected=True,
+                stellar=True,
+                sigmara=0.1,
+                sigmadec=0.2,
+                meandec=50.0,
+                ndet="ndet",
+            )
+        self.assertEqual(str(e.exception), "Object model needs meanra attribute")
+
+    def test_from_records_matches_constructor(self):
+        records = [
+            dict(
+                candid="candid1",
+                aid="aid",
+                oid="oid",
+                sid="sid",
+                tid="tid",
+                mjd="mjd",
+                diffmaglim="diffmaglim",
+                fid="fid",
+                extra="extra",
+            ),
+            dict(
+                candid="candid2",
+                aid="aid",
+                oid="oid",
+                sid="sid",
+                tid="tid",
+                mjd="mjd",
+                diffmaglim="diffmaglim",
+                fid="fid",
+                extra="other",
+            ),
+            dict(
+                _id="candid3",
+                aid="aid",
+                oid="oid",
+                sid="sid",
+                tid="tid",
+                mjd="mjd",
+                diffmaglim="diffmaglim",
+                fid="fid",
+                extra_fields={"extra": "extra"},
+            ),
+        ]
+        documents = models.NonDetection.from_records(records)
+        self.assertNotIsInstance(documents, list)
+        documents = list(documents)
+        self.assertEqual(documents, [models.NonDetection(**r) for r in records])
+        self.assertIsInstance(documents[0], models.NonDetection)
+        self.assertEqual(documents[1]["extra_fields"], {"extra": "other"})
+
+    def test_from_records_with_columns(self):
+        columns = {
+            "classifier_name": ["clf1", "clf2"],
+            "classifier_version": ["1.0", "2.0"],
+            "classes": [["A"], ["B"]],
+        }
+        documents = list(models.Taxonomy.from_records(columns))
+        self.assertEqual(
+            documents[1],
+            {"classifier_name": "clf2", "classifier_version": "2.0", "classes": ["B"]},
+        )
+        columns["classes"].append(["C"])
+        with self.assertRaisesRegex(ValueError, "same length"):
+            list(models.Taxonomy.from_records(columns))
+
+    def test_from_records_fails_creation(self):
+        with self.assertRaises(AttributeError) as e:
+            list(models.Taxonomy.from_records([{"classifier_name": "clf"}]))
+        self.assertEqual(
+            str(e.exception), "Taxonomy model needs classifier_version attribute"
+        )
+        with self.assertRaisesRegex(AttributeError, "needs _id attribute"):
+            list(
+                models.NonDetection.from_records(
+                    [
+                        dict(
+                            aid="aid",
+                            oid="oid",
+                            sid="sid",
+                            tid="tid",
+                            mjd="mjd",
+                            diffmaglim="diffmaglim",
+                            fid="fid",
+                        )
+                    ]
+                )
+            )
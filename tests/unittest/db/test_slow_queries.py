@@ -0,0 +1,110 @@
+from db_plugins.db import instrumentation
+from db_plugins.db.slow_queries import (
+    JSONLinesSink,
+    LoggingSink,
+    RingBufferSink,
+    SlowQueryLog,
+)
+from db_plugins.db.sql.models import Object
+from sqlalchemy import create_engine, select
+from unittest import mock
+import json
+import os
+import tempfile
+import unittest
+
+
+class SlowQueryLogTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = self.create_engine("sqlite://")
+        self.sink = RingBufferSink(size=10)
+        self.log = SlowQueryLog(0.0, self.sink, explain_rate=1.0)
+        instrumentation.add_listener(self.log)
+
+    def tearDown(self):
+        instrumentation.remove_listener(self.log)
+        self.log.close()
+        self.engine.dispose()
+
+    def create_engine(self, url):
+        engine = instrumentation.instrument_engine(create_engine(url))
+        Object.__table__.create(engine)
+        return engine
+
+    def test_sql_statements_with_plan(self):
+        # Plans are explained in another thread, so the database can't be in memory
+        instrumentation.remove_listener(self.log)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.engine.dispose()
+        self.engine = self.create_engine(f"sqlite:///{directory.name}/db.sqlite")
+        instrumentation.add_listener(self.log)
+        with self.engine.begin() as connection:
+            connection.execute(Object.__table__.insert(), [{"oid": "a"}, {"oid": "b"}])
+        with self.engine.connect() as connection:
+            connection.execute(select(Object.oid).where(Object.ndet == 1))
+        self.log.close()
+        insert, query = self.sink.records()
+        self.assertEqual(insert["operation"], "INSERT")
+        self.assertNotIn("plan", insert)
+        self.assertEqual(query["operation"], "SELECT")
+        self.assertIn("WHERE object.ndet = ?", query["statement"])
+        self.assertEqual(query["backend"], "sql")
+        self.assertIn("USING INDEX ix_object_ndet", str(query["plan"]))
+
+    def test_fast_queries_are_ignored(self):
+        self.log.threshold = 10
+        with self.engine.connect() as connection:
+            connection.execute(select(Object.oid))
+        self.assertEqual(self.sink.records(), [])
+
+    def test_plans_are_sampled(self):
+        self.log.explain_rate = 0.0
+        with self.engine.connect() as connection:
+            connection.execute(select(Object.oid))
+        self.assertNotIn("plan", self.sink.records()[0])
+
+    def test_mongo_command_shape_and_plan(self):
+        client = mock.MagicMock()
+        listener = instrumentation.MongoCommandListener(client)
+        command = {
+            "find": "detection",
+            "filter": {"aid": "aid1", "candid": {"$in": [1, 2]}},
+            "lsid": {"id": "session"},
+            "$db": "db",
+        }
+        ids = {"connection_id": ("host", 27017), "request_id": 1}
+        listener.started(
+            mock.Mock(command=command, command_name="find", database_name="db", **ids)
+        )
+        listener.succeeded(
+            mock.Mock(command_name="find", duration_micros=2000, reply={}, **ids)
+        )
+        self.log.close()
+        (record,) = self.sink.records()
+        self.assertEqual(
+            record["statement"],
+            {"find": "detection", "filter": {"aid": "?", "candid": {"$in": "?"}}},
+        )
+        self.assertEqual(record["duration"], 0.002)
+        self.assertEqual(record["plan"], client["db"].command.return_value)
+        client["db"].command.assert_called_once_with(
+            "explain",
+            {"find": "detection", "filter": command["filter"]},
+            verbosity="executionStats",
+        )
+
+    def test_json_lines_sink(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "slow.jsonl")
+            sink = JSONLinesSink(path)
+            sink({"operation": "find"})
+            sink({"operation": "aggregate"})
+            with open(path) as file:
+                records = [json.loads(line) for line in file]
+        self.assertEqual(records, [{"operation": "find"}, {"operation": "aggregate"}])
+
+    def test_logging_sink(self):
+        with self.assertLogs("db_plugins.slow_queries", "WARNING") as logs:
+            LoggingSink()({"operation": "find"})
+        self.assertIn('"operation": "find"', logs.output[0])
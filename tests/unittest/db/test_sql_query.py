@@ -0,0 +1,301 @@
+from db_plugins.db import healpix
+from db_plugins.db.generic import (
+    DESCENDING,
+    CachedCount,
+    EstimatedCount,
+    Pagination,
+    PaginationNoCount,
+)
+from db_plugins.db.sql.models import Object, MagStats
+from db_plugins.db.sql.query import SQLQuery
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from unittest import mock
+import unittest
+
+
+class SQLQueryTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        Object.__table__.create(self.engine)
+        MagStats.__table__.create(self.engine)
+        self.session = sessionmaker(bind=self.engine, query_cls=SQLQuery)()
+        self.session.add_all(
+            [
+                Object(oid=f"oid{i}", firstmjd=firstmjd, ndet=1)
+                for i, firstmjd in enumerate([3.0, 1.0, 2.0, 2.0, 5.0])
+            ]
+        )
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+
+    def test_query_class(self):
+        self.assertIsInstance(self.session.query(Object), SQLQuery)
+
+    def test_check_exists(self):
+        self.assertTrue(
+            self.session.query(Object).check_exists(filter_by={"oid": "oid1"})
+        )
+        self.assertFalse(self.session.query().check_exists(Object, {"oid": "fake"}))
+
+    def test_get_or_create(self):
+        instance, created = self.session.query(Object).get_or_create(
+            filter_by={"oid": "oid1"}
+        )
+        self.assertFalse(created)
+        self.assertEqual(instance.firstmjd, 1.0)
+        instance, created = self.session.query().get_or_create(
+            model=Object, filter_by={"oid": "new"}, ndet=2
+        )
+        self.assertTrue(created)
+        self.assertEqual(instance.ndet, 2)
+        self.assertIn(instance, self.session.new)
+
+    def test_update(self):
+        instance = self.session.query(Object).find_one({"oid": "oid1"})
+        self.session.query().update(instance, {"ndet": 10})
+        self.assertEqual(instance.ndet, 10)
+
+    def test_query_update(self):
+        query = self.session.query(Object).filter(Object.firstmjd == 2.0)
+        self.assertEqual(query.update({"ndet": 7}), 2)
+        self.assertEqual(
+            self.session.query(Object).filter_by(oid="oid1").update({"ndet": 3}, False),
+            1,
+        )
+        self.session.commit()
+        self.assertEqual(
+            {o.oid: o.ndet for o in self.session.query(Object).filter(Object.ndet > 1)},
+            {"oid1": 3, "oid2": 7, "oid3": 7},
+        )
+
+    def test_bulk_insert(self):
+        self.session.query(Object).bulk_insert([{"oid": "new1"}, {"oid": "new2"}])
+        self.assertEqual(self.session.query(Object).count(), 7)
+
+    def test_find_all(self):
+        result = self.session.query(Object).find_all(paginate=False)
+        self.assertEqual(len(result), 5)
+        result = self.session.query().find_all({"firstmjd": 2.0}, model=Object)
+        self.assertIsInstance(result, Pagination)
+        self.assertEqual(result.total, 2)
+
+    def test_cone_search(self):
+        self.session.add_all(
+            [
+                Object(oid="near", meanra=10.0, meandec=-20.0),
+                Object(oid="edge", meanra=10.0, meandec=-20.0 + 1.9 / 3600),
+                Object(oid="far", meanra=10.0 + 2.2 / 3600, meandec=-20.0),
+                Object(oid="wrap", meanra=359.9999, meandec=0.0),
+            ]
+        )
+        self.session.commit()
+        for use_healpix in (False, True):
+            query = self.session.query(Object).cone_search(
+                10.0, -20.0, 2.0, use_healpix=use_healpix
+            )
+            self.assertEqual({o.oid for o in query}, {"near", "edge"})
+        query = self.session.query().cone_search(
+            0.0001, 0.0, 1.0, model=Object, use_healpix=True
+        )
+        self.assertEqual([o.oid for o in query], ["wrap"])
+
+    def test_object_healpix(self):
+        self.session.query(Object).bulk_insert(
+            [{"oid": "new", "meanra": 10.0, "meandec": -20.0}]
+        )
+        instance = self.session.query(Object).find_one({"oid": "new"})
+        self.assertEqual(
+            instance.healpix, healpix.ang2pix(healpix.HEALPIX_ORDER, 10.0, -20.0)
+        )
+        self.assertIsNone(self.session.query(Object).find_one({"oid": "oid1"}).healpix)
+
+    def test_object_healpix_is_updated(self):
+        instance = self.session.query(Object).find_one({"oid": "oid1"})
+        self.session.query().update(instance, {"meanra": 10.0, "meandec": -20.0})
+        self.session.commit()
+        pixel = healpix.ang2pix(healpix.HEALPIX_ORDER, 10.0, -20.0)
+        self.assertEqual(instance.healpix, pixel)
+        self.session.query().update(instance, {"ndet": 2})
+        self.session.commit()
+        self.session.expire_all()
+        instance = self.session.query(Object).find_one({"oid": "oid1"})
+        self.assertEqual(instance.healpix, pixel)
+        self.session.query().update(instance, {"meandec": 30.0})
+        self.session.commit()
+        self.assertEqual(
+            instance.healpix, healpix.ang2pix(healpix.HEALPIX_ORDER, 10.0, 30.0)
+        )
+
+    def test_offset_pagination(self):
+        query = self.session.query(Object).order_by(Object.oid)
+        paginate = query.paginate(page=1, per_page=2)
+        self.assertEqual(paginate.total, 5)
+        self.assertEqual([o.oid for o in paginate.items], ["oid0", "oid1"])
+        paginate = paginate.next().next()
+        self.assertEqual([o.oid for o in paginate.items], ["oid4"])
+        self.assertFalse(paginate.has_next)
+        self.assertIsNone(paginate.next_cursor)
+
+    def test_offset_pagination_without_counting(self):
+        paginate = self.session.query(Object).paginate(page=2, per_page=2, count=False)
+        self.assertIsInstance(paginate, PaginationNoCount)
+        self.assertIsNone(paginate.total)
+        self.assertTrue(paginate.has_next)
+        paginate = self.session.query(Object).paginate(page=3, per_page=2, count=False)
+        self.assertFalse(paginate.has_next)
+
+    def test_keyset_pagination(self):
+        pages, cursor = [], None
+        while True:
+            paginate = self.session.query(Object).paginate(
+                per_page=2,
+                count=False,
+                sort_by=Object.firstmjd,
+                sort_direction=DESCENDING,
+                cursor=cursor,
+            )
+            pages.append([o.oid for o in paginate.items])
+            if not paginate.has_next:
+                self.assertIsNone(paginate.next_cursor)
+                break
+            cursor = paginate.next_cursor
+        self.assertEqual(pages, [["oid4", "oid0"], ["oid3", "oid2"], ["oid1"]])
+
+    def test_keyset_pagination_with_counting_and_filters(self):
+        query = self.session.query(Object).filter(Object.firstmjd > 1.0)
+        paginate = query.paginate(per_page=3, sort_by=Object.firstmjd)
+        self.assertEqual(paginate.total, 4)
+        self.assertEqual([o.oid for o in paginate.items], ["oid2", "oid3", "oid0"])
+        paginate = query.paginate(
+            per_page=3, sort_by=Object.firstmjd, cursor=paginate.next_cursor
+        )
+        self.assertEqual([o.oid for o in paginate.items], ["oid4"])
+
+    def test_keyset_pagination_with_nulls(self):
+        self.session.add_all(
+            [Object(oid=f"null{i}", firstmjd=None, ndet=1) for i in range(3)]
+        )
+        self.session.commit()
+        for sort_direction, expected in [
+            (1, ["oid1", "oid2", "oid3", "oid0", "oid4", "null0", "null1", "null2"]),
+            (-1, ["null2", "null1", "null0", "oid4", "oid0", "oid3", "oid2", "oid1"]),
+        ]:
+            for per_page in range(1, 5):
+                oids, cursor = [], None
+                while True:
+                    paginate = self.session.query(Object).paginate(
+                        per_page=per_page,
+                        count=False,
+                        sort_by="firstmjd",
+                        sort_direction=sort_direction,
+                        cursor=cursor,
+                    )
+                    oids.extend(o.oid for o in paginate.items)
+                    if not paginate.has_next:
+                        break
+                    cursor = paginate.next_cursor
+                self.assertEqual(oids, expected)
+
+    def test_keyset_pagination_uses_index_ranges(self):
+        self.session.add(Object(oid="null", firstmjd=None, ndet=1))
+        self.session.commit()
+        with mock.patch.object(
+            SQLQuery, "all", autospec=True, side_effect=SQLQuery.all
+        ) as all_:
+            for sort_direction in (1, -1):
+                cursor = None
+                while True:
+                    paginate = self.session.query(Object).paginate(
+                        per_page=2,
+                        count=False,
+                        sort_by="firstmjd",
+                        sort_direction=sort_direction,
+                        cursor=cursor,
+                    )
+                    if not paginate.has_next:
+                        break
+                    cursor = paginate.next_cursor
+        for call in all_.call_args_list:
+            statement = str(call.args[0])
+            self.assertNotIn(" OR ", statement)
+            self.assertRegex(statement, r"firstmjd (NULLS LAST|DESC NULLS FIRST), ")
+
+    def test_keyset_pagination_with_composite_primary_key(self):
+        self.session.add_all(
+            [
+                MagStats(
+                    oid="oid1",
+                    fid=fid,
+                    stellar=False,
+                    corrected=False,
+                    ndet=1,
+                    ndubious=0,
+                    step_id_corr="step",
+                    lastmjd=1.0,
+                )
+                for fid in range(3)
+            ]
+        )
+        self.session.commit()
+        paginate = self.session.query(MagStats).paginate(
+            per_page=2, count=False, sort_by="lastmjd"
+        )
+        paginate = self.session.query(MagStats).paginate(
+            per_page=2,
+            count=False,
+            sort_by="lastmjd",
+            cursor=paginate.next_cursor,
+        )
+        self.assertEqual([m.fid for m in paginate.items], [2])
+
+    def test_keyset_pagination_fails_with_invalid_cursor(self):
+        with self.assertRaisesRegex(ValueError, "Invalid pagination cursor"):
+            self.session.query(Object).paginate(sort_by=Object.ndet, cursor="e30=")
+        with self.assertRaisesRegex(ValueError, "only be used with 'sort_by'"):
+            self.session.query(Object).paginate(cursor="e30=")
+
+    def test_pagination_with_estimated_count_falls_back_outside_postgres(self):
+        paginate = self.session.query(Object).paginate(count_strategy=EstimatedCount())
+        self.assertEqual(paginate.total, 5)
+
+    def _postgres_connection(self, plan):
+        connection = mock.Mock(dialect=postgresql.psycopg2.dialect())
+        connection.exec_driver_sql.return_value.scalar.side_effect = plan
+        return mock.patch.object(self.session, "connection", return_value=connection)
+
+    def test_estimated_count_with_in_filter(self):
+        query = self.session.query(Object).filter(Object.oid.in_(["oid1", "oid2"]))
+        plan = [[{"Plan": {"Plan Rows": 2}}]]
+        with self._postgres_connection(plan) as connection:
+            self.assertEqual(query.estimated_count(), 2)
+        sql, params = connection.return_value.exec_driver_sql.call_args.args
+        self.assertTrue(sql.startswith("EXPLAIN (FORMAT JSON) SELECT"))
+        self.assertIn("IN (%(oid_1_1)s, %(oid_1_2)s)", sql)
+        self.assertNotIn("POSTCOMPILE", sql)
+        self.assertEqual(params, {"oid_1_1": "oid1", "oid_1_2": "oid2"})
+
+    def test_estimated_count_failure_keeps_session(self):
+        self.session.add(Object(oid="new", firstmjd=10.0))
+        query = self.session.query(Object).filter(Object.firstmjd > 1.0)
+        error = OperationalError("EXPLAIN", {}, Exception("canceled"))
+        with self._postgres_connection(error):
+            self.assertIsNone(query.estimated_count())
+        self.session.commit()
+        self.assertEqual(self.session.query(Object).count(), 6)
+
+    def test_pagination_with_cached_count(self):
+        strategy = CachedCount()
+        query = self.session.query(Object).filter(Object.firstmjd > 1.0)
+        self.assertEqual(query.paginate(count_strategy=strategy).total, 4)
+        self.session.add(Object(oid="new", firstmjd=10.0))
+        self.session.commit()
+        query = self.session.query(Object).filter(Object.firstmjd > 1.0)
+        self.assertEqual(query.paginate(count_strategy=strategy).total, 4)
+        query = self.session.query(Object).filter(Object.firstmjd > 2.0)
+        self.assertEqual(query.paginate(count_strategy=strategy).total, 3)